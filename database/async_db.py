@@ -0,0 +1,352 @@
+from .db_connector import db_connection
+from . import catalog_store, fragment_store, inventory_db, member_db, query_planner, sales_db
+from . import reservations, shard_health, shard_routing, sku_index, supplier_cache
+from .product_rows import ProductBatch
+from bson.objectid import ObjectId
+from pymongo import AsyncMongoClient, ReturnDocument
+from pymongo.errors import DuplicateKeyError
+from datetime import datetime
+import asyncio
+
+# --- ASYNCIO DATABASE LAYER ---
+# Async versions of the inventory, member and sales functions, on PyMongo's
+# native async client. They share the sync modules' sharding rules and
+# pipelines, so results and side effects are the same; only the waiting
+# is different. Shard fan-out runs concurrently, each shard with a timeout.
+# Anything sync that can block (routing refreshes read MongoDB, the local
+# catalog is SQLite) runs in a worker thread, never on the event loop.
+NUM_INVENTORY_SHARDS = 3 # DB1, DB2, DB3
+SHARD_TIMEOUT_SECONDS = 5
+
+_client = None
+
+def get_client():
+    """ The shared AsyncMongoClient (created on first use, in the running loop) """
+    global _client
+    if _client is None:
+        _client = AsyncMongoClient(db_connection.connection_string)
+    return _client
+
+def _get_inventory_shard(shard_id):
+    return get_client()[f"DB{shard_id + 1}"]
+
+def _get_sales_db():
+    return get_client()["ShopSales"]
+
+async def close():
+    global _client
+    if _client is not None:
+        await _client.close()
+        _client = None
+
+async def _gather_shards(func, shard_ids, label, statuses=None):
+    """
+    Runs func(shard_id) for every shard concurrently. A shard that fails or
+    times out is reported and contributes None, like the sync scatter loops.
+    Outcomes feed the shard's circuit breaker; a shard whose circuit is open
+    is not called at all. 'statuses' (a dict) collects "ok", "unavailable"
+    or "error" per shard.
+    """
+    if statuses is None:
+        statuses = {}
+
+    async def run(shard_id):
+        if not shard_health.get_breaker(shard_id).allow():
+            print(f"Skipping {label} Shard DB{shard_id + 1}: circuit open")
+            statuses[shard_id] = "unavailable"
+            return None
+        try:
+            result = await asyncio.wait_for(func(shard_id), SHARD_TIMEOUT_SECONDS)
+            shard_health.record_success(shard_id)
+            statuses[shard_id] = "ok"
+            return result
+        except asyncio.TimeoutError:
+            print(f"Timed out {label} Shard DB{shard_id + 1} after {SHARD_TIMEOUT_SECONDS}s")
+            shard_health.record_failure(shard_id, "timeout")
+            statuses[shard_id] = "unavailable"
+        except shard_health.SHARD_DOWN_ERRORS as e:
+            print(f"Error {label} Shard DB{shard_id + 1}: {e}")
+            shard_health.record_failure(shard_id, e)
+            statuses[shard_id] = "unavailable"
+        except Exception as e:
+            print(f"Error {label} Shard DB{shard_id + 1}: {e}")
+            shard_health.record_success(shard_id) # The shard answered; the request itself was bad
+            statuses[shard_id] = "error"
+        return None
+    return await asyncio.gather(*(run(shard_id) for shard_id in shard_ids))
+
+
+# --- INVENTORY ---
+async def create_product_fragment(filters={}, max_staleness=catalog_store.CATALOG_MAX_STALENESS_SECONDS, compact=False,
+                                  session_id=None, with_status=False):
+    """ Async inventory_db.create_product_fragment: all shards queried at once """
+    async def query_shard(shard_id):
+        # Statistics may need a (sync) refresh, so plan off the event loop
+        plan = await asyncio.to_thread(query_planner.plan_fragment_query, filters, shard_id)
+        cursor = await _get_inventory_shard(shard_id)[plan["collection"]].aggregate(plan["pipeline"])
+        return await cursor.to_list()
+
+    def route_and_check_catalog():
+        shard_ids = [s for s in shard_routing.inventory_shard_ids(NUM_INVENTORY_SHARDS)
+                     if inventory_db._shard_matches_category(filters, s)]
+        return [(shard_id, catalog_store.is_fresh(shard_id, max_staleness)) for shard_id in shard_ids]
+
+    shard_status = {}
+    all_fragment_docs = []
+    remote_shard_ids = []
+    for shard_id, fresh in await asyncio.to_thread(route_and_check_catalog):
+        if fresh:
+            shard_docs = await asyncio.to_thread(catalog_store.search, filters, shard_id)
+            print(f"Found {len(shard_docs)} products for Shard DB{shard_id + 1} (local catalog)")
+            all_fragment_docs.extend(shard_docs)
+            shard_status[shard_id] = "local"
+        else:
+            remote_shard_ids.append(shard_id)
+
+    results = await _gather_shards(query_shard, remote_shard_ids, "querying", shard_status)
+    for shard_id, shard_docs in zip(remote_shard_ids, results):
+        if shard_docs is not None:
+            print(f"Found {len(shard_docs)} products for Shard DB{shard_id + 1}")
+            all_fragment_docs.extend(shard_docs)
+        elif shard_status[shard_id] == "unavailable" and await asyncio.to_thread(catalog_store.is_fresh, shard_id, None):
+            # Degrade to whatever local snapshot we have, however old
+            shard_docs = await asyncio.to_thread(catalog_store.search, filters, shard_id)
+            print(f"Shard DB{shard_id + 1} is unavailable; using {len(shard_docs)} products from the local catalog")
+            all_fragment_docs.extend(shard_docs)
+            shard_status[shard_id] = "stale"
+
+    if fragment_store.FRAGMENT_WRITE_MODE == "sync":
+        await asyncio.to_thread(fragment_store.save_fragment, all_fragment_docs, filters, session_id)
+    else:
+        fragment_store.save_fragment(all_fragment_docs, filters, session_id) # Queued, returns at once
+    results = ProductBatch.from_docs(all_fragment_docs) if compact else all_fragment_docs
+    if with_status:
+        degraded = any(status not in ("ok", "local") for status in shard_status.values())
+        return results, {"degraded": degraded, "shards": shard_status}
+    return results
+
+
+async def _get_or_create_supplier(shard_id, supplier_name):
+    """ Cache hits stay on the loop; misses use the sync cache in a thread """
+    supplier = supplier_cache.cached_supplier(shard_id, supplier_name)
+    if supplier is not None:
+        return supplier
+    return await asyncio.to_thread(supplier_cache.get_or_create_supplier, shard_id, supplier_name)
+
+async def _get_product_by_name_and_supplier(name, supplier_id, products_coll):
+    return await products_coll.find_one({
+        "name": {"$regex": f"^{name}$", "$options": "i"},
+        "supplier_id": supplier_id
+    })
+
+async def add_product(name, price, category, supplier_name, initial_stock, sku=None):
+    """ Async inventory_db.add_product """
+    shard_id = await asyncio.to_thread(inventory_db._get_shard_id_for_category, category)
+    db_shard = _get_inventory_shard(shard_id)
+    products_coll, stock_coll = db_shard["products"], db_shard["stock"]
+    print(f"Adding product to Shard DB{shard_id + 1} (Category: {category})")
+
+    if sku:
+        sku = sku_index.normalize_sku(sku)
+        if await asyncio.to_thread(sku_index.lookup_sku, sku):
+            print(f"Error: SKU '{sku}' is already used by another product.")
+            return None
+        await asyncio.to_thread(sku_index.ensure_index, shard_id)
+
+    supplier_id, stored_supplier_name = await _get_or_create_supplier(shard_id, supplier_name)
+
+    if await _get_product_by_name_and_supplier(name, supplier_id, products_coll):
+        print(f"Error: Product '{name}' from '{supplier_name}' already exists on Shard DB{shard_id + 1}.")
+        return None
+
+    product_doc = {
+        "name": name, "price": price, "category": category,
+        "supplier_id": supplier_id, "created_at": datetime.utcnow()
+    }
+    if sku:
+        product_doc["sku"] = sku
+    try:
+        product_id = (await products_coll.insert_one(product_doc)).inserted_id
+    except DuplicateKeyError:
+        print(f"Error: SKU '{sku}' is already used on Shard DB{shard_id + 1}.")
+        return None
+    stock_doc = {
+        "product_id": product_id, "product_name": name,
+        "quantity": initial_stock, "location": "main_warehouse",
+        "last_updated": datetime.utcnow()
+    }
+    await stock_coll.insert_one(stock_doc)
+
+    def remember():
+        inventory_db._write_through_catalog(shard_id, products=[product_doc], stock=[stock_doc],
+                                            suppliers=[{"_id": supplier_id, "name": stored_supplier_name}])
+        sku_index.remember_product(shard_id, product_doc, stored_supplier_name)
+    await asyncio.to_thread(remember)
+    return str(product_id)
+
+async def add_stock_to_product(product_name, supplier_name, category, amount_to_add):
+    """ Async inventory_db.add_stock_to_product """
+    shard_id = await asyncio.to_thread(inventory_db._get_shard_id_for_category, category)
+    db_shard = _get_inventory_shard(shard_id)
+
+    supplier = supplier_cache.cached_supplier(shard_id, supplier_name)
+    if supplier is None:
+        supplier = await asyncio.to_thread(supplier_cache.find_supplier, shard_id, supplier_name)
+    if not supplier:
+        print(f"Error: Supplier '{supplier_name}' not found on Shard DB{shard_id + 1}.")
+        return None
+    product = await _get_product_by_name_and_supplier(product_name, supplier[0], db_shard["products"])
+    if not product:
+        print(f"Error: Product '{product_name}' from '{supplier_name}' not found on Shard DB{shard_id + 1}.")
+        return None
+
+    update_result = await db_shard["stock"].find_one_and_update(
+        {"product_id": product["_id"]},
+        {"$inc": {"quantity": amount_to_add}, "$set": {"last_updated": datetime.utcnow()}},
+        return_document=ReturnDocument.AFTER
+    )
+    if update_result:
+        await asyncio.to_thread(inventory_db._write_through_catalog, shard_id, stock=[update_result])
+    return update_result
+
+
+# --- MEMBERS ---
+async def add_member(name, phone, email):
+    """ Async member_db.add_member """
+    shard_id = member_db._get_shard_id_for_email(email)
+    members_coll = _get_inventory_shard(shard_id)["members"]
+    if await members_coll.find_one({"$or": [{"phone": phone}, {"email": email}]}):
+        print(f"Member with phone {phone} or email {email} already exists on shard {shard_id}")
+        return None
+    member_doc = {"name": name, "phone": phone, "email": email, "points": 0, "created_at": datetime.utcnow()}
+    try:
+        return str((await members_coll.insert_one(member_doc)).inserted_id)
+    except Exception as e:
+        print(f"Error inserting member: {e}")
+        return None
+
+async def find_member_by_phone(phone):
+    """
+    Async member_db.find_member_by_phone: all shards are asked at once and,
+    like the sync loop, the lowest shard with a match wins.
+    """
+    async def find_on_shard(shard_id):
+        return await _get_inventory_shard(shard_id)["members"].find_one({"phone": phone})
+
+    results = await _gather_shards(find_on_shard, range(NUM_INVENTORY_SHARDS), "searching members on")
+    for shard_id, member_doc in enumerate(results):
+        if member_doc:
+            member_doc["_id"] = str(member_doc["_id"])
+            return {"doc": member_doc, "shard_id": shard_id}
+    print("Member not found on any shard.")
+    return None
+
+
+# --- SALES ---
+async def _locate_product(product_id_obj, hint_shard_id, session=None):
+    """ Async sales_db._locate_product """
+    for shard_id in await asyncio.to_thread(sales_db._product_shard_candidates, hint_shard_id):
+        product = await _get_inventory_shard(shard_id)["products"].find_one({"_id": product_id_obj}, session=session)
+        if not product:
+            continue
+        routed_shard_id = await asyncio.to_thread(shard_routing.get_route, product.get("category"))
+        if routed_shard_id is not None and routed_shard_id != shard_id:
+            moved = await _get_inventory_shard(routed_shard_id)["products"].find_one(
+                {"_id": product_id_obj}, session=session
+            )
+            if moved:
+                return routed_shard_id, moved
+        return shard_id, product
+    raise ValueError(f"Product ID {product_id_obj} not found on Shard DB{hint_shard_id + 1}.")
+
+async def record_sale(member_info, items_sold, discount_applied=0, till_id=None, cart_id=None):
+    """ Async sales_db.record_sale: same steps, in one multi-shard transaction """
+    if not items_sold:
+        raise ValueError("Cannot record a sale with no items.")
+
+    needed_shards = {item["shard_id"] for item in items_sold}
+    if member_info:
+        needed_shards.add(member_info['shard_id'])
+    for shard_id in sorted(needed_shards):
+        if not shard_health.is_available(shard_id):
+            raise shard_health.ShardUnavailable(shard_id)
+
+    client = get_client()
+    sold_items_coll = _get_sales_db()["Sold_Items"]
+    try:
+        transaction_id, timestamp, transaction_shard_id, partition = await asyncio.to_thread(
+            sales_db._new_transaction_location
+        )
+        async with client.start_session() as session:
+            async with await session.start_transaction():
+                subtotal = 0
+                permanent_item_docs = []
+                updated_stock = []
+
+                for item in items_sold:
+                    quantity_sold = item["quantity"]
+                    product_id_obj = ObjectId(item["product_id"])
+                    inventory_shard_id, product = await _locate_product(product_id_obj, item["shard_id"], session)
+                    db_shard = _get_inventory_shard(inventory_shard_id)
+                    price = sales_db._sale_price(item, product)
+                    category = product.get("category", "UncategorIZED").strip() or "Uncategorized"
+                    subtotal += price * quantity_sold
+
+                    held = await reservations.take_hold_async(db_shard, cart_id, product_id_obj, session)
+                    stock_filter, stock_update = sales_db._stock_decrement(
+                        product_id_obj, quantity_sold, held, item.get("price_version")
+                    )
+                    stock_doc = await db_shard["stock"].find_one_and_update(
+                        stock_filter, stock_update, return_document=ReturnDocument.AFTER, session=session
+                    )
+                    if stock_doc is None:
+                        current_stock = await db_shard["stock"].find_one({"product_id": product_id_obj}, session=session)
+                        raise sales_db._stock_failure(product, current_stock, item, inventory_shard_id)
+                    updated_stock.append((inventory_shard_id, stock_doc))
+
+                    update_result = await sold_items_coll.update_one(
+                        {"category": category, "products_sold.name": product["name"]},
+                        {"$inc": {"Total_Sold_in_Category": quantity_sold, "products_sold.$.quantity_sold": quantity_sold}},
+                        session=session
+                    )
+                    if update_result.matched_count == 0:
+                        await sold_items_coll.update_one(
+                            {"category": category},
+                            {"$inc": {"Total_Sold_in_Category": quantity_sold},
+                             "$push": {"products_sold": {"name": product["name"], "quantity_sold": quantity_sold}}},
+                            upsert=True, session=session
+                        )
+
+                    permanent_item_docs.append({
+                        "product_id": product_id_obj, "inventory_shard_id": inventory_shard_id,
+                        "name": product["name"], "category": category,
+                        "price_at_sale": price, "quantity_sold": quantity_sold
+                    })
+
+                final_total = subtotal - discount_applied
+                member_id = ObjectId(member_info['doc']['_id']) if member_info else None
+                transaction_doc = sales_db._build_transaction_doc(
+                    transaction_id, timestamp, subtotal, discount_applied, member_id, permanent_item_docs, till_id
+                )
+                transactions_coll = _get_inventory_shard(transaction_shard_id)[partition]
+                trans_result = await transactions_coll.insert_one(transaction_doc, session=session)
+
+                if member_info:
+                    member_coll = _get_inventory_shard(member_info['shard_id'])["members"]
+                    await member_coll.update_one(
+                        {"_id": member_id}, {"$inc": {"points": int(final_total)}}, session=session
+                    )
+
+                transaction_id = str(trans_result.inserted_id)
+
+    except ValueError as e:
+        # Out of stock, price changed...: the cashier needs to see why
+        print(f"Transaction aborted: {e}")
+        raise
+    except Exception as e:
+        print(f"Transaction aborted: {e}")
+        return None
+
+    for shard_id, stock_doc in updated_stock:
+        await asyncio.to_thread(inventory_db._write_through_catalog, shard_id, stock=[stock_doc])
+    return transaction_id
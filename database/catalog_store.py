@@ -0,0 +1,346 @@
+from .db_connector import db_connection
+from . import shard_routing
+from bson.objectid import ObjectId
+from datetime import datetime, timezone
+from functools import lru_cache
+import sqlite3
+import threading
+import time
+import os
+import re
+
+# --- LOCAL CATALOG SNAPSHOT ---
+# Each till keeps a SQLite copy of products, suppliers and stock for every
+# inventory shard. It is synced incrementally using the 'updated_at' (or
+# 'created_at') of products and 'last_updated' of stock as watermarks, so
+# searches can be answered locally and the product list survives a
+# restart. stock_watcher keeps it fresh while the app runs.
+# Rows are keyed by (shard_id, _id): a migrated category's products exist
+# on both shards until the source copies are purged.
+NUM_INVENTORY_SHARDS = 3 # DB1, DB2, DB3
+CATALOG_DB_PATH = os.getenv("CATALOG_DB_PATH", "catalog_cache.sqlite3")
+CATALOG_MAX_STALENESS_SECONDS = 30 # Older than this -> query the shards
+SCHEMA_VERSION = 2 # Bump when the tables change: older snapshots are rebuilt
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS products (
+    product_id TEXT NOT NULL, shard_id INTEGER NOT NULL,
+    name TEXT, price REAL, category TEXT, supplier_id TEXT, created_at TEXT,
+    price_version INTEGER DEFAULT 0,
+    PRIMARY KEY (shard_id, product_id)
+);
+CREATE INDEX IF NOT EXISTS idx_products_shard ON products (shard_id, category);
+CREATE TABLE IF NOT EXISTS suppliers (
+    supplier_id TEXT NOT NULL, shard_id INTEGER NOT NULL, name TEXT,
+    PRIMARY KEY (shard_id, supplier_id)
+);
+CREATE TABLE IF NOT EXISTS stock (
+    product_id TEXT NOT NULL, shard_id INTEGER NOT NULL,
+    quantity INTEGER, last_updated TEXT,
+    PRIMARY KEY (shard_id, product_id)
+);
+CREATE TABLE IF NOT EXISTS sync_state (
+    shard_id INTEGER NOT NULL, collection TEXT NOT NULL,
+    watermark TEXT, synced_at REAL,
+    PRIMARY KEY (shard_id, collection)
+);
+CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT);
+"""
+
+_lock = threading.RLock()
+_conn = None
+
+
+@lru_cache(maxsize=256)
+def _compile_regex(pattern):
+    return re.compile(pattern, re.IGNORECASE)
+
+def _regexp(pattern, value):
+    """ SQLite REGEXP: case-insensitive search, like the shard '$regex' filters """
+    return value is not None and _compile_regex(pattern).search(value) is not None
+
+def _get_conn():
+    """ Opens (once) the local catalog database and creates the schema """
+    global _conn
+    with _lock:
+        if _conn is None:
+            conn = sqlite3.connect(CATALOG_DB_PATH, check_same_thread=False)
+            conn.row_factory = sqlite3.Row
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.create_function("REGEXP", 2, _regexp, deterministic=True)
+            _drop_if_outdated(conn)
+            conn.executescript(_SCHEMA)
+            conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('schema_version', ?)", (str(SCHEMA_VERSION),))
+            conn.commit()
+            _conn = conn
+        return _conn
+
+def _drop_if_outdated(conn):
+    """ A snapshot from an older schema is dropped; the next sync rebuilds it """
+    conn.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)")
+    row = conn.execute("SELECT value FROM meta WHERE key = 'schema_version'").fetchone()
+    if row is not None and int(row["value"]) >= SCHEMA_VERSION:
+        return
+    with conn:
+        for table in ("products", "stock", "suppliers", "sync_state"):
+            conn.execute(f"DROP TABLE IF EXISTS {table}")
+        conn.execute("DELETE FROM meta WHERE key = 'routing_version'")
+
+def _product_mark(doc):
+    """ A product's sync watermark: when it last changed (price changes set updated_at) """
+    return doc.get("updated_at") or doc.get("created_at")
+
+def to_price(value):
+    """ Same conversion as the shard pipeline: numbers as-is, else double or 0 """
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return 0.0
+
+def _iso(value):
+    return value.isoformat() if isinstance(value, datetime) else None
+
+
+# --- SYNC STATE ---
+def _get_watermark(shard_id, collection):
+    with _lock:
+        row = _get_conn().execute(
+            "SELECT watermark FROM sync_state WHERE shard_id = ? AND collection = ?",
+            (shard_id, collection)
+        ).fetchone()
+    if row is None or row["watermark"] is None:
+        return None
+    return datetime.fromisoformat(row["watermark"])
+
+def _set_synced(conn, shard_id, collection, watermark):
+    conn.execute(
+        "INSERT INTO sync_state (shard_id, collection, watermark, synced_at) VALUES (?, ?, ?, ?) "
+        "ON CONFLICT (shard_id, collection) DO UPDATE SET "
+        "watermark = NULLIF(MAX(COALESCE(excluded.watermark, ''), COALESCE(sync_state.watermark, '')), ''), "
+        "synced_at = excluded.synced_at",
+        (shard_id, collection, _iso(watermark), time.time())
+    )
+
+def last_synced_at(shard_id):
+    """ Time (epoch seconds) of the last complete sync of a shard, or None """
+    with _lock:
+        row = _get_conn().execute(
+            "SELECT COUNT(*) AS n, MIN(synced_at) AS synced_at FROM sync_state WHERE shard_id = ?",
+            (shard_id,)
+        ).fetchone()
+    if row["n"] < 2: # Both products and stock must have synced at least once
+        return None
+    return row["synced_at"]
+
+def is_fresh(shard_id, max_staleness=CATALOG_MAX_STALENESS_SECONDS):
+    """
+    True if the local snapshot of 'shard_id' can answer searches.
+    max_staleness=None accepts any snapshot that exists (e.g. at startup).
+    """
+    try:
+        synced_at = last_synced_at(shard_id)
+    except sqlite3.Error as e:
+        print(f"Local catalog unavailable: {e}")
+        return False
+    if synced_at is None:
+        return False
+    return max_staleness is None or time.time() - synced_at <= max_staleness
+
+
+# --- APPLYING CHANGES ---
+def _write_rows(sql, rows, conn):
+    """ Runs an upsert; commits on its own unless given a caller's connection """
+    if conn is not None:
+        conn.executemany(sql, rows)
+        return
+    with _lock:
+        conn = _get_conn()
+        with conn:
+            conn.executemany(sql, rows)
+
+def upsert_products(shard_id, product_docs, conn=None):
+    """ Writes product documents from 'shard_id' into the snapshot """
+    _write_rows(
+        "INSERT OR REPLACE INTO products "
+        "(product_id, shard_id, name, price, category, supplier_id, created_at, price_version) "
+        "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+        [(str(doc["_id"]), shard_id, doc.get("name"), to_price(doc.get("price")), doc.get("category"),
+          str(doc["supplier_id"]) if doc.get("supplier_id") is not None else None,
+          _iso(doc.get("created_at")), doc.get("price_version", 0)) for doc in product_docs],
+        conn
+    )
+
+def upsert_suppliers(shard_id, supplier_docs, conn=None):
+    """ Writes supplier documents from 'shard_id' into the snapshot """
+    _write_rows(
+        "INSERT OR REPLACE INTO suppliers (supplier_id, shard_id, name) VALUES (?, ?, ?)",
+        [(str(doc["_id"]), shard_id, doc.get("name")) for doc in supplier_docs],
+        conn
+    )
+
+def upsert_stock(shard_id, stock_docs, conn=None):
+    """ Writes stock documents from 'shard_id' into the snapshot """
+    _write_rows(
+        "INSERT OR REPLACE INTO stock (product_id, shard_id, quantity, last_updated) VALUES (?, ?, ?, ?)",
+        [(str(doc["product_id"]), shard_id, doc.get("quantity", 0), _iso(doc.get("last_updated")))
+         for doc in stock_docs],
+        conn
+    )
+
+def missing_supplier_ids(shard_id):
+    """ Supplier ids referenced by local products of a shard but not known locally """
+    with _lock:
+        rows = _get_conn().execute(
+            "SELECT DISTINCT p.supplier_id FROM products p "
+            "LEFT JOIN suppliers s ON s.shard_id = p.shard_id AND s.supplier_id = p.supplier_id "
+            "WHERE p.shard_id = ? AND p.supplier_id IS NOT NULL AND s.supplier_id IS NULL",
+            (shard_id,)
+        ).fetchall()
+    return [ObjectId(row["supplier_id"]) for row in rows]
+
+def apply_changes(shard_id, products=(), stock=(), suppliers=()):
+    """
+    Applies changed documents from a shard in one local transaction, moves
+    the sync watermarks forward and marks the shard as freshly synced.
+    """
+    product_wm = max((_product_mark(d) for d in products if _product_mark(d)), default=None)
+    stock_wm = max((d["last_updated"] for d in stock if d.get("last_updated")), default=None)
+    with _lock:
+        conn = _get_conn()
+        with conn:
+            upsert_suppliers(shard_id, suppliers, conn)
+            upsert_products(shard_id, products, conn)
+            upsert_stock(shard_id, stock, conn)
+            _set_synced(conn, shard_id, "products", product_wm)
+            _set_synced(conn, shard_id, "stock", stock_wm)
+
+def mark_synced(shard_id):
+    """ Marks a shard fresh without new data (e.g. an idle change stream) """
+    apply_changes(shard_id)
+
+def fetch_missing_suppliers(shard_id, db_shard):
+    """ Fetches suppliers that local products reference but the snapshot lacks """
+    missing = missing_supplier_ids(shard_id)
+    if not missing:
+        return []
+    supplier_docs = list(db_shard["suppliers"].find({"_id": {"$in": missing}}, {"name": 1}))
+    upsert_suppliers(shard_id, supplier_docs)
+    return supplier_docs
+
+
+def _reset_if_routing_changed():
+    """
+    Products copied to another shard keep their old 'created_at', so the
+    watermarks would never pick them up. When category routing changes, the
+    snapshot is dropped and rebuilt from scratch.
+    """
+    version = shard_routing.get_version()
+    with _lock:
+        conn = _get_conn()
+        row = conn.execute("SELECT value FROM meta WHERE key = 'routing_version'").fetchone()
+        if row is not None and row["value"] == version:
+            return
+        with conn:
+            if row is not None:
+                print("Shard routing changed; rebuilding the local catalog.")
+                for table in ("products", "stock", "suppliers", "sync_state"):
+                    conn.execute(f"DELETE FROM {table}")
+            conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('routing_version', ?)", (version,))
+
+def sync_shard(shard_id):
+    """
+    Incremental sync of one inventory shard into the local snapshot.
+    Only documents at or after the stored watermarks are fetched; suppliers
+    are fetched by id when a product references an unknown one.
+    Returns the (products, stock) documents that are new since the last sync.
+    """
+    db_shard = db_connection.get_inventory_shard(shard_id)
+    if db_shard is None:
+        raise ConnectionError(f"Fatal: Could not connect to inventory shard DB{shard_id + 1}")
+
+    _reset_if_routing_changed()
+    product_wm = _get_watermark(shard_id, "products")
+    stock_wm = _get_watermark(shard_id, "stock")
+
+    # '$gte' so documents sharing the watermark timestamp are never missed;
+    # re-applying them is harmless.
+    product_query = {"$or": [
+        {"created_at": {"$gte": product_wm}}, {"updated_at": {"$gte": product_wm}}
+    ]} if product_wm else {}
+    stock_query = {"last_updated": {"$gte": stock_wm}} if stock_wm else {}
+
+    product_docs = list(db_shard["products"].find(
+        product_query, {"name": 1, "price": 1, "category": 1, "supplier_id": 1, "sku": 1, "created_at": 1,
+                        "updated_at": 1, "price_version": 1}
+    ))
+    stock_docs = list(db_shard["stock"].find(
+        stock_query, {"product_id": 1, "quantity": 1, "last_updated": 1}
+    ))
+    supplier_docs = list(db_shard["suppliers"].find({}, {"name": 1})) if product_wm is None else []
+
+    apply_changes(shard_id, product_docs, stock_docs, supplier_docs)
+    fetch_missing_suppliers(shard_id, db_shard)
+
+    # Don't report the documents re-read at the old watermarks
+    new_products = [d for d in product_docs if product_wm is None or _product_mark(d) != product_wm]
+    new_stock = [d for d in stock_docs if stock_wm is None or d.get("last_updated") != stock_wm]
+    return new_products, new_stock
+
+def sync_all():
+    """ Incremental sync of every shard; errors on one shard don't stop the others """
+    for shard_id in shard_routing.inventory_shard_ids(NUM_INVENTORY_SHARDS):
+        try:
+            new_products, new_stock = sync_shard(shard_id)
+            if new_products or new_stock:
+                print(f"Catalog sync: {len(new_products)} products, {len(new_stock)} stock docs from Shard DB{shard_id + 1}")
+        except Exception as e:
+            print(f"Catalog sync failed for Shard DB{shard_id + 1}: {e}")
+
+
+# --- LOCAL SEARCH ---
+def search(filters, shard_id):
+    """
+    Answers a product search for one shard from the snapshot.
+    Same filters and same document shape as the shard pipeline in
+    inventory_db.create_product_fragment (only in-stock products).
+    """
+    where = ["p.shard_id = ?", "st.quantity > 0"]
+    params = [shard_id]
+    if filters.get("name"):
+        where.append("p.name REGEXP ?")
+        params.append(filters["name"])
+    if filters.get("category"):
+        where.append("lower(p.category) = lower(?)")
+        params.append(filters["category"])
+    else:
+        # Ignore leftover/in-flight copies of categories another shard serves
+        excluded = shard_routing.excluded_categories(shard_id)
+        if excluded:
+            where.append(f"p.category NOT IN ({', '.join('?' * len(excluded))})")
+            params.extend(excluded)
+    if filters.get("min_price"):
+        where.append("p.price >= ?")
+        params.append(filters["min_price"])
+    if filters.get("max_price"):
+        where.append("p.price <= ?")
+        params.append(filters["max_price"])
+    if filters.get("brand"):
+        where.append("s.name REGEXP ?")
+        params.append(filters["brand"])
+
+    query = (
+        "SELECT p.product_id, p.name, p.price, p.price_version, p.category, st.quantity, s.name AS supplier_name "
+        "FROM products p JOIN stock st ON st.shard_id = p.shard_id AND st.product_id = p.product_id "
+        "LEFT JOIN suppliers s ON s.shard_id = p.shard_id AND s.supplier_id = p.supplier_id "
+        f"WHERE {' AND '.join(where)}"
+    )
+    with _lock:
+        rows = _get_conn().execute(query, params).fetchall()
+
+    created_at = datetime.now(timezone.utc)
+    return [{
+        "_id": ObjectId(row["product_id"]), "name": row["name"], "price": row["price"],
+        "price_version": row["price_version"] or 0, "category": row["category"], "quantity_in_stock": row["quantity"],
+        "supplier_name": row["supplier_name"] if row["supplier_name"] is not None else "N/A",
+        "shard_id": shard_id, "createdAt": created_at
+    } for row in rows]
@@ -8,12 +8,16 @@ class DBConnection:
         self.connection_string = os.getenv("MONGODB_CONNECTION_STRING")
         if not self.connection_string:
             raise ValueError("MONGODB_CONNECTION_STRING not found in .env file")
+        # Give up on an unreachable server after this long (the driver's default is 30s)
+        self.server_selection_timeout_ms = int(os.getenv("MONGODB_SERVER_SELECTION_TIMEOUT_MS", "5000"))
         self.client = None
         self.connect()
 
     def connect(self):
         try:
-            self.client = pymongo.MongoClient(self.connection_string)
+            self.client = pymongo.MongoClient(
+                self.connection_string, serverSelectionTimeoutMS=self.server_selection_timeout_ms
+            )
             self.client.admin.command('ismaster')
             print("Successfully connected to MongoDB.")
         except pymongo.errors.ConnectionFailure as e:
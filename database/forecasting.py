@@ -0,0 +1,201 @@
+from .db_connector import db_connection
+from . import shard_routing, transaction_store
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+from bson.objectid import ObjectId
+import numpy as np
+import argparse
+import timeit
+
+# --- STOCK DEPLETION FORECAST ---
+# Loads the last HISTORY_DAYS of sales (per product and day, aggregated on
+# the transaction shards) and every product's current stock into NumPy
+# arrays, then computes for all products at once:
+#   velocity       units/day, the higher of the short and long moving average
+#   days_of_cover  stock / velocity (inf for products that do not sell)
+#   reorder_qty    units to get back to TARGET_COVER_DAYS
+# Sold_Items has no dates, so it only supplies each product's lifetime total.
+#
+#   python -m database.forecasting --limit 30
+NUM_INVENTORY_SHARDS = 3 # DB1, DB2, DB3
+HISTORY_DAYS = 28
+SHORT_WINDOW_DAYS = 7
+LEAD_TIME_DAYS = 3 # Supplier delivery time
+SAFETY_DAYS = 2 # Extra cover on top of the lead time
+TARGET_COVER_DAYS = 14 # A reorder should last this long
+LOW_STOCK_DAYS = LEAD_TIME_DAYS + SAFETY_DAYS # Below this, reorder now
+MAX_PARALLEL_QUERIES = 8
+
+_DAY_MS = 24 * 60 * 60 * 1000
+
+
+def _get_shard(shard_id):
+    db_shard = db_connection.get_inventory_shard(shard_id)
+    if db_shard is None:
+        raise ConnectionError(f"Fatal: Could not connect to inventory shard DB{shard_id + 1}")
+    return db_shard
+
+def _id_bytes(object_ids):
+    """ ObjectIds as a fixed-width bytes array, so NumPy can sort and match them """
+    return np.array([ObjectId(oid).binary for oid in object_ids], dtype="S12")
+
+
+# --- LOADING ---
+def _daily_sales(shard_id, name, start):
+    """ [(product_id, day index, units)] from one transaction collection """
+    pipeline = [
+        {"$match": {"timestamp": {"$gte": start}}},
+        {"$unwind": "$items"},
+        {"$group": {
+            "_id": {
+                "product_id": "$items.product_id",
+                "day": {"$floor": {"$divide": [{"$subtract": ["$timestamp", start]}, _DAY_MS]}}
+            },
+            "units": {"$sum": "$items.quantity_sold"}
+        }},
+    ]
+    coll = transaction_store.get_collection(shard_id, name)
+    return [(doc["_id"]["product_id"], int(doc["_id"]["day"]), doc["units"]) for doc in coll.aggregate(pipeline)]
+
+def load_history(days=HISTORY_DAYS, now=None):
+    """
+    Sales per product and day over the last 'days' days.
+    Returns (product_ids S12 array, day indexes, units); day 0 is the oldest.
+    """
+    now = now or datetime.now(timezone.utc)
+    start = now - timedelta(days=days)
+    locations = transaction_store.hot_collections(start, now)
+    entries = []
+    with ThreadPoolExecutor(max_workers=max(1, min(MAX_PARALLEL_QUERIES, len(locations)))) as pool:
+        futures = [(pool.submit(_daily_sales, shard_id, name, start), shard_id, name) for shard_id, name in locations]
+        for future, shard_id, name in futures:
+            try:
+                entries.extend(future.result())
+            except Exception as e:
+                print(f"Error loading sales history from {name} on Shard DB{shard_id + 1}: {e}")
+    if not entries:
+        return np.empty(0, dtype="S12"), np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float64)
+    product_ids, day_index, units = zip(*entries)
+    return _id_bytes(product_ids), np.array(day_index, dtype=np.int64), np.array(units, dtype=np.float64)
+
+def _shard_stock(shard_id):
+    db_shard = _get_shard(shard_id)
+    excluded = shard_routing.excluded_categories(shard_id)
+    products = list(db_shard["products"].find(
+        {"category": {"$nin": excluded}} if excluded else {}, {"name": 1, "category": 1}
+    ))
+    quantities = {doc["product_id"]: doc.get("quantity", 0)
+                  for doc in db_shard["stock"].find({}, {"product_id": 1, "quantity": 1})}
+    return [(doc["_id"], doc.get("name"), doc.get("category"), shard_id, quantities.get(doc["_id"], 0))
+            for doc in products]
+
+def load_stock():
+    """ Every product on every inventory shard with its current stock quantity """
+    shard_ids = shard_routing.inventory_shard_ids(NUM_INVENTORY_SHARDS)
+    rows = []
+    with ThreadPoolExecutor(max_workers=len(shard_ids)) as pool:
+        for shard_id, future in [(s, pool.submit(_shard_stock, s)) for s in shard_ids]:
+            try:
+                rows.extend(future.result())
+            except Exception as e:
+                print(f"Error loading stock from Shard DB{shard_id + 1}: {e}")
+    product_ids, names, categories, shard_id_list, quantities = zip(*rows) if rows else ((),) * 5
+    return {
+        "product_id": _id_bytes(product_ids),
+        "name": np.array(names, dtype=object),
+        "category": np.array(categories, dtype=object),
+        "shard_id": np.array(shard_id_list, dtype=np.int64),
+        "quantity": np.array(quantities, dtype=np.float64),
+    }
+
+def load_lifetime_sold():
+    """ {(category, product name): units} from the central Sold_Items fragment """
+    db_sales = db_connection.get_sales_db()
+    if db_sales is None:
+        raise ConnectionError("Fatal: Could not connect to ShopSales database")
+    lifetime = {}
+    for doc in db_sales["Sold_Items"].find({}, {"category": 1, "products_sold": 1}):
+        for entry in doc.get("products_sold", []):
+            lifetime[(doc.get("category"), entry.get("name"))] = entry.get("quantity_sold", 0)
+    return lifetime
+
+
+# --- FORECAST (vectorized) ---
+def forecast(stock, history, days=HISTORY_DAYS, short_window=SHORT_WINDOW_DAYS):
+    """
+    One pass over all products. 'stock' is load_stock(), 'history' is
+    load_history(). Returns the stock arrays plus velocity, days_of_cover,
+    reorder_qty, low_stock (bool) and 'order' (most urgent first).
+    """
+    count = len(stock["product_id"])
+    history_ids, day_index, units = history
+
+    # Match history rows to stock rows by product id (sort-based, no Python loop)
+    all_ids = np.concatenate([stock["product_id"], history_ids])
+    _, inverse = np.unique(all_ids, return_inverse=True)
+    row_of_id = np.full(inverse.max() + 1 if len(inverse) else 0, -1, dtype=np.int64)
+    row_of_id[inverse[:count]] = np.arange(count)
+    rows = row_of_id[inverse[count:]]
+    keep = (rows >= 0) & (day_index >= 0) & (day_index < days) # Sold products since deleted, clock skew
+
+    flat_index = rows[keep] * days + day_index[keep]
+    daily = np.bincount(flat_index, weights=units[keep], minlength=count * days).reshape(count, days)
+
+    long_avg = daily.mean(axis=1) if days else np.zeros(count)
+    short_avg = daily[:, -short_window:].mean(axis=1) if days else np.zeros(count)
+    velocity = np.maximum(short_avg, long_avg) # A recent surge or a steady seller, whichever is faster
+
+    quantity = np.maximum(stock["quantity"], 0)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        # Sold out is no cover at all, even if it sold nothing lately (because it was sold out)
+        days_of_cover = np.where(quantity == 0, 0.0, np.where(velocity > 0, quantity / velocity, np.inf))
+    reorder_qty = np.ceil(np.maximum(velocity * TARGET_COVER_DAYS - quantity, 0))
+    low_stock = days_of_cover < LOW_STOCK_DAYS
+
+    # Least cover first; among equal cover the faster seller first
+    order = np.lexsort((-velocity, days_of_cover))
+    return dict(stock, velocity=velocity, days_of_cover=days_of_cover,
+                reorder_qty=reorder_qty, low_stock=low_stock, order=order)
+
+def reorder_list(result, limit=50, lifetime_sold=None):
+    """ The most urgent products that need reordering, as plain dicts """
+    entries = []
+    for i in result["order"]:
+        if not result["low_stock"][i] or len(entries) >= limit:
+            break # 'order' is sorted by cover, so the rest are not low either
+        entry = {
+            "product_id": result["product_id"][i].hex(),
+            "name": result["name"][i], "category": result["category"][i],
+            "shard_id": int(result["shard_id"][i]),
+            "quantity": int(result["quantity"][i]),
+            "velocity": round(float(result["velocity"][i]), 2),
+            "days_of_cover": round(float(result["days_of_cover"][i]), 1),
+            "reorder_qty": int(result["reorder_qty"][i]),
+        }
+        if lifetime_sold is not None:
+            entry["lifetime_sold"] = lifetime_sold.get((entry["category"], entry["name"]), 0)
+        entries.append(entry)
+    return entries
+
+def get_low_stock(limit=50):
+    """ Loads, forecasts and returns {count, items}: all low-stock products and the top 'limit' """
+    result = forecast(load_stock(), load_history())
+    return {"count": int(result["low_stock"].sum()),
+            "items": reorder_list(result, limit, load_lifetime_sold())}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Products that will run out first")
+    parser.add_argument("--limit", type=int, default=50)
+    args = parser.parse_args()
+
+    started = timeit.default_timer()
+    stock, history = load_stock(), load_history()
+    loaded = timeit.default_timer()
+    result = forecast(stock, history)
+    computed = timeit.default_timer()
+    print(f"{len(stock['product_id'])} products, {len(history[0])} product-days loaded in {loaded - started:.2f}s; "
+          f"forecast in {(computed - loaded) * 1000:.1f}ms")
+    for entry in reorder_list(result, args.limit, load_lifetime_sold()):
+        print(f"{entry['name']} ({entry['category']}, DB{entry['shard_id'] + 1}): {entry['quantity']} left, "
+              f"{entry['velocity']}/day, {entry['days_of_cover']} days -> order {entry['reorder_qty']}")
@@ -0,0 +1,206 @@
+from .db_connector import db_connection
+from pymongo import UpdateOne
+from datetime import datetime, timedelta, timezone
+import pymongo
+import threading
+import hashlib
+import socket
+import uuid
+import json
+import time
+import os
+
+# --- FRAGMENT NAMESPACES ---
+# Search results are kept in ShopSales.FragementedData per (session, filter
+# hash), one document per product, so tills no longer wipe each other's
+# fragments. Saving a fragment only writes the difference from what that
+# namespace already holds: changed or new rows are upserted, vanished rows
+# deleted, unchanged rows left alone (a repeat search writes nothing).
+# Written rows get a new createdAt; the whole namespace's createdAt is
+# refreshed only as a keep-alive, once per half TTL. _touched holds the
+# time of the last full refresh, which the oldest row is never older
+# than, so a namespace not refreshed for the TTL (its rows expired or
+# about to) is forgotten here and written in full next time.
+# By default the write happens on a background thread, off the search path.
+#
+#   FRAGMENT_WRITE_MODE=async (default) | sync | off
+FRAGMENT_TTL_SECONDS = 300 # 5 minutes
+FRAGMENT_WRITE_MODE = os.getenv("FRAGMENT_WRITE_MODE", "async")
+# One per process; a backend service shares it between its tills (same filter -> same rows)
+SESSION_ID = os.getenv("FRAGMENT_SESSION_ID") or f"{socket.gethostname()}-{os.getpid()}-{uuid.uuid4().hex[:8]}"
+ROW_FIELDS = ["name", "price", "category", "quantity_in_stock", "supplier_name", "shard_id"]
+
+db_sales = db_connection.get_sales_db()
+if db_sales is None:
+     raise ConnectionError("Fatal: Could not connect to ShopSales database")
+fragment_coll = db_sales["FragementedData"]
+
+_indexes_created = False
+_written = {} # (session_id, filter_hash) -> {product_id: row_hash} last written
+_touched = {} # (session_id, filter_hash) -> time.time() of the last write (TTL refresh)
+_pending = {} # (session_id, filter_hash) -> docs waiting for the writer (latest wins)
+_pending_cond = threading.Condition()
+_in_flight = 0 # Writes taken off _pending but not finished
+_write_lock = threading.Lock()
+_writer = None
+
+
+def _ensure_indexes():
+    global _indexes_created
+    if _indexes_created: return
+    try:
+        fragment_coll.create_index([("createdAt", pymongo.ASCENDING)], expireAfterSeconds=FRAGMENT_TTL_SECONDS)
+        fragment_coll.create_index(
+            [("session_id", pymongo.ASCENDING), ("filter_hash", pymongo.ASCENDING), ("product_id", pymongo.ASCENDING)],
+            unique=True
+        )
+        print(f"Ensured indexes on 'FragementedData'. Data expires in {FRAGMENT_TTL_SECONDS}s.")
+        _indexes_created = True
+    except pymongo.errors.OperationFailure as e:
+        # Rows from the old global layout (no session_id) break the unique index until they expire
+        print(f"Warning: Could not create FragementedData indexes: {e}")
+
+def filter_hash(filters):
+    """ Stable short hash of a search's filters """
+    encoded = json.dumps(filters or {}, sort_keys=True, default=str)
+    return hashlib.sha1(encoded.encode("utf-8")).hexdigest()[:16]
+
+def _row_hash(doc):
+    encoded = json.dumps([doc.get(field) for field in ROW_FIELDS], default=str)
+    return hashlib.sha1(encoded.encode("utf-8")).hexdigest()[:16]
+
+
+# --- DIFFED WRITE ---
+def _load_written(session_id, hash_key):
+    """ What a namespace holds, read back after a restart (rows due to expire count as unwritten) """
+    expires_before = datetime.now(timezone.utc) - timedelta(seconds=FRAGMENT_TTL_SECONDS)
+    written = {}
+    for doc in fragment_coll.find({"session_id": session_id, "filter_hash": hash_key},
+                                  {"product_id": 1, "row_hash": 1, "createdAt": 1}):
+        created_at = doc.get("createdAt")
+        if created_at is not None and created_at.tzinfo is None:
+            created_at = created_at.replace(tzinfo=timezone.utc)
+        fresh = created_at is not None and created_at > expires_before
+        written[doc["product_id"]] = doc.get("row_hash") if fresh else None
+    return written
+
+def _prune_expired(now):
+    """
+    Forgets namespaces not refreshed for the TTL: the TTL index has removed
+    (or is about to remove) their rows. Returns the forgotten namespaces.
+    Caller holds _write_lock.
+    """
+    expired = [namespace for namespace, touched in _touched.items() if now - touched >= FRAGMENT_TTL_SECONDS]
+    for namespace in expired:
+        _touched.pop(namespace, None)
+        _written.pop(namespace, None)
+    return expired
+
+def write_fragment(docs, session_id, hash_key):
+    """ Brings one namespace in line with 'docs'; returns (upserted, deleted) """
+    with _write_lock:
+        try:
+            return _write_fragment(docs, session_id, hash_key)
+        except Exception:
+            _written.pop((session_id, hash_key), None) # Unknown state: re-read it next time
+            raise
+
+def _write_fragment(docs, session_id, hash_key):
+    _ensure_indexes()
+    namespace = (session_id, hash_key)
+    namespace_query = {"session_id": session_id, "filter_hash": hash_key}
+    if namespace in _prune_expired(time.time()):
+        # Clear whatever the TTL monitor has not removed yet, then write it all again
+        fragment_coll.delete_many(namespace_query)
+        written = {}
+    else:
+        written = _written.get(namespace)
+        if written is None:
+            written = _load_written(session_id, hash_key)
+
+    now = datetime.now(timezone.utc)
+    current, ops = {}, []
+    for doc in docs:
+        product_id, row_hash = doc["_id"], _row_hash(doc)
+        current[product_id] = row_hash
+        if written.get(product_id) != row_hash:
+            row = {field: doc.get(field) for field in ROW_FIELDS}
+            row.update(row_hash=row_hash, createdAt=now)
+            ops.append(UpdateOne(
+                {"session_id": session_id, "filter_hash": hash_key, "product_id": product_id},
+                {"$set": row}, upsert=True
+            ))
+    removed = [product_id for product_id in written if product_id not in current]
+
+    if ops:
+        fragment_coll.bulk_write(ops, ordered=False)
+    if removed:
+        fragment_coll.delete_many({**namespace_query, "product_id": {"$in": removed}})
+    if ops and len(ops) == len(current):
+        _touched[namespace] = time.time() # Every row was just written
+    elif time.time() - _touched.get(namespace, 0) > FRAGMENT_TTL_SECONDS / 2:
+        # Keep-alive: unchanged rows must not expire under a namespace still in use
+        fragment_coll.update_many(namespace_query, {"$set": {"createdAt": now}})
+        _touched[namespace] = time.time()
+    _written[namespace] = current
+    return len(ops), len(removed)
+
+
+# --- BACKGROUND WRITER ---
+def _write_pending():
+    global _in_flight
+    while True:
+        with _pending_cond:
+            while not _pending:
+                _pending_cond.wait()
+            namespace, docs = _pending.popitem()
+            _in_flight += 1
+        try:
+            upserted, deleted = write_fragment(docs, *namespace)
+            if upserted or deleted:
+                print(f"Fragment {namespace[1]}: {upserted} rows written, {deleted} removed")
+        except Exception as e:
+            print(f"Error writing to FragementedData: {e}")
+        finally:
+            with _pending_cond:
+                _in_flight -= 1
+                _pending_cond.notify_all()
+
+def _start_writer():
+    global _writer
+    with _pending_cond:
+        if _writer is None or not _writer.is_alive():
+            _writer = threading.Thread(target=_write_pending, name="fragment-writer", daemon=True)
+            _writer.start()
+
+def save_fragment(docs, filters, session_id=None, mode=None):
+    """
+    Records a search's results under (session, filter hash).
+    mode "async" queues the write and returns at once, "sync" writes now,
+    "off" skips it. Defaults to FRAGMENT_WRITE_MODE.
+    """
+    mode = mode or FRAGMENT_WRITE_MODE
+    if mode == "off":
+        return
+    namespace = (session_id or SESSION_ID, filter_hash(filters))
+    if mode == "sync":
+        try:
+            write_fragment(docs, *namespace)
+        except Exception as e:
+            print(f"Error writing to FragementedData: {e}")
+        return
+    _start_writer()
+    with _pending_cond:
+        _pending[namespace] = list(docs) # A newer search for the same filters replaces a queued one
+        _pending_cond.notify_all()
+
+def flush(timeout=5):
+    """ Waits until queued fragment writes are done; False on timeout """
+    deadline = time.time() + timeout
+    with _pending_cond:
+        while _pending or _in_flight:
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                return False
+            _pending_cond.wait(remaining)
+    return True
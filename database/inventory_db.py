@@ -1,7 +1,10 @@
 from .db_connector import db_connection
+from . import catalog_store, fragment_store, query_planner, shard_health, shard_routing
+from . import sku_index, supplier_cache
+from .product_rows import ProductBatch
 from bson.objectid import ObjectId
 import pymongo
-from datetime import datetime, timezone
+from datetime import datetime
 import re
 
 # --- SHARDING CONFIGURATION ---
@@ -19,6 +22,10 @@ CATEGORY_HASH = {
 
 def _get_shard_id_for_category(category):
     """ Hash function: Category name -> Shard ID (0, 1, or 2) """
+    # A category being moved (or already moved) by shard_migration wins
+    routed_shard_id = shard_routing.get_route(category)
+    if routed_shard_id is not None:
+        return routed_shard_id
     # Default to "Uncategorized" hash value if not found or invalid
     hash_value = CATEGORY_HASH.get(category, 0) if category else 0
     shard_id = hash_value % NUM_INVENTORY_SHARDS
@@ -35,122 +42,85 @@ def _get_collections_for_shard(shard_id):
 # --- END SHARDING ---
 
 
-# Get sales DB (this is not sharded)
-db_sales = db_connection.get_sales_db()
-if db_sales is None:
-     raise ConnectionError("Fatal: Could not connect to ShopSales database")
-temp_fragment_coll = db_sales["FragementedData"]
-_temp_index_created = False
+def _shard_matches_category(filters, shard_id):
+    """ A category filter only applies to the shard that category hashes to """
+    category_filter = filters.get("category")
+    return not category_filter or _get_shard_id_for_category(category_filter) == shard_id
 
-def _ensure_temp_fragment_ttl():
-    global _temp_index_created
-    if _temp_index_created: return
-    try:
-        SECONDS_TO_LIVE = 300 # 5 minutes
-        temp_fragment_coll.create_index(
-            [("createdAt", pymongo.ASCENDING)],
-            expireAfterSeconds=SECONDS_TO_LIVE
-        )
-        print(f"Ensured TTL index on 'FragementedData'. Data expires in 300s.")
-        _temp_index_created = True
-    except pymongo.errors.OperationFailure as e:
-         # Ignore index already exists error, raise others
-        if "Index already exists" not in str(e):
-            print(f"Warning: Could not create TTL index (permissions?): {e}")
-    except Exception as e:
-        print(f"Error creating TTL index: {e}")
-
-
-def create_product_fragment(filters={}):
+def create_product_fragment(filters={}, max_staleness=catalog_store.CATALOG_MAX_STALENESS_SECONDS, compact=False,
+                            session_id=None, with_status=False):
     """
     Scatter-gather fragmentation: Queries ALL shards based on filters,
-    merges results, and saves to the temporary 'FragementedData'.
+    merges results, and saves them (in the background, as a diff) to this
+    session's namespace in the temporary 'FragementedData'.
     Includes Brand filter.
+    Shards whose local catalog snapshot is fresh enough (see catalog_store)
+    are answered locally; max_staleness=None accepts any local snapshot.
+    compact=True returns a column-oriented ProductBatch instead of dicts.
+    A shard that is down does not fail the search: its rows come from the
+    local catalog if there is one, otherwise they are left out.
+    with_status=True returns (results, {"degraded": bool, "shards": {shard_id: status}})
+    with status "ok", "local", "stale", "unavailable" or "error".
     """
-    _ensure_temp_fragment_ttl()
-
     all_fragment_docs = []
+    shard_status = {}
 
     # --- SCATTER PHASE ---
-    for shard_id in range(NUM_INVENTORY_SHARDS):
+    for shard_id in shard_routing.inventory_shard_ids(NUM_INVENTORY_SHARDS):
         print(f"Querying Shard DB{shard_id + 1}...")
         try:
-            products_coll, stock_coll, suppliers_coll = _get_collections_for_shard(shard_id)
-
-            # 1. Build initial product filter (non-price, non-brand)
-            match_query = {}
-            if filters.get("name"):
-                match_query["name"] = {"$regex": filters["name"], "$options": "i"}
             # Apply category filter ONLY if the category belongs to this shard
-            category_filter = filters.get("category")
-            if category_filter and _get_shard_id_for_category(category_filter) == shard_id:
-                 match_query["category"] = {"$regex": f"^{category_filter}$", "$options": "i"}
-            elif category_filter:
-                 print(f"Skipping category '{category_filter}' on shard {shard_id}")
+            if not _shard_matches_category(filters, shard_id):
+                 print(f"Skipping category '{filters['category']}' on shard {shard_id}")
                  continue # Skip this shard if category doesn't match
 
-            # Build price filter separately
-            price_match_query = {}
-            if filters.get("min_price"): price_match_query["$gte"] = filters["min_price"]
-            if filters.get("max_price"): price_match_query["$lte"] = filters["max_price"]
-
-            # 2. Build the aggregation pipeline for this shard
-            pipeline = [
-                {"$match": match_query},
-                {"$addFields": {"numericPrice": {"$cond": { "if": {"$isNumber": "$price"}, "then": "$price", "else": {"$convert": {"input": "$price", "to": "double", "onError": 0, "onNull": 0}}}}}},
-            ]
-            if price_match_query:
-                pipeline.append({"$match": {"numericPrice": price_match_query}})
-
-            pipeline.extend([
-                # Join with suppliers FIRST to filter by brand early
-                {"$lookup": {"from": "suppliers", "localField": "supplier_id", "foreignField": "_id", "as": "supplier_data"}},
-                {"$unwind": {"path": "$supplier_data", "preserveNullAndEmptyArrays": True}},
-            ])
-
-            # --- NEW: Add Brand filter ---
-            brand_filter = filters.get("brand")
-            if brand_filter:
-                pipeline.append({"$match": {"supplier_data.name": {"$regex": brand_filter, "$options": "i"}}})
-            # --- END NEW ---
-
-            pipeline.extend([
-                 # Join with stock
-                {"$lookup": {"from": "stock", "localField": "_id", "foreignField": "product_id", "as": "stock_data"}},
-                {"$unwind": "$stock_data"},
-                {"$match": {"stock_data.quantity": {"$gt": 0}}},
-                 # Project the final shape
-                {"$addFields": {"shard_id_field": shard_id}},
-                {"$project": {
-                    "_id": 1, "name": 1, "price": "$numericPrice", "category": 1,
-                    "quantity_in_stock": "$stock_data.quantity",
-                    "supplier_name": {"$ifNull": ["$supplier_data.name", "N/A"]},
-                    "shard_id": "$shard_id_field",
-                    "createdAt": datetime.now(timezone.utc)
-                }}
-            ])
-
-            # 3. Run the pipeline for this shard
-            shard_docs = list(products_coll.aggregate(pipeline))
+            # Serve from the local catalog snapshot when it is fresh enough
+            if catalog_store.is_fresh(shard_id, max_staleness):
+                shard_docs = catalog_store.search(filters, shard_id)
+                all_fragment_docs.extend(shard_docs)
+                shard_status[shard_id] = "local"
+                print(f"Found {len(shard_docs)} products for Shard DB{shard_id + 1} (local catalog)")
+                continue
+
+            # Run the pipeline the planner picked for this shard
+            with shard_health.guard(shard_id):
+                plan = query_planner.plan_fragment_query(filters, shard_id)
+                shard_docs = query_planner.run_plan(plan)
             all_fragment_docs.extend(shard_docs)
-            print(f"Found {len(shard_docs)} products on Shard DB{shard_id + 1}")
-
+            shard_status[shard_id] = "ok"
+            print(f"Found {len(shard_docs)} products on Shard DB{shard_id + 1} ({plan['strategy']})")
+
+        except shard_health.ShardUnavailable as e:
+            # Degrade to whatever local snapshot we have, however old
+            if catalog_store.is_fresh(shard_id, None):
+                shard_docs = catalog_store.search(filters, shard_id)
+                all_fragment_docs.extend(shard_docs)
+                shard_status[shard_id] = "stale"
+                print(f"{e}; using {len(shard_docs)} products from the local catalog")
+            else:
+                shard_status[shard_id] = "unavailable"
+                print(f"{e}; its products are missing from this search")
         except Exception as e:
+            shard_status[shard_id] = "error"
             print(f"Error querying Shard DB{shard_id + 1}: {e}")
 
     # --- GATHER PHASE ---
-    # 4. Clear and insert the merged results into the temporary fragment
-    print("Clearing old data from 'FragementedData'...")
-    try:
-        temp_fragment_coll.delete_many({})
-        if all_fragment_docs:
-            print(f"Inserting {len(all_fragment_docs)} total new docs into 'FragementedData'...")
-            temp_fragment_coll.insert_many(all_fragment_docs)
-    except Exception as e:
-        print(f"Error writing to FragementedData: {e}")
+    fragment_store.save_fragment(all_fragment_docs, filters, session_id)
 
+    results = ProductBatch.from_docs(all_fragment_docs) if compact else all_fragment_docs
+    if with_status:
+        degraded = any(status not in ("ok", "local") for status in shard_status.values())
+        return results, {"degraded": degraded, "shards": shard_status}
+    return results
 
-    return all_fragment_docs
+def _write_through_catalog(shard_id, products=(), stock=(), suppliers=()):
+    """ Applies our own writes to the local catalog so the next search sees them """
+    try:
+        catalog_store.upsert_suppliers(shard_id, suppliers)
+        catalog_store.upsert_products(shard_id, products)
+        catalog_store.upsert_stock(shard_id, stock)
+    except Exception as e:
+        print(f"Could not update local catalog: {e}")
 
 def _get_product_by_name_and_supplier(name, supplier_id, products_coll):
     """ Helper to find product on a specific shard's product collection """
@@ -159,8 +129,8 @@ def _get_product_by_name_and_supplier(name, supplier_id, products_coll):
         "supplier_id": supplier_id
     })
 
-def add_product(name, price, category, supplier_name, initial_stock):
-    """ Adds product to the correct inventory shard based on category """
+def add_product(name, price, category, supplier_name, initial_stock, sku=None):
+    """ Adds product to the correct inventory shard based on category (sku: optional barcode) """
 
     # 1. Determine the correct shard
     shard_id = _get_shard_id_for_category(category)
@@ -171,14 +141,16 @@ def add_product(name, price, category, supplier_name, initial_stock):
         print(e)
         return None # Cannot proceed if shard connection failed
 
-    # 2. Find or create supplier (on that shard)
-    supplier = suppliers_coll.find_one_and_update(
-        {"name": {"$regex": f"^{supplier_name}$", "$options": "i"}},
-        {"$setOnInsert": {"name": supplier_name, "contact_email": "default@supplier.com"}},
-        upsert=True,
-        return_document=pymongo.ReturnDocument.AFTER
-    )
-    supplier_id = supplier["_id"]
+    # Barcodes are unique per shard by index; across shards, checked here
+    if sku:
+        sku = sku_index.normalize_sku(sku)
+        if sku_index.lookup_sku(sku):
+            print(f"Error: SKU '{sku}' is already used by another product.")
+            return None
+        sku_index.ensure_index(shard_id)
+
+    # 2. Find or create supplier (on that shard) - cached by normalized name
+    supplier_id, stored_supplier_name = supplier_cache.get_or_create_supplier(shard_id, supplier_name)
 
     # 3. Check for duplicates (on that shard)
     existing_product = _get_product_by_name_and_supplier(name, supplier_id, products_coll)
@@ -191,7 +163,13 @@ def add_product(name, price, category, supplier_name, initial_stock):
         "name": name, "price": price, "category": category, # Save original category
         "supplier_id": supplier_id, "created_at": datetime.utcnow()
     }
-    result = products_coll.insert_one(product_doc)
+    if sku:
+        product_doc["sku"] = sku
+    try:
+        result = products_coll.insert_one(product_doc)
+    except pymongo.errors.DuplicateKeyError:
+        print(f"Error: SKU '{sku}' is already used on Shard DB{shard_id + 1}.")
+        return None
     product_id = result.inserted_id
 
     # 5. Add to 'stock' collection (on that shard)
@@ -201,6 +179,9 @@ def add_product(name, price, category, supplier_name, initial_stock):
         "last_updated": datetime.utcnow()
     }
     stock_coll.insert_one(stock_doc)
+    _write_through_catalog(shard_id, products=[product_doc], stock=[stock_doc],
+                           suppliers=[{"_id": supplier_id, "name": stored_supplier_name}])
+    sku_index.remember_product(shard_id, product_doc, stored_supplier_name)
     print(f"Added product '{name}' (ID: {product_id}) to Shard DB{shard_id + 1} with stock {initial_stock}")
     return str(product_id)
 
@@ -217,14 +198,14 @@ def add_stock_to_product(product_name, supplier_name, category, amount_to_add):
         print(e)
         return None
 
-    # 2. Find the supplier (on that shard)
-    supplier = suppliers_coll.find_one({"name": {"$regex": f"^{supplier_name}$", "$options": "i"}})
+    # 2. Find the supplier (on that shard) - cached by normalized name
+    supplier = supplier_cache.find_supplier(shard_id, supplier_name)
     if not supplier:
         print(f"Error: Supplier '{supplier_name}' not found on Shard DB{shard_id + 1}.")
         return None
 
     # 3. Find the product (on that shard)
-    product = _get_product_by_name_and_supplier(product_name, supplier["_id"], products_coll)
+    product = _get_product_by_name_and_supplier(product_name, supplier[0], products_coll)
     if not product:
         print(f"Error: Product '{product_name}' from '{supplier_name}' not found on Shard DB{shard_id + 1}.")
         return None
@@ -236,4 +217,6 @@ def add_stock_to_product(product_name, supplier_name, category, amount_to_add):
         return_document=pymongo.ReturnDocument.AFTER # Get the updated doc
     )
 
+    if update_result:
+        _write_through_catalog(shard_id, stock=[update_result])
     return update_result # Return the updated stock document or None if update failed
\ No newline at end of file
@@ -1,4 +1,5 @@
 from .db_connector import db_connection
+from . import shard_health
 from bson.objectid import ObjectId
 import pymongo
 import re
@@ -75,9 +76,10 @@ def find_member_by_phone(phone):
     print(f"Searching for member with phone: {phone}")
     for shard_id in range(NUM_INVENTORY_SHARDS):
         try:
-            members_coll = _get_member_collection_for_shard(shard_id)
-            member_doc = members_coll.find_one({"phone": phone})
-            
+            with shard_health.guard(shard_id):
+                members_coll = _get_member_collection_for_shard(shard_id)
+                member_doc = members_coll.find_one({"phone": phone})
+
             if member_doc:
                 print(f"Found member on Shard DB{shard_id + 1}")
                 # Convert ObjectId to string for easier use in GUI
@@ -86,6 +88,8 @@ def find_member_by_phone(phone):
                     "doc": member_doc,
                     "shard_id": shard_id # Return the doc AND the shard ID
                 }
+        except shard_health.ShardUnavailable as e:
+            print(f"Skipping member search on DB{shard_id + 1}: {e}")
         except Exception as e:
             print(f"Error searching shard DB{shard_id + 1} for member: {e}")
             
@@ -0,0 +1,428 @@
+from .db_connector import db_connection
+from . import catalog_store, shard_health, shard_routing, sku_index, supplier_cache
+from pymongo import UpdateOne
+from bson.objectid import ObjectId
+from datetime import datetime, timezone
+import threading
+import argparse
+import time
+
+# --- REPRICING AND PROMOTIONS ---
+# Every price change goes through here, shard by shard, in batches of
+# BULK_BATCH_SIZE products: one bulk_write to 'products' and one to 'stock'
+# inside a single-shard transaction.
+#
+#   products: list_price (regular price), price (what is charged: list_price,
+#             or the promotion price while one runs), promotion, price_version,
+#             updated_at (so catalog syncs pick the change up)
+#   stock:    price_version, mirrored so record_sale can check a cart's price
+#             snapshot in the same conditional update that takes the units
+#
+# Each change bumps price_version (products without one are version 0).
+# Cart lines keep the price and version they were added at; record_sale
+# charges that price only if the version is still current.
+#
+# Promotions live in ShopSales.promotions and start/end on schedule
+# (apply_due_promotions, run by the backend service or the 'scheduler'
+# command). A promotion takes percent_off or amount_off from list_price.
+# Starting or ending one is recorded shard by shard ('started_on',
+# 'ended_on'); shards that failed are retried on every check until all
+# are done ('start_done', 'end_done'). Products whose promotion's end time
+# has passed are given back their list price on every check as well.
+#
+#   python -m database.pricing reprice --category Bakery --percent 5
+#   python -m database.pricing promote --name "Eid" --category Bakery --percent-off 10 --ends 2025-06-30T23:59
+NUM_INVENTORY_SHARDS = 3 # DB1, DB2, DB3
+BULK_BATCH_SIZE = 500
+PROMOTION_CHECK_SECONDS = 30
+MIN_PRICE = 0.01
+
+db_sales = db_connection.get_sales_db()
+if db_sales is None:
+     raise ConnectionError("Fatal: Could not connect to ShopSales database")
+promotions_coll = db_sales["promotions"]
+
+_indexed = set()
+_scheduler = None
+_scheduler_lock = threading.Lock()
+
+
+def _get_shard(shard_id):
+    db_shard = db_connection.get_inventory_shard(shard_id)
+    if db_shard is None:
+        raise ConnectionError(f"Fatal: Could not connect to inventory shard DB{shard_id + 1}")
+    return db_shard
+
+def _ensure_indexes(shard_id, db_shard):
+    """ updated_at for the catalog's incremental sync, promotion.id for ending promotions """
+    if shard_id in _indexed:
+        return
+    db_shard["products"].create_index("updated_at")
+    db_shard["products"].create_index("promotion.id", sparse=True)
+    db_shard["products"].create_index("promotion.ends_at", sparse=True)
+    _indexed.add(shard_id)
+
+def _as_utc(value):
+    """ Timezone-aware UTC datetime; naive ones are taken to be UTC already """
+    if value.tzinfo is None:
+        return value.replace(tzinfo=timezone.utc)
+    return value.astimezone(timezone.utc)
+
+def _parse_utc(text):
+    """ --starts/--ends: ISO 8601, with an offset or in UTC """
+    return _as_utc(datetime.fromisoformat(text))
+
+def _round_price(value):
+    return round(value, 2)
+
+def list_price_of(doc):
+    """ Regular price of a product (older products only have 'price') """
+    return catalog_store.to_price(doc.get("list_price", doc.get("price")))
+
+def promotion_price(list_price, promotion):
+    """ What a promotion charges for a product with this list price """
+    if promotion.get("percent_off"):
+        return _round_price(list_price * (1 - promotion["percent_off"] / 100))
+    return _round_price(list_price - (promotion.get("amount_off") or 0))
+
+
+# --- SELECTION ---
+def _product_query(shard_id, category=None, product_ids=None, brand=None):
+    """ Query for the selected products on one shard, or None if the shard has none of them """
+    excluded = shard_routing.excluded_categories(shard_id)
+    if category and category in excluded:
+        return None # Leftover copies of a migrated category are not repriced twice
+    query = {}
+    if category:
+        query["category"] = category
+    elif excluded:
+        query["category"] = {"$nin": list(excluded)}
+    if product_ids:
+        query["_id"] = {"$in": [ObjectId(product_id) for product_id in product_ids]}
+    if brand:
+        supplier = supplier_cache.find_supplier(shard_id, brand)
+        if supplier is None:
+            return None
+        query["supplier_id"] = supplier[0]
+    return query
+
+
+# --- WRITING ---
+def _write_batch(shard_id, changes):
+    """
+    Applies one batch of price changes on a shard in a transaction.
+    changes: [(product doc as read, {"list_price", "price", "promotion"})]
+    A product whose price_version moved since it was read is skipped.
+    Returns (product ids in the batch, how many were changed).
+    """
+    client = db_connection.client
+    if client is None:
+        raise ConnectionError("Fatal: MongoDB client not available")
+    db_shard = _get_shard(shard_id)
+    now = datetime.now(timezone.utc)
+    product_ops, stock_ops, product_ids = [], [], []
+    for doc, new in changes:
+        version = doc.get("price_version", 0)
+        version_filter = {"$in": [0, None]} if version == 0 else version
+        update = {"$set": {
+            "list_price": new["list_price"], "price": new["price"],
+            "price_version": version + 1, "updated_at": now
+        }}
+        if new.get("promotion"):
+            update["$set"]["promotion"] = new["promotion"]
+        elif "promotion" in new:
+            update["$unset"] = {"promotion": ""}
+        product_ops.append(UpdateOne({"_id": doc["_id"], "price_version": version_filter}, update))
+        stock_ops.append(UpdateOne(
+            {"product_id": doc["_id"], "price_version": version_filter},
+            {"$set": {"price_version": version + 1}}
+        ))
+        product_ids.append(doc["_id"])
+
+    with shard_health.guard(shard_id):
+        with client.start_session() as session:
+            with session.start_transaction():
+                result = db_shard["products"].bulk_write(product_ops, ordered=False, session=session)
+                db_shard["stock"].bulk_write(stock_ops, ordered=False, session=session)
+    if result.modified_count < len(product_ops):
+        print(f"{len(product_ops) - result.modified_count} products on Shard DB{shard_id + 1} "
+              f"changed price meanwhile and were skipped")
+    return product_ids, result.modified_count
+
+def _refresh_caches(shard_id, product_ids):
+    """ Our own local catalog and barcode map see the new prices at once (other tills via the watcher) """
+    try:
+        product_docs = list(_get_shard(shard_id)["products"].find({"_id": {"$in": product_ids}}))
+        catalog_store.upsert_products(shard_id, product_docs)
+        for doc in product_docs:
+            if doc.get("sku"):
+                sku_index.refresh_product(shard_id, doc)
+    except Exception as e:
+        print(f"Could not refresh cached prices for Shard DB{shard_id + 1}: {e}")
+
+def _apply(shard_id, query, compute):
+    """
+    Runs compute(doc) -> new prices (or None to leave it) over the selected
+    products of a shard and writes the changes in batches. Returns (matched, changed).
+    """
+    db_shard = _get_shard(shard_id)
+    _ensure_indexes(shard_id, db_shard)
+    projection = {"price": 1, "list_price": 1, "price_version": 1, "promotion": 1, "name": 1}
+    matched = changed = 0
+    batch = []
+    for doc in db_shard["products"].find(query, projection):
+        matched += 1
+        new = compute(doc)
+        if new is None or (new["price"] == catalog_store.to_price(doc.get("price"))
+                           and new["list_price"] == list_price_of(doc) and "promotion" not in new):
+            continue
+        batch.append((doc, new))
+        if len(batch) >= BULK_BATCH_SIZE:
+            changed += _write_and_refresh(shard_id, batch)
+            batch = []
+    if batch:
+        changed += _write_and_refresh(shard_id, batch)
+    return matched, changed
+
+def _write_and_refresh(shard_id, batch):
+    product_ids, changed = _write_batch(shard_id, batch)
+    _refresh_caches(shard_id, product_ids)
+    return changed
+
+
+# --- REPRICING ---
+def reprice(percent=None, amount=None, set_price=None, category=None, product_ids=None, brand=None):
+    """
+    Changes list prices of the selected products on every shard:
+    percent=+5 raises them 5%, amount=-10 takes 10 off, set_price=99 sets them.
+    Products on a promotion keep it, at the promotion's price of the new list price.
+    Returns {"matched", "changed", "shards": {shard_id: changed}}.
+    """
+    if sum(option is not None for option in (percent, amount, set_price)) != 1:
+        raise ValueError("Give exactly one of percent, amount or set_price.")
+    if not (category or product_ids or brand):
+        raise ValueError("Select the products to reprice (category, product ids or brand).")
+
+    def compute(doc):
+        old_list_price = list_price_of(doc)
+        if percent is not None:
+            list_price = _round_price(old_list_price * (1 + percent / 100))
+        elif amount is not None:
+            list_price = _round_price(old_list_price + amount)
+        else:
+            list_price = _round_price(set_price)
+        if list_price < MIN_PRICE:
+            print(f"Skipping '{doc.get('name')}': new price {list_price} is below {MIN_PRICE}")
+            return None
+        promotion = doc.get("promotion")
+        price = max(promotion_price(list_price, promotion), MIN_PRICE) if promotion else list_price
+        return {"list_price": list_price, "price": price}
+
+    return _run_on_shards(compute, category, product_ids, brand, "Repriced")
+
+def _run_on_shards(compute, category, product_ids, brand, label, extra_query=None, shard_ids=None):
+    """ Applies compute on each shard (or only 'shard_ids'); a failed shard is "error" in summary["shards"] """
+    summary = {"matched": 0, "changed": 0, "shards": {}}
+    if shard_ids is None:
+        shard_ids = shard_routing.inventory_shard_ids(NUM_INVENTORY_SHARDS)
+    for shard_id in shard_ids:
+        query = _product_query(shard_id, category, product_ids, brand)
+        if query is None:
+            continue
+        if extra_query:
+            query.update(extra_query)
+        try:
+            matched, changed = _apply(shard_id, query, compute)
+        except Exception as e:
+            # The other shards still go ahead; re-running is safe (unchanged products are skipped)
+            print(f"Error pricing products on Shard DB{shard_id + 1}: {e}")
+            summary["shards"][shard_id] = "error"
+            continue
+        summary["matched"] += matched
+        summary["changed"] += changed
+        summary["shards"][shard_id] = changed
+        if changed:
+            print(f"{label} {changed} products on Shard DB{shard_id + 1}")
+    return summary
+
+
+# --- PROMOTIONS ---
+def create_promotion(name, ends_at, percent_off=None, amount_off=None, starts_at=None,
+                     category=None, product_ids=None, brand=None):
+    """ Schedules a timed promotion; it starts at starts_at (default: now) """
+    if (percent_off is None) == (amount_off is None):
+        raise ValueError("Give exactly one of percent_off or amount_off.")
+    if percent_off is not None and not 0 < percent_off < 100:
+        raise ValueError("percent_off must be between 0 and 100.")
+    if not (category or product_ids or brand):
+        raise ValueError("Select the products to promote (category, product ids or brand).")
+    starts_at = _as_utc(starts_at) if starts_at else datetime.now(timezone.utc)
+    ends_at = _as_utc(ends_at)
+    if ends_at <= starts_at:
+        raise ValueError("A promotion must end after it starts.")
+    promotion_doc = {
+        "name": name, "percent_off": percent_off, "amount_off": amount_off,
+        "starts_at": starts_at, "ends_at": ends_at, "status": "scheduled",
+        "category": category, "product_ids": product_ids, "brand": brand,
+        "created_at": datetime.now(timezone.utc)
+    }
+    promotion_id = promotions_coll.insert_one(promotion_doc).inserted_id
+    print(f"Scheduled promotion '{name}' ({starts_at} to {ends_at})")
+    apply_due_promotions()
+    return str(promotion_id)
+
+def _start_promotion(promotion, shard_ids=None):
+    tag = {
+        "id": promotion["_id"], "name": promotion["name"], "percent_off": promotion.get("percent_off"),
+        "amount_off": promotion.get("amount_off"), "ends_at": promotion["ends_at"]
+    }
+
+    def compute(doc):
+        if doc.get("promotion"):
+            return None # One promotion at a time; the earlier one keeps the product
+        list_price = list_price_of(doc)
+        return {"list_price": list_price, "price": max(promotion_price(list_price, tag), MIN_PRICE), "promotion": tag}
+
+    return _run_on_shards(compute, promotion.get("category"), promotion.get("product_ids"), promotion.get("brand"),
+                          f"Promotion '{promotion['name']}' started on", shard_ids=shard_ids)
+
+def _restore_list_price(doc):
+    return {"list_price": list_price_of(doc), "price": list_price_of(doc), "promotion": None}
+
+def _end_promotion(promotion, shard_ids=None):
+    return _run_on_shards(_restore_list_price, None, None, None, f"Promotion '{promotion['name']}' ended on",
+                          extra_query={"promotion.id": promotion["_id"]}, shard_ids=shard_ids)
+
+def _finish_transition(promotion, transition):
+    """
+    Runs a promotion's "start" or "end" on the shards that have not done
+    it yet and records each shard that succeeded. Returns True once every
+    shard has; until then the next check retries the rest.
+    """
+    progress_field = "started_on" if transition == "start" else "ended_on"
+    done = set(promotion.get(progress_field, []))
+    pending = [shard_id for shard_id in shard_routing.inventory_shard_ids(NUM_INVENTORY_SHARDS) if shard_id not in done]
+    run = _start_promotion if transition == "start" else _end_promotion
+    summary = run(promotion, pending)
+    succeeded = [shard_id for shard_id in pending if summary["shards"].get(shard_id) != "error"]
+    update = {"$addToSet": {progress_field: {"$each": succeeded}}}
+    complete = len(succeeded) == len(pending)
+    if complete:
+        update["$set"] = {f"{transition}_done": True}
+    promotions_coll.update_one({"_id": promotion["_id"]}, update)
+    if not complete:
+        print(f"Promotion '{promotion['name']}': {transition} not done on "
+              f"{len(pending) - len(succeeded)} shard(s); retrying on the next check")
+    return complete
+
+def _end_expired_products(now):
+    """ Gives back the list price to products whose promotion has ended (whatever missed it) """
+    return _run_on_shards(_restore_list_price, None, None, None, "Ended expired promotions on",
+                          extra_query={"promotion.ends_at": {"$lte": now}})
+
+def end_promotion(promotion_id):
+    """ Ends a promotion now (restores list prices) """
+    promotions_coll.update_one(
+        {"_id": ObjectId(promotion_id), "status": {"$in": ["scheduled", "active"]}},
+        {"$set": {"ends_at": datetime.now(timezone.utc)}}
+    )
+    apply_due_promotions()
+
+def apply_due_promotions(now=None):
+    """
+    Starts promotions whose time has come and ends expired ones, then
+    finishes any start or end that some shard has not done yet. Status
+    changes are claimed with an update first, and the product writes are
+    idempotent, so several tills or services can run this at once.
+    Returns (started, ended) status changes.
+    """
+    now = _as_utc(now) if now else datetime.now(timezone.utc)
+    ended = 0
+    while True:
+        promotion = promotions_coll.find_one_and_update(
+            {"status": {"$in": ["scheduled", "active"]}, "ends_at": {"$lte": now}},
+            {"$set": {"status": "ended", "ended_at": now}}
+        )
+        if promotion is None:
+            break
+        if promotion["status"] == "scheduled":
+            # Never started: no product carries it
+            promotions_coll.update_one({"_id": promotion["_id"]}, {"$set": {"end_done": True}})
+        ended += 1
+    started = 0
+    while True:
+        promotion = promotions_coll.find_one_and_update(
+            {"status": "scheduled", "starts_at": {"$lte": now}},
+            {"$set": {"status": "active", "started_at": now}}
+        )
+        if promotion is None:
+            break
+        started += 1
+
+    for promotion in list(promotions_coll.find({"status": "ended", "end_done": {"$ne": True}})):
+        _finish_transition(promotion, "end")
+    for promotion in list(promotions_coll.find({"status": "active", "start_done": {"$ne": True}})):
+        _finish_transition(promotion, "start")
+    _end_expired_products(now)
+    return started, ended
+
+def _run_scheduler():
+    while True:
+        try:
+            apply_due_promotions()
+        except Exception as e:
+            print(f"Error applying promotions: {e}")
+        time.sleep(PROMOTION_CHECK_SECONDS)
+
+def start_scheduler():
+    global _scheduler
+    with _scheduler_lock:
+        if _scheduler is None or not _scheduler.is_alive():
+            _scheduler = threading.Thread(target=_run_scheduler, name="promotion-scheduler", daemon=True)
+            _scheduler.start()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Bulk repricing and timed promotions")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    def add_selection(subparser):
+        subparser.add_argument("--category")
+        subparser.add_argument("--brand")
+        subparser.add_argument("--product-id", action="append", dest="product_ids")
+
+    reprice_parser = subparsers.add_parser("reprice", help="Change list prices")
+    add_selection(reprice_parser)
+    change = reprice_parser.add_mutually_exclusive_group(required=True)
+    change.add_argument("--percent", type=float, help="e.g. 5 or -10")
+    change.add_argument("--amount", type=float, help="Added to each price, e.g. -20")
+    change.add_argument("--set-price", type=float)
+
+    promote_parser = subparsers.add_parser("promote", help="Schedule a timed promotion")
+    add_selection(promote_parser)
+    promote_parser.add_argument("--name", required=True)
+    discount = promote_parser.add_mutually_exclusive_group(required=True)
+    discount.add_argument("--percent-off", type=float)
+    discount.add_argument("--amount-off", type=float)
+    promote_parser.add_argument("--starts", type=_parse_utc, help="ISO time, UTC unless it has an offset; default now")
+    promote_parser.add_argument("--ends", type=_parse_utc, required=True, help="ISO time, UTC unless it has an offset")
+
+    end_parser = subparsers.add_parser("end", help="End a promotion now")
+    end_parser.add_argument("promotion_id")
+    subparsers.add_parser("run-due", help="Start/end promotions that are due")
+    subparsers.add_parser("scheduler", help="Keep starting/ending promotions on time")
+    args = parser.parse_args()
+
+    if args.command == "reprice":
+        print(reprice(args.percent, args.amount, args.set_price, args.category, args.product_ids, args.brand))
+    elif args.command == "promote":
+        create_promotion(args.name, args.ends, args.percent_off, args.amount_off, args.starts,
+                         args.category, args.product_ids, args.brand)
+    elif args.command == "end":
+        end_promotion(args.promotion_id)
+    elif args.command == "run-due":
+        started, ended = apply_due_promotions()
+        print(f"Started {started}, ended {ended} promotions")
+    else:
+        print(f"Checking promotions every {PROMOTION_CHECK_SECONDS}s (Ctrl+C to stop)")
+        _run_scheduler()
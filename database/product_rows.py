@@ -0,0 +1,136 @@
+from bson.objectid import ObjectId
+from array import array
+import sys
+
+# --- COMPACT PRODUCT ROWS ---
+# create_product_fragment(..., compact=True) returns a ProductBatch instead
+# of a list of BSON dicts. Fields are stored column by column: ids as 12
+# raw bytes, prices/stock/shard in typed arrays, and category and supplier
+# names interned so every product of a brand shares one string. Rows read
+# like the dicts they replace (row["name"], row.get("supplier_name")), so
+# consumers opt in without other changes, while sorting and filtering run
+# over the columns.
+ROW_FIELDS = ["_id", "name", "price", "price_version", "category", "quantity_in_stock", "supplier_name", "shard_id"]
+
+
+class ProductRow:
+    """ A read-only view of one product in a ProductBatch """
+    __slots__ = ("batch", "index")
+
+    def __init__(self, batch, index):
+        self.batch = batch
+        self.index = index
+
+    def __getitem__(self, field):
+        batch, i = self.batch, self.index
+        if field == "_id":
+            return ObjectId(batch.ids[i])
+        if field == "name":
+            return batch.names[i]
+        if field == "price":
+            return batch.prices[i]
+        if field == "price_version":
+            return batch.price_versions[i]
+        if field == "category":
+            return batch.categories[i]
+        if field == "quantity_in_stock":
+            return batch.quantities[i]
+        if field == "supplier_name":
+            return batch.suppliers[i]
+        if field == "shard_id":
+            return batch.shard_ids[i]
+        raise KeyError(field)
+
+    def get(self, field, default=None):
+        try:
+            return self[field]
+        except KeyError:
+            return default
+
+    def keys(self):
+        return list(ROW_FIELDS)
+
+    def to_dict(self):
+        return {field: self[field] for field in ROW_FIELDS}
+
+
+class ProductBatch:
+    """ Column-oriented product search results """
+    __slots__ = ("ids", "names", "prices", "price_versions", "categories", "quantities", "suppliers", "shard_ids")
+
+    def __init__(self):
+        self.ids = [] # 12-byte ObjectId binaries
+        self.names = []
+        self.prices = array("d")
+        self.price_versions = array("q")
+        self.categories = [] # Interned
+        self.quantities = array("q")
+        self.suppliers = [] # Interned
+        self.shard_ids = array("b")
+
+    @classmethod
+    def from_docs(cls, docs):
+        """ Builds a batch from fragment documents (pipeline or local catalog shape) """
+        batch = cls()
+        for doc in docs:
+            batch.append(doc)
+        return batch
+
+    def append(self, doc):
+        self.ids.append(ObjectId(doc["_id"]).binary)
+        self.names.append(doc.get("name"))
+        self.prices.append(float(doc.get("price") or 0))
+        self.price_versions.append(int(doc.get("price_version") or 0))
+        self.categories.append(sys.intern(doc.get("category") or ""))
+        self.quantities.append(int(doc.get("quantity_in_stock") or 0))
+        self.suppliers.append(sys.intern(doc.get("supplier_name") or "N/A"))
+        self.shard_ids.append(doc["shard_id"])
+
+    def __len__(self):
+        return len(self.ids)
+
+    def __getitem__(self, index):
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError(index)
+        return ProductRow(self, index)
+
+    def __iter__(self):
+        return (ProductRow(self, i) for i in range(len(self)))
+
+    def _column(self, field):
+        return {
+            "_id": self.ids, "name": self.names, "price": self.prices, "price_version": self.price_versions,
+            "category": self.categories,
+            "quantity_in_stock": self.quantities, "supplier_name": self.suppliers, "shard_id": self.shard_ids
+        }[field]
+
+    def take(self, indexes):
+        """ A new batch with the rows at 'indexes', in that order """
+        batch = ProductBatch()
+        batch.ids = [self.ids[i] for i in indexes]
+        batch.names = [self.names[i] for i in indexes]
+        batch.prices = array("d", (self.prices[i] for i in indexes))
+        batch.price_versions = array("q", (self.price_versions[i] for i in indexes))
+        batch.categories = [self.categories[i] for i in indexes]
+        batch.quantities = array("q", (self.quantities[i] for i in indexes))
+        batch.suppliers = [self.suppliers[i] for i in indexes]
+        batch.shard_ids = array("b", (self.shard_ids[i] for i in indexes))
+        return batch
+
+    def sorted_by(self, field, reverse=False):
+        column = self._column(field)
+        if field in ("name", "category", "supplier_name"):
+            key = lambda i: (column[i] or "").casefold()
+        else:
+            key = column.__getitem__
+        return self.take(sorted(range(len(self)), key=key, reverse=reverse))
+
+    def where(self, field, predicate):
+        """ Rows whose 'field' value satisfies predicate(value) """
+        column = self._column(field)
+        return self.take([i for i, value in enumerate(column) if predicate(value)])
+
+    def to_dicts(self):
+        return [row.to_dict() for row in self]
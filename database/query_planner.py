@@ -0,0 +1,337 @@
+from .db_connector import db_connection
+from . import shard_routing, supplier_cache
+from bson import json_util
+from datetime import datetime, timezone
+import pymongo
+import argparse
+import threading
+import time
+import re
+import os
+
+# --- FRAGMENT QUERY PLANNER ---
+# A product search joins three collections on each shard: products,
+# stock (only quantity > 0) and suppliers (for the brand). The planner
+# picks where to start from the filters present and per-shard statistics:
+#
+#   products_first   filter products, then look up stock/suppliers
+#                    (the cheaper-to-reject join first)
+#   stock_first      start from in-stock rows - best when most of the
+#                    catalog is sold out and products are not filtered
+#   suppliers_first  start from the suppliers matching the brand
+#
+# Every join is a $lookup sub-pipeline with its filter inside, so rows that
+# fail a join are dropped before the next one. All plans return the same
+# document shape.
+#
+# Statistics (and the join indexes) are gathered by a background thread,
+# never on the search path: a search uses whatever statistics are cached
+# and plans products_first until the first ones arrive.
+#
+#   python -m database.query_planner --brand nestle --explain
+NUM_INVENTORY_SHARDS = 3 # DB1, DB2, DB3
+STATS_REFRESH_SECONDS = 300
+STRATEGIES = ["products_first", "stock_first", "suppliers_first"]
+FORCE_STRATEGY = os.getenv("QUERY_PLAN_STRATEGY") # Pin one strategy (for comparing plans)
+
+# Guessed selectivities for filters the statistics cannot answer
+NAME_SELECTIVITY = 0.1
+PRICE_BOUND_SELECTIVITY = 0.5 # Per bound (min or max)
+BRAND_SELECTIVITY = 0.05 # Until the supplier cache is warm
+
+_stats = {} # shard_id -> statistics dict
+_stats_lock = threading.Lock()
+_refreshing = set() # shards with a statistics refresh running
+_indexed = set()
+
+
+def _get_shard(shard_id):
+    db_shard = db_connection.get_inventory_shard(shard_id)
+    if db_shard is None:
+        raise ConnectionError(f"Fatal: Could not connect to inventory shard DB{shard_id + 1}")
+    return db_shard
+
+def _ensure_indexes(shard_id, db_shard):
+    """ Indexes the join keys and the in-stock filter (once per shard) """
+    if shard_id in _indexed:
+        return
+    try:
+        db_shard["products"].create_index("supplier_id")
+        db_shard["products"].create_index("category")
+        db_shard["stock"].create_index("product_id")
+        db_shard["stock"].create_index("quantity")
+    except pymongo.errors.OperationFailure as e:
+        print(f"Warning: Could not create planner indexes on Shard DB{shard_id + 1}: {e}")
+    _indexed.add(shard_id)
+
+
+# --- STATISTICS ---
+def get_shard_stats(shard_id, force=False):
+    """
+    Collection sizes, in-stock count and products per category. Cached
+    statistics are returned as they are (None before the first ones);
+    stale or missing ones are refreshed in the background. force=True
+    collects them now (for the command line).
+    """
+    if force:
+        return _collect_stats(shard_id)
+    with _stats_lock:
+        cached = _stats.get(shard_id)
+    if cached is None or time.time() - cached["collected_at"] >= STATS_REFRESH_SECONDS:
+        _start_refresh(shard_id)
+    return cached
+
+def _collect_stats(shard_id):
+    db_shard = _get_shard(shard_id)
+    _ensure_indexes(shard_id, db_shard)
+    if supplier_cache.cached_names(shard_id) is None:
+        supplier_cache.warm_up(shard_id) # For brand estimates
+    stats = {
+        "products": db_shard["products"].estimated_document_count(),
+        "stock": db_shard["stock"].estimated_document_count(),
+        "in_stock": db_shard["stock"].count_documents({"quantity": {"$gt": 0}}),
+        "suppliers": db_shard["suppliers"].estimated_document_count(),
+        "categories": {
+            doc["_id"]: doc["count"]
+            for doc in db_shard["products"].aggregate([{"$group": {"_id": "$category", "count": {"$sum": 1}}}])
+        },
+        "collected_at": time.time(),
+    }
+    with _stats_lock:
+        _stats[shard_id] = stats
+    return stats
+
+def _refresh_stats(shard_id):
+    try:
+        _collect_stats(shard_id)
+    except Exception as e:
+        print(f"Warning: Could not refresh planner statistics for Shard DB{shard_id + 1}: {e}")
+    finally:
+        with _stats_lock:
+            _refreshing.discard(shard_id)
+
+def _start_refresh(shard_id):
+    with _stats_lock:
+        if shard_id in _refreshing:
+            return
+        _refreshing.add(shard_id)
+    threading.Thread(target=_refresh_stats, args=(shard_id,), name=f"planner-stats-DB{shard_id + 1}", daemon=True).start()
+
+def _brand_selectivity(filters, shard_id):
+    """ Share of suppliers matching the brand filter (from the supplier cache when warm, else a guess) """
+    try:
+        pattern = re.compile(filters["brand"], re.IGNORECASE)
+    except re.error:
+        return BRAND_SELECTIVITY # MongoDB's regex dialect; not worth a query to find out
+    names = supplier_cache.cached_names(shard_id)
+    if not names:
+        return BRAND_SELECTIVITY
+    return sum(1 for name in names if name and pattern.search(name)) / len(names)
+
+def _estimate_selectivity(filters, shard_id, stats):
+    """ Fraction of rows surviving each filter: product filters, brand, in stock """
+    product_fraction = 1.0
+    if filters.get("name"):
+        product_fraction *= NAME_SELECTIVITY
+    if filters.get("category") and stats["products"]:
+        wanted = filters["category"].lower()
+        in_category = sum(count for category, count in stats["categories"].items()
+                          if isinstance(category, str) and category.lower() == wanted)
+        product_fraction *= in_category / stats["products"]
+    for bound in ("min_price", "max_price"):
+        if filters.get(bound):
+            product_fraction *= PRICE_BOUND_SELECTIVITY
+    return {
+        "products": product_fraction,
+        "brand": _brand_selectivity(filters, shard_id) if filters.get("brand") else 1.0,
+        "in_stock": stats["in_stock"] / stats["stock"] if stats["stock"] else 0.0,
+    }
+
+def _estimate_costs(selectivity, stats, has_brand):
+    """
+    Rough cost per strategy: documents scanned at the start plus one
+    index lookup per document entering each join.
+    """
+    n_products, n_stock, n_suppliers = stats["products"], stats["stock"], stats["suppliers"]
+    f_products, f_brand, f_stock = selectivity["products"], selectivity["brand"], selectivity["in_stock"]
+
+    # products_first: scan products, then the join that rejects more goes first
+    candidates = n_products * f_products
+    costs = {"products_first": n_products + candidates + candidates * (min(f_stock, f_brand) if has_brand else f_stock)}
+    # stock_first: in-stock rows come off the quantity index
+    in_stock = n_stock * f_stock
+    costs["stock_first"] = in_stock + in_stock + in_stock * f_products
+    if has_brand:
+        brand_products = n_products * f_brand
+        costs["suppliers_first"] = n_suppliers + n_suppliers * f_brand + brand_products + brand_products * f_products
+    return costs
+
+
+# --- PIPELINE PIECES ---
+def _product_match(filters, shard_id):
+    match_query = {}
+    if filters.get("name"):
+        match_query["name"] = {"$regex": filters["name"], "$options": "i"}
+    category_filter = filters.get("category")
+    if category_filter:
+        match_query["category"] = {"$regex": f"^{category_filter}$", "$options": "i"}
+    else:
+        # Ignore leftover/in-flight copies of categories another shard serves
+        excluded = shard_routing.excluded_categories(shard_id)
+        if excluded:
+            match_query["category"] = {"$nin": excluded}
+    return match_query
+
+def _product_filter_stages(filters, shard_id):
+    """ Product match, numeric price and price range """
+    stages = []
+    match_query = _product_match(filters, shard_id)
+    if match_query:
+        stages.append({"$match": match_query})
+    stages.append({"$addFields": {"numericPrice": {"$cond": {
+        "if": {"$isNumber": "$price"}, "then": "$price",
+        "else": {"$convert": {"input": "$price", "to": "double", "onError": 0, "onNull": 0}}
+    }}}})
+    price_match_query = {}
+    if filters.get("min_price"): price_match_query["$gte"] = filters["min_price"]
+    if filters.get("max_price"): price_match_query["$lte"] = filters["max_price"]
+    if price_match_query:
+        stages.append({"$match": {"numericPrice": price_match_query}})
+    return stages
+
+def _stock_join():
+    return [
+        {"$lookup": {"from": "stock", "let": {"pid": "$_id"}, "pipeline": [
+            {"$match": {"$expr": {"$eq": ["$product_id", "$$pid"]}}},
+            {"$match": {"quantity": {"$gt": 0}}},
+            {"$project": {"_id": 0, "quantity": 1}},
+        ], "as": "stock_data"}},
+        {"$unwind": "$stock_data"},
+    ]
+
+def _supplier_join(brand):
+    pipeline = [{"$match": {"$expr": {"$eq": ["$_id", "$$sid"]}}}]
+    if brand:
+        pipeline.append({"$match": {"name": {"$regex": brand, "$options": "i"}}})
+    pipeline.append({"$project": {"_id": 0, "name": 1}})
+    return [
+        {"$lookup": {"from": "suppliers", "let": {"sid": "$supplier_id"}, "pipeline": pipeline, "as": "supplier_data"}},
+        # Without a brand filter, products with no supplier stay (as "N/A")
+        {"$unwind": {"path": "$supplier_data", "preserveNullAndEmptyArrays": not brand}},
+    ]
+
+def _final_projection(shard_id):
+    return {"$project": {
+        "_id": 1, "name": 1, "price": "$numericPrice", "price_version": {"$ifNull": ["$price_version", 0]},
+        "category": 1,
+        "quantity_in_stock": "$stock_data.quantity",
+        "supplier_name": {"$ifNull": ["$supplier_data.name", "N/A"]},
+        "shard_id": {"$literal": shard_id},
+        "createdAt": datetime.now(timezone.utc)
+    }}
+
+def _build_pipeline(strategy, filters, shard_id, stock_join_first=True):
+    """ (collection to aggregate on, pipeline) for a strategy """
+    brand = filters.get("brand")
+    if strategy == "stock_first":
+        return "stock", [
+            {"$match": {"quantity": {"$gt": 0}}},
+            {"$lookup": {"from": "products", "let": {"pid": "$product_id"}, "pipeline": [
+                {"$match": {"$expr": {"$eq": ["$_id", "$$pid"]}}},
+                *_product_filter_stages(filters, shard_id),
+            ], "as": "product"}},
+            {"$unwind": "$product"},
+            {"$replaceRoot": {"newRoot": {"$mergeObjects": ["$product", {"stock_data": {"quantity": "$quantity"}}]}}},
+            *_supplier_join(brand),
+            _final_projection(shard_id),
+        ]
+    if strategy == "suppliers_first":
+        return "suppliers", [
+            {"$match": {"name": {"$regex": brand, "$options": "i"}}},
+            {"$lookup": {"from": "products", "let": {"sid": "$_id"}, "pipeline": [
+                {"$match": {"$expr": {"$eq": ["$supplier_id", "$$sid"]}}},
+                *_product_filter_stages(filters, shard_id),
+            ], "as": "product"}},
+            {"$unwind": "$product"},
+            {"$replaceRoot": {"newRoot": {"$mergeObjects": ["$product", {"supplier_data": {"name": "$name"}}]}}},
+            *_stock_join(),
+            _final_projection(shard_id),
+        ]
+    joins = _stock_join() + _supplier_join(brand) if stock_join_first else _supplier_join(brand) + _stock_join()
+    return "products", [*_product_filter_stages(filters, shard_id), *joins, _final_projection(shard_id)]
+
+
+# --- PLANNING ---
+def plan_fragment_query(filters, shard_id):
+    """
+    Chooses how to run one shard's part of a product search. Returns
+    {shard_id, strategy, collection, pipeline, join_order, costs, selectivity}.
+    """
+    stats = get_shard_stats(shard_id)
+    has_brand = bool(filters.get("brand"))
+    if stats is None:
+        # No statistics yet (being collected): the plan that is never far off
+        selectivity, costs = {}, {}
+        strategy = "products_first"
+        stock_join_first = True
+    else:
+        selectivity = _estimate_selectivity(filters, shard_id, stats)
+        costs = _estimate_costs(selectivity, stats, has_brand)
+        if FORCE_STRATEGY in costs:
+            strategy = FORCE_STRATEGY
+        else:
+            strategy = min(costs, key=costs.get)
+        stock_join_first = not has_brand or selectivity["in_stock"] <= selectivity["brand"]
+    collection, pipeline = _build_pipeline(strategy, filters, shard_id, stock_join_first)
+
+    if strategy == "products_first":
+        join_order = ["products", "stock", "suppliers"] if stock_join_first else ["products", "suppliers", "stock"]
+    elif strategy == "stock_first":
+        join_order = ["stock", "products", "suppliers"]
+    else:
+        join_order = ["suppliers", "products", "stock"]
+    return {
+        "shard_id": shard_id, "strategy": strategy, "collection": collection, "pipeline": pipeline,
+        "join_order": join_order, "costs": costs, "selectivity": selectivity,
+    }
+
+def run_plan(plan, db_shard=None):
+    """ Runs a plan on its shard and returns the fragment documents """
+    db_shard = db_shard if db_shard is not None else _get_shard(plan["shard_id"])
+    return list(db_shard[plan["collection"]].aggregate(plan["pipeline"]))
+
+def explain_plan(plan, verbosity="executionStats"):
+    """ MongoDB's explain output for a plan """
+    db_shard = _get_shard(plan["shard_id"])
+    return db_shard.command({
+        "explain": {"aggregate": plan["collection"], "pipeline": plan["pipeline"], "cursor": {}},
+        "verbosity": verbosity
+    })
+
+def dump_plan(plan, explain=False):
+    """ The chosen plan (and optionally its explain output) as readable JSON """
+    output = {key: plan[key] for key in ("shard_id", "strategy", "join_order", "costs", "selectivity", "collection", "pipeline")}
+    if explain:
+        output["explain"] = explain_plan(plan)
+    return json_util.dumps(output, indent=2)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Show how product searches would run on each shard")
+    parser.add_argument("--name")
+    parser.add_argument("--brand")
+    parser.add_argument("--category")
+    parser.add_argument("--min-price", type=float)
+    parser.add_argument("--max-price", type=float)
+    parser.add_argument("--shard", type=int, help="Only this shard id (0-based)")
+    parser.add_argument("--explain", action="store_true", help="Include MongoDB's explain output")
+    args = parser.parse_args()
+
+    filters = {key: value for key, value in {
+        "name": args.name, "brand": args.brand, "category": args.category,
+        "min_price": args.min_price, "max_price": args.max_price
+    }.items() if value}
+    shard_ids = [args.shard] if args.shard is not None else shard_routing.inventory_shard_ids(NUM_INVENTORY_SHARDS)
+    for shard_id in shard_ids:
+        get_shard_stats(shard_id, force=True)
+        print(dump_plan(plan_fragment_query(filters, shard_id), explain=args.explain))
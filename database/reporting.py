@@ -0,0 +1,330 @@
+from . import transaction_store
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import datetime, date, time, timedelta
+import argparse
+import math
+import csv
+import os
+import timeit
+
+# Parquet output is optional: without pyarrow reports are written as CSV only
+try:
+    import pyarrow
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+
+# --- END-OF-DAY REPORTS ---
+# Daily totals per category, till, payment method and discount tier.
+# Every hot transaction collection for the day runs one aggregation on its
+# own shard (in parallel) and returns small partial aggregates: sums and
+# counts per key, split by a log-scale histogram bucket of the basket value.
+# Partials are merged here; sums add up, and the bucket counts form a
+# mergeable histogram (LogHistogram) for percentiles. Archived days are
+# reduced from the archive files into the same partials.
+#
+#   python -m database.reporting --day 2025-06-30 --out reports
+DIMENSIONS = ["total", "category", "till", "payment_method", "discount_tier"]
+# Discount as a share of the subtotal: (tier, upper bound); the first that fits wins
+DISCOUNT_TIERS = [("none", 0), ("up_to_5pct", 0.05), ("up_to_10pct", 0.10), ("over_10pct", None)]
+_TIER_EPSILON = 1e-9 # 5% of a subtotal divided by it is not always exactly 0.05
+SKETCH_RELATIVE_ACCURACY = 0.01 # Percentiles are within 1% of the true value
+PERCENTILES = [0.5, 0.9, 0.99]
+MAX_PARALLEL_QUERIES = 8
+REPORT_DIR = os.getenv("REPORT_DIR", "reports")
+REPORT_COLUMNS = ["dimension", "key", "transactions", "units", "subtotal", "discount", "revenue", "avg_basket"] + \
+    [f"p{round(q * 100)}" for q in PERCENTILES]
+
+
+class LogHistogram:
+    """
+    Mergeable histogram with relative-error quantiles (DDSketch-style).
+    A value v > 0 falls in bucket ceil(log_gamma(v)); any quantile read back
+    is within 'relative_accuracy' of the true one, and histograms built on
+    different shards merge exactly by adding bucket counts.
+    """
+    def __init__(self, relative_accuracy=SKETCH_RELATIVE_ACCURACY):
+        self.gamma = (1 + relative_accuracy) / (1 - relative_accuracy)
+        self.ln_gamma = math.log(self.gamma)
+        self.buckets = {} # bucket index -> count
+        self.zero_count = 0 # values <= 0 (fully discounted, refunds)
+        self.count = 0
+
+    def bucket_index(self, value):
+        """ Bucket for 'value', or None for values <= 0 """
+        return math.ceil(math.log(value) / self.ln_gamma) if value > 0 else None
+
+    def add_bucket(self, index, count=1):
+        if index is None:
+            self.zero_count += count
+        else:
+            index = int(index)
+            self.buckets[index] = self.buckets.get(index, 0) + count
+        self.count += count
+
+    def add(self, value, count=1):
+        self.add_bucket(self.bucket_index(value), count)
+
+    def merge(self, other):
+        for index, count in other.buckets.items():
+            self.buckets[index] = self.buckets.get(index, 0) + count
+        self.zero_count += other.zero_count
+        self.count += other.count
+
+    def quantile(self, q):
+        """ Estimated q-quantile (0 <= q <= 1), or None if empty """
+        if self.count == 0:
+            return None
+        rank = q * (self.count - 1)
+        seen = self.zero_count
+        if seen > rank:
+            return 0.0
+        for index in sorted(self.buckets):
+            seen += self.buckets[index]
+            if seen > rank:
+                return 2 * self.gamma ** index / (self.gamma + 1) # Bucket midpoint (relative)
+        return 2 * self.gamma ** max(self.buckets) / (self.gamma + 1)
+
+
+# --- PUSHDOWN AGGREGATION ---
+def _discount_ratio_expr():
+    return {"$cond": [
+        {"$gt": ["$subtotal", 0]},
+        {"$divide": [{"$ifNull": ["$discount_applied", 0]}, "$subtotal"]},
+        0
+    ]}
+
+def _discount_tier_expr():
+    ratio = _discount_ratio_expr()
+    branches = [
+        {"case": {"$lte": [ratio, bound + _TIER_EPSILON]}, "then": tier}
+        for tier, bound in DISCOUNT_TIERS if bound is not None
+    ]
+    return {"$switch": {"branches": branches, "default": DISCOUNT_TIERS[-1][0]}}
+
+def _bucket_expr(value, ln_gamma):
+    """ Server-side LogHistogram.bucket_index """
+    return {"$cond": [{"$gt": [value, 0]}, {"$ceil": {"$divide": [{"$ln": value}, ln_gamma]}}, None]}
+
+def _group_by(key, ln_gamma):
+    """ Sums per (key, revenue bucket); expects units/subtotal/discount/revenue fields """
+    return {"$group": {
+        "_id": {"key": key, "bucket": _bucket_expr("$revenue", ln_gamma)},
+        "transactions": {"$sum": 1}, "units": {"$sum": "$units"},
+        "subtotal": {"$sum": "$subtotal"}, "discount": {"$sum": "$discount"}, "revenue": {"$sum": "$revenue"}
+    }}
+
+def _build_report_pipeline(start, end, ln_gamma):
+    """ One pass over a day's transactions, returning partials for every dimension """
+    return [
+        {"$match": {"timestamp": {"$gte": start, "$lt": end}}}, # Uses the partition's timestamp index
+        {"$project": {
+            "items.category": 1, "items.price_at_sale": 1, "items.quantity_sold": 1,
+            "units": {"$sum": "$items.quantity_sold"},
+            "subtotal": {"$ifNull": ["$subtotal", 0]},
+            "discount": {"$ifNull": ["$discount_applied", 0]},
+            "revenue": {"$ifNull": ["$total_amount", 0]},
+            "till": {"$ifNull": ["$till_id", "unknown"]}, # Receipts from before till ids
+            "payment_method": {"$ifNull": ["$payment_method", "unknown"]},
+            "discount_tier": _discount_tier_expr(),
+        }},
+        {"$facet": {
+            "total": [_group_by("all", ln_gamma)],
+            "till": [_group_by("$till", ln_gamma)],
+            "payment_method": [_group_by("$payment_method", ln_gamma)],
+            "discount_tier": [_group_by("$discount_tier", ln_gamma)],
+            # Per category and basket: the receipt's discount is shared by line value
+            "category": [
+                {"$unwind": "$items"},
+                {"$group": {
+                    "_id": {"transaction": "$_id", "category": "$items.category"},
+                    "units": {"$sum": "$items.quantity_sold"},
+                    "line_total": {"$sum": {"$multiply": ["$items.price_at_sale", "$items.quantity_sold"]}},
+                    "basket_subtotal": {"$first": "$subtotal"},
+                    "basket_discount": {"$first": "$discount"},
+                }},
+                {"$project": {
+                    "category": "$_id.category", "units": 1, "subtotal": "$line_total",
+                    "discount": {"$cond": [
+                        {"$gt": ["$basket_subtotal", 0]},
+                        {"$multiply": ["$basket_discount", {"$divide": ["$line_total", "$basket_subtotal"]}]},
+                        0
+                    ]},
+                }},
+                {"$addFields": {"revenue": {"$subtract": ["$subtotal", "$discount"]}}},
+                _group_by("$category", ln_gamma),
+            ],
+        }},
+    ]
+
+def _aggregate_location(shard_id, name, start, end, ln_gamma):
+    """ Partial rows {dimension, key, bucket, sums...} from one hot collection """
+    coll = transaction_store.get_collection(shard_id, name)
+    result = next(coll.aggregate(_build_report_pipeline(start, end, ln_gamma), allowDiskUse=True), {})
+    rows = []
+    for dimension in DIMENSIONS:
+        for doc in result.get(dimension, []):
+            rows.append({"dimension": dimension, "key": doc["_id"]["key"], "bucket": doc["_id"]["bucket"],
+                         "transactions": doc["transactions"], "units": doc["units"],
+                         "subtotal": doc["subtotal"], "discount": doc["discount"], "revenue": doc["revenue"]})
+    return rows
+
+
+# --- ARCHIVED DAYS ---
+def _discount_tier(subtotal, discount):
+    ratio = discount / subtotal if subtotal > 0 else 0
+    for tier, bound in DISCOUNT_TIERS:
+        if bound is not None and ratio <= bound + _TIER_EPSILON:
+            return tier
+    return DISCOUNT_TIERS[-1][0]
+
+def _partials_from_docs(docs, sketch):
+    """ The pipeline's partial rows, computed in Python (for archived partitions) """
+    partials = {}
+    def add(dimension, key, units, subtotal, discount, revenue):
+        bucket = sketch.bucket_index(revenue)
+        row = partials.setdefault((dimension, key, bucket), {
+            "dimension": dimension, "key": key, "bucket": bucket,
+            "transactions": 0, "units": 0, "subtotal": 0, "discount": 0, "revenue": 0
+        })
+        row["transactions"] += 1
+        row["units"] += units
+        row["subtotal"] += subtotal
+        row["discount"] += discount
+        row["revenue"] += revenue
+
+    for doc in docs:
+        items = doc.get("items", [])
+        subtotal = doc.get("subtotal") or 0
+        discount = doc.get("discount_applied") or 0
+        revenue = doc.get("total_amount") or 0
+        units = sum(item.get("quantity_sold", 0) for item in items)
+        add("total", "all", units, subtotal, discount, revenue)
+        add("till", doc.get("till_id") or "unknown", units, subtotal, discount, revenue)
+        add("payment_method", doc.get("payment_method") or "unknown", units, subtotal, discount, revenue)
+        add("discount_tier", _discount_tier(subtotal, discount), units, subtotal, discount, revenue)
+
+        by_category = {}
+        for item in items:
+            entry = by_category.setdefault(item.get("category"), [0, 0])
+            entry[0] += item.get("quantity_sold", 0)
+            entry[1] += item.get("price_at_sale", 0) * item.get("quantity_sold", 0)
+        for category, (category_units, line_total) in by_category.items():
+            share = discount * line_total / subtotal if subtotal > 0 else 0
+            add("category", category, category_units, line_total, share, line_total - share)
+    return list(partials.values())
+
+
+# --- MERGING ---
+def _merge_rows(totals, rows):
+    for row in rows:
+        entry = totals.get((row["dimension"], row["key"]))
+        if entry is None:
+            entry = totals[(row["dimension"], row["key"])] = {
+                "transactions": 0, "units": 0, "subtotal": 0, "discount": 0, "revenue": 0,
+                "sketch": LogHistogram()
+            }
+        for field in ("transactions", "units", "subtotal", "discount", "revenue"):
+            entry[field] += row[field]
+        entry["sketch"].add_bucket(row["bucket"], row["transactions"])
+
+def _day_bounds(day):
+    """ [start, end) of a local calendar day, as aware datetimes """
+    start = datetime.combine(day, time.min).astimezone()
+    return start, (start + timedelta(days=1)).astimezone()
+
+def build_daily_report(day=None, max_workers=MAX_PARALLEL_QUERIES):
+    """
+    Totals for one local calendar day (default: today).
+    Returns {day, rows, sources, failed, seconds}; 'rows' follow REPORT_COLUMNS,
+    'failed' lists collections that could not be read (the report is short).
+    """
+    day = day or date.today()
+    start, end = _day_bounds(day)
+    started = timeit.default_timer()
+    ln_gamma = LogHistogram().ln_gamma
+    totals, failed = {}, []
+
+    locations = transaction_store.hot_collections(start, end)
+    with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(locations)))) as pool:
+        futures = {
+            pool.submit(_aggregate_location, shard_id, name, start, end, ln_gamma): (shard_id, name)
+            for shard_id, name in locations
+        }
+        for future in as_completed(futures):
+            shard_id, name = futures[future]
+            try:
+                _merge_rows(totals, future.result())
+            except Exception as e:
+                print(f"Error aggregating {name} on Shard DB{shard_id + 1}: {e}")
+                failed.append(f"{name}@DB{shard_id + 1}")
+
+    archived = transaction_store.iter_archived_transactions(start, end, skip=locations)
+    _merge_rows(totals, _partials_from_docs(archived, LogHistogram()))
+
+    rows = []
+    for (dimension, key), entry in totals.items():
+        row = {"dimension": dimension, "key": key}
+        for field in ("transactions", "units"):
+            row[field] = entry[field]
+        for field in ("subtotal", "discount", "revenue"):
+            row[field] = round(entry[field], 2)
+        row["avg_basket"] = round(entry["revenue"] / entry["transactions"], 2) if entry["transactions"] else 0
+        for q in PERCENTILES:
+            value = entry["sketch"].quantile(q)
+            row[f"p{round(q * 100)}"] = round(value, 2) if value is not None else None
+        rows.append(row)
+    rows.sort(key=lambda row: (DIMENSIONS.index(row["dimension"]), -row["revenue"], str(row["key"])))
+
+    return {"day": day, "rows": rows, "sources": len(locations), "failed": failed,
+            "seconds": timeit.default_timer() - started}
+
+
+# --- OUTPUT ---
+def write_csv(report, path):
+    with open(path, "w", newline="", encoding="utf-8") as f:
+        writer = csv.DictWriter(f, fieldnames=REPORT_COLUMNS)
+        writer.writeheader()
+        writer.writerows(report["rows"])
+    return path
+
+def write_parquet(report, path):
+    if pyarrow is None:
+        raise ImportError("Writing Parquet reports requires the 'pyarrow' package")
+    columns = {column: [row[column] for row in report["rows"]] for column in REPORT_COLUMNS}
+    columns["key"] = [str(key) for key in columns["key"]] # Keys may be None for old receipts
+    pyarrow.parquet.write_table(pyarrow.table(columns), path)
+    return path
+
+def write_report(report, out_dir=REPORT_DIR, formats=("csv", "parquet")):
+    """ Writes eod_<day>.csv / .parquet to 'out_dir'; returns the paths written """
+    os.makedirs(out_dir, exist_ok=True)
+    base = os.path.join(out_dir, f"eod_{report['day']:%Y-%m-%d}")
+    paths = []
+    if "csv" in formats:
+        paths.append(write_csv(report, base + ".csv"))
+    if "parquet" in formats:
+        if pyarrow is None:
+            print("pyarrow is not installed; skipping the Parquet report.")
+        else:
+            paths.append(write_parquet(report, base + ".parquet"))
+    return paths
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="End-of-day sales report")
+    parser.add_argument("--day", type=date.fromisoformat, help="YYYY-MM-DD (default: today)")
+    parser.add_argument("--out", default=REPORT_DIR, help="Output directory")
+    parser.add_argument("--format", nargs="+", choices=["csv", "parquet"], default=["csv", "parquet"])
+    args = parser.parse_args()
+
+    report = build_daily_report(args.day)
+    for row in report["rows"]:
+        if row["dimension"] == "total":
+            print(f"{report['day']}: {row['transactions']} sales, {row['revenue']:.2f} BDT "
+                  f"(median basket {row['p50']}, p90 {row['p90']})")
+    if report["failed"]:
+        print(f"Warning: report is missing {', '.join(report['failed'])}")
+    for path in write_report(report, args.out, args.format):
+        print(f"Wrote {path}")
+    print(f"Aggregated {report['sources']} collections in {report['seconds']:.2f}s")
@@ -0,0 +1,204 @@
+from .db_connector import db_connection
+from . import shard_health, shard_routing
+from bson.objectid import ObjectId
+from datetime import datetime, timedelta, timezone
+import pymongo
+import threading
+import time
+import os
+
+# --- STOCK RESERVATIONS ---
+# A till holds stock for each cart line while the customer is at the
+# counter, so the last unit of a fast seller is claimed when it is scanned,
+# not discovered gone halfway through record_sale's multi-shard transaction.
+#
+# On the product's inventory shard, 'stock.reserved' counts the held units
+# (available = quantity - reserved) and 'stock_holds' has one document per
+# (cart, product). Both change together in a single-shard transaction.
+# A hold lasts RESERVATION_TTL_SECONDS from the line's last change; expired
+# holds are given back by a background sweep. At checkout record_sale
+# deletes the cart's holds and takes the units in the same transaction.
+# Hold changes only move 'reserved' (not 'last_updated'), so stock_watcher
+# does not publish them: other tills are not repainted for every click.
+RESERVATION_TTL_SECONDS = int(os.getenv("RESERVATION_TTL_SECONDS", "600")) # 10 minutes
+SWEEP_INTERVAL_SECONDS = 30
+HOLDS_COLLECTION = "stock_holds"
+NUM_INVENTORY_SHARDS = 3 # DB1, DB2, DB3
+
+_indexes_created = set()
+_sweeper = None
+_sweeper_lock = threading.Lock()
+
+
+def _get_shard(shard_id):
+    db_shard = db_connection.get_inventory_shard(shard_id)
+    if db_shard is None:
+        raise ConnectionError(f"Fatal: Could not connect to inventory shard DB{shard_id + 1}")
+    return db_shard
+
+def _ensure_indexes(shard_id, db_shard):
+    if shard_id in _indexes_created: return
+    holds = db_shard[HOLDS_COLLECTION]
+    holds.create_index([("cart_id", pymongo.ASCENDING), ("product_id", pymongo.ASCENDING)], unique=True)
+    holds.create_index([("expires_at", pymongo.ASCENDING)])
+    _indexes_created.add(shard_id)
+
+def available_at_least(quantity, held=0):
+    """ $expr: quantity - (reserved - held) >= 'quantity' (held = units the caller already holds) """
+    return {"$expr": {"$gte": [
+        {"$subtract": [{"$add": ["$quantity", held]}, {"$ifNull": ["$reserved", 0]}]}, quantity
+    ]}}
+
+def _run_in_transaction(shard_id, func):
+    client = db_connection.client
+    if client is None:
+        raise ConnectionError("Fatal: MongoDB client not available")
+    db_shard = _get_shard(shard_id)
+    _ensure_indexes(shard_id, db_shard)
+    with shard_health.guard(shard_id):
+        with client.start_session() as session:
+            with session.start_transaction():
+                result = func(db_shard, session)
+    return result
+
+
+# --- HOLDS ---
+def reserve(cart_id, shard_id, product_id, quantity=1):
+    """
+    Holds 'quantity' more units of a product for a cart line and restarts
+    the line's expiry. Returns the units now held for the line.
+    Raises ValueError if fewer than 'quantity' units are free.
+    """
+    product_id_obj = ObjectId(product_id)
+    expires_at = datetime.now(timezone.utc) + timedelta(seconds=RESERVATION_TTL_SECONDS)
+    _start_sweeper()
+
+    def hold(db_shard, session):
+        stock_doc = db_shard["stock"].find_one_and_update(
+            {"product_id": product_id_obj, **available_at_least(quantity)},
+            {"$inc": {"reserved": quantity}},
+            return_document=pymongo.ReturnDocument.AFTER, session=session
+        )
+        if stock_doc is None:
+            return None
+        hold_doc = db_shard[HOLDS_COLLECTION].find_one_and_update(
+            {"cart_id": cart_id, "product_id": product_id_obj},
+            {"$inc": {"quantity": quantity}, "$set": {"expires_at": expires_at}},
+            upsert=True, return_document=pymongo.ReturnDocument.AFTER, session=session
+        )
+        return hold_doc["quantity"]
+
+    held = _run_in_transaction(shard_id, hold)
+    if held is None:
+        # Units held by abandoned carts may be free again
+        if sweep_expired(shard_id, product_id_obj):
+            held = _run_in_transaction(shard_id, hold)
+    if held is None:
+        stock_doc = _get_shard(shard_id)["stock"].find_one({"product_id": product_id_obj})
+        if stock_doc is None:
+            raise ValueError(f"Product ID {product_id} has no stock on Shard DB{shard_id + 1}.")
+        available = stock_doc.get("quantity", 0) - stock_doc.get("reserved", 0)
+        raise ValueError(f"Only {max(available, 0)} unit(s) available.")
+    return held
+
+def release(cart_id, shard_id, product_id, quantity=None):
+    """ Gives back 'quantity' held units of a cart line (None = the whole hold); returns units still held """
+    product_id_obj = ObjectId(product_id)
+
+    def give_back(db_shard, session):
+        holds = db_shard[HOLDS_COLLECTION]
+        hold_doc = holds.find_one({"cart_id": cart_id, "product_id": product_id_obj}, session=session)
+        if hold_doc is None:
+            return 0
+        returned = hold_doc["quantity"] if quantity is None else min(quantity, hold_doc["quantity"])
+        if returned == hold_doc["quantity"]:
+            holds.delete_one({"_id": hold_doc["_id"]}, session=session)
+        else:
+            holds.update_one({"_id": hold_doc["_id"]}, {"$inc": {"quantity": -returned}}, session=session)
+        db_shard["stock"].update_one(
+            {"product_id": product_id_obj}, {"$inc": {"reserved": -returned}}, session=session
+        )
+        return hold_doc["quantity"] - returned
+
+    return _run_in_transaction(shard_id, give_back)
+
+def release_cart(cart_id):
+    """ Gives back every hold of a cart (cleared or abandoned sale); returns the lines released """
+    released = 0
+    for shard_id in shard_routing.inventory_shard_ids(NUM_INVENTORY_SHARDS):
+        try:
+            holds = _get_shard(shard_id)[HOLDS_COLLECTION].find({"cart_id": cart_id}, {"product_id": 1})
+            for hold_doc in holds:
+                release(cart_id, shard_id, hold_doc["product_id"])
+                released += 1
+        except Exception as e:
+            # Whatever is left expires on its own
+            print(f"Could not release holds on Shard DB{shard_id + 1}: {e}")
+    return released
+
+def take_hold(db_shard, cart_id, product_id_obj, session=None):
+    """
+    For record_sale: removes a cart's hold on a product inside the sale's
+    transaction and returns the units it held (0 if none, e.g. it expired).
+    """
+    if not cart_id:
+        return 0
+    hold_doc = db_shard[HOLDS_COLLECTION].find_one_and_delete(
+        {"cart_id": cart_id, "product_id": product_id_obj}, session=session
+    )
+    return hold_doc["quantity"] if hold_doc else 0
+
+async def take_hold_async(db_shard, cart_id, product_id_obj, session=None):
+    """ take_hold on an AsyncMongoClient shard (async_db.record_sale) """
+    if not cart_id:
+        return 0
+    hold_doc = await db_shard[HOLDS_COLLECTION].find_one_and_delete(
+        {"cart_id": cart_id, "product_id": product_id_obj}, session=session
+    )
+    return hold_doc["quantity"] if hold_doc else 0
+
+
+# --- EXPIRY SWEEP ---
+def _expire_hold(shard_id, hold_id):
+    def expire(db_shard, session):
+        # Re-checked inside the transaction: the cart may have checked out or renewed it meanwhile
+        expired = db_shard[HOLDS_COLLECTION].find_one_and_delete(
+            {"_id": hold_id, "expires_at": {"$lt": datetime.now(timezone.utc)}}, session=session
+        )
+        if expired is None:
+            return 0
+        db_shard["stock"].update_one(
+            {"product_id": expired["product_id"]}, {"$inc": {"reserved": -expired["quantity"]}}, session=session
+        )
+        return 1
+    return _run_in_transaction(shard_id, expire)
+
+def sweep_expired(shard_id, product_id_obj=None):
+    """ Gives back expired holds on one shard (optionally one product's); returns how many """
+    query = {"expires_at": {"$lt": datetime.now(timezone.utc)}}
+    if product_id_obj is not None:
+        query["product_id"] = product_id_obj
+    swept = 0
+    for hold_doc in _get_shard(shard_id)[HOLDS_COLLECTION].find(query, {"_id": 1}):
+        swept += _expire_hold(shard_id, hold_doc["_id"])
+    if swept:
+        print(f"Released {swept} expired stock hold(s) on Shard DB{shard_id + 1}")
+    return swept
+
+def _sweep_forever():
+    while True:
+        for shard_id in shard_routing.inventory_shard_ids(NUM_INVENTORY_SHARDS):
+            if not shard_health.is_available(shard_id):
+                continue
+            try:
+                sweep_expired(shard_id)
+            except Exception as e:
+                print(f"Error sweeping stock holds on Shard DB{shard_id + 1}: {e}")
+        time.sleep(SWEEP_INTERVAL_SECONDS)
+
+def _start_sweeper():
+    global _sweeper
+    with _sweeper_lock:
+        if _sweeper is None or not _sweeper.is_alive():
+            _sweeper = threading.Thread(target=_sweep_forever, name="stock-hold-sweeper", daemon=True)
+            _sweeper.start()
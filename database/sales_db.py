@@ -1,7 +1,10 @@
 from .db_connector import db_connection
+from . import catalog_store, reservations, shard_health, shard_routing, transaction_store
 from datetime import datetime, timezone
 from bson.objectid import ObjectId
 import pymongo
+import socket
+import os
 import re
 
 # Get database handles for CENTRAL DBs
@@ -12,16 +15,115 @@ if db_sales is None: raise ConnectionError("Fatal: Could not connect to ShopSale
 
 # --- PERMANENT FRAGMENTATION ---
 sold_items_coll = db_sales["Sold_Items"] # Central analytics
-# 'transactions_coll' is dynamic and lives on the inventory shards
+# 'transactions_coll' is dynamic: monthly partitions on the inventory shards
+# (see transaction_store)
+
+NUM_INVENTORY_SHARDS = 3 # DB1, DB2, DB3
+TILL_ID = os.getenv("TILL_ID") or socket.gethostname() # Stamped on receipts for per-till reports
+
+def _product_shard_candidates(hint_shard_id):
+    """ Shards to look for a cart item on: its own shard_id first, then the rest (skipping shards that are down) """
+    return [hint_shard_id] + [s for s in shard_routing.inventory_shard_ids(NUM_INVENTORY_SHARDS)
+                              if s != hint_shard_id and shard_health.is_available(s)]
+
+def _locate_product(product_id_obj, hint_shard_id, session=None):
+    """
+    Finds a cart item's product and the shard that owns it now.
+    A cart's shard_id goes stale when shard_migration moves the category,
+    so the routing table wins over the copy left on the old shard.
+    Returns (shard_id, product).
+    """
+    for shard_id in _product_shard_candidates(hint_shard_id):
+        db_shard = db_connection.get_inventory_shard(shard_id)
+        if db_shard is None:
+            raise ConnectionError(f"Could not connect to Inventory Shard DB{shard_id + 1}")
+        with shard_health.guard(shard_id):
+            product = db_shard["products"].find_one({"_id": product_id_obj}, session=session)
+        if not product:
+            continue
+        routed_shard_id = shard_routing.get_route(product.get("category"))
+        if routed_shard_id is not None and routed_shard_id != shard_id:
+            with shard_health.guard(routed_shard_id):
+                moved = db_connection.get_inventory_shard(routed_shard_id)["products"].find_one(
+                    {"_id": product_id_obj}, session=session
+                )
+            if moved:
+                return routed_shard_id, moved
+        return shard_id, product
+    raise ValueError(f"Product ID {product_id_obj} not found on Shard DB{hint_shard_id + 1}.")
+
+def _stock_decrement(product_id_obj, quantity_sold, held=0, price_version=None):
+    """
+    (filter, update) that takes 'quantity_sold' units only if they are in
+    stock and not held for other carts. 'held' is this cart's own hold on
+    the product, which the sale converts (see reservations). With
+    price_version, it also requires the price not to have changed since
+    the cart's snapshot (the version is mirrored on stock, see pricing).
+    """
+    increments = {"quantity": -quantity_sold}
+    if held:
+        increments["reserved"] = -held
+    stock_filter = {"product_id": product_id_obj, **reservations.available_at_least(quantity_sold, held)}
+    if price_version is not None:
+        stock_filter["price_version"] = {"$in": [0, None]} if price_version == 0 else price_version
+    return (
+        stock_filter,
+        {"$inc": increments, "$set": {"last_updated": datetime.now(timezone.utc)}}
+    )
+
+def _sale_price(item, product):
+    """
+    The unit price to charge: the cart's snapshot if it is still the
+    current price (same price_version), else the product's price for
+    callers that send no snapshot. A stale snapshot is refused.
+    """
+    if "price_version" not in item:
+        return product["price"]
+    current_price = catalog_store.to_price(product.get("price"))
+    price = catalog_store.to_price(item.get("price"))
+    if item["price_version"] != product.get("price_version", 0) or abs(price - current_price) > 0.005:
+        raise ValueError(f"Price of {product['name']} changed to {current_price:.2f} BDT; update the cart.")
+    return price
+
+def _stock_failure(product, stock_doc, item, shard_id):
+    """ Why a conditional stock update matched nothing (read only after it failed) """
+    if stock_doc is not None and "price_version" in item and \
+            stock_doc.get("price_version", 0) != item["price_version"]:
+        return ValueError(f"Price of {product['name']} changed during checkout; update the cart.")
+    return ValueError(f"Out of stock for product: {product['name']} on Shard DB{shard_id + 1}.")
+
+def _new_transaction_location():
+    """
+    Picks the new transaction's _id, timestamp and (shard, monthly partition)
+    up front, so the partition can be created before the transaction starts.
+    """
+    transaction_id = ObjectId()
+    timestamp = datetime.now(timezone.utc)
+    shard_id, partition = transaction_store.get_location(transaction_id, timestamp)
+    transaction_store.ensure_partition(shard_id, partition)
+    return transaction_id, timestamp, shard_id, partition
+
+def _build_transaction_doc(transaction_id, timestamp, subtotal, discount_applied, member_id, item_docs, till_id=None):
+    return {
+        "_id": transaction_id, "timestamp": timestamp,
+        "subtotal": subtotal, "discount_applied": discount_applied,
+        "total_amount": subtotal - discount_applied, "member_id": member_id, # Store the ObjectId or None
+        "payment_method": "cash", "till_id": till_id or TILL_ID, "items": item_docs
+    }
 
 # --- MODIFIED: Accepts member_info dict ---
-def record_sale(member_info, items_sold, discount_applied=0):
+def record_sale(member_info, items_sold, discount_applied=0, till_id=None, cart_id=None):
     """
     Processes a sale as an ATOMIC TRANSACTION.
-    1. Writes receipt to the correct price-based transaction SHARD (DB1 or DB2).
+    1. Writes receipt to this month's transaction partition on its hashed SHARD.
     2. Updates stock on the correct inventory SHARD (DB1, DB2, or DB3).
     3. Updates the CENTRAL 'Sold_Items' analytics collection.
     4. Updates points on the correct member SHARD (DB1, DB2, or DB3).
+    With cart_id, the cart's stock holds are converted into the sale.
+    Items with a price snapshot (price, price_version) are charged that
+    price, or refused if the product has been repriced since.
+    Raises ValueError when the sale is refused (out of stock, price
+    changed); returns None if the transaction failed for another reason.
     """
 
     client = db_connection.client
@@ -30,42 +132,53 @@ def record_sale(member_info, items_sold, discount_applied=0):
 
     if not items_sold:
         raise ValueError("Cannot record a sale with no items.")
-        
-    with client.start_session() as session:
-        with session.start_transaction():
-            try:
+
+    # Refuse at once (instead of timing out mid-transaction) only if a shard this sale needs is down.
+    # Each shard access below also runs under shard_health.guard, so failures open the circuit.
+    needed_shards = {item["shard_id"] for item in items_sold}
+    if member_info:
+        needed_shards.add(member_info['shard_id'])
+    for shard_id in sorted(needed_shards):
+        if not shard_health.is_available(shard_id):
+            raise shard_health.ShardUnavailable(shard_id)
+
+    # Exceptions must leave the 'with' blocks so the transaction is aborted
+    # (returning from inside start_transaction() would commit it).
+    try:
+        transaction_id, timestamp, transaction_shard_id, partition = _new_transaction_location()
+        with client.start_session() as session:
+            with session.start_transaction():
                 subtotal = 0
-                permanent_item_docs = [] 
+                permanent_item_docs = []
+                updated_stock = [] # (shard_id, stock doc after the sale)
 
                 for item in items_sold:
                     quantity_sold = item["quantity"]
                     product_id_obj = ObjectId(item["product_id"])
-                    inventory_shard_id = item["shard_id"] 
-
-                    # 1. Connect to the correct INVENTORY shard DB for *this item*
-                    db_inventory_shard_for_item = db_connection.get_inventory_shard(inventory_shard_id)
-                    if db_inventory_shard_for_item is None:
-                        raise ConnectionError(f"Could not connect to Inventory Shard DB{inventory_shard_id + 1}")
-                    shard_products_coll = db_inventory_shard_for_item["products"]
-                    shard_stock_coll = db_inventory_shard_for_item["stock"]
 
-                    # 2. Find the product *on its specific inventory shard*
-                    product = shard_products_coll.find_one({"_id": product_id_obj}, session=session)
-                    if not product:
-                        raise ValueError(f"Product ID {product_id_obj} not found on Shard DB{inventory_shard_id + 1}.")
+                    # 1-2. Find the product and the INVENTORY shard that owns it
+                    inventory_shard_id, product = _locate_product(product_id_obj, item["shard_id"], session)
 
-                    price = product["price"]
+                    price = _sale_price(item, product)
                     category = product.get("category", "UncategorIZED").strip() or "Uncategorized"
                     subtotal += price * quantity_sold
 
-                    # 3. Update stock *on its specific inventory shard*
-                    stock_update_result = shard_stock_coll.update_one(
-                        {"product_id": product_id_obj, "quantity": {"$gte": quantity_sold}},
-                        {"$inc": {"quantity": -quantity_sold}, "$set": {"last_updated": datetime.now(timezone.utc)}},
-                        session=session
-                    )
-                    if stock_update_result.matched_count == 0:
-                        raise ValueError(f"Out of stock for product: {product['name']} on Shard DB{inventory_shard_id + 1}.")
+                    # 3. Update stock *on its specific inventory shard* (our own hold becomes the sale)
+                    db_inventory_shard = db_connection.get_inventory_shard(inventory_shard_id)
+                    with shard_health.guard(inventory_shard_id):
+                        held = reservations.take_hold(db_inventory_shard, cart_id, product_id_obj, session)
+                        stock_filter, stock_update = _stock_decrement(
+                            product_id_obj, quantity_sold, held, item.get("price_version")
+                        )
+                        stock_doc = db_inventory_shard["stock"].find_one_and_update(
+                            stock_filter, stock_update,
+                            return_document=pymongo.ReturnDocument.AFTER,
+                            session=session
+                        )
+                        if stock_doc is None:
+                            current_stock = db_inventory_shard["stock"].find_one({"product_id": product_id_obj}, session=session)
+                            raise _stock_failure(product, current_stock, item, inventory_shard_id)
+                    updated_stock.append((inventory_shard_id, stock_doc))
 
                     # 4. --- UPDATE CENTRAL 'Sold_Items' AGGREGATED FRAGMENT ---
                     update_result = sold_items_coll.update_one(
@@ -98,26 +211,15 @@ def record_sale(member_info, items_sold, discount_applied=0):
                     member_id = ObjectId(member_info['doc']['_id']) 
 
                 # --- Step 7: Build the final transaction document ---
-                transaction_doc = {
-                    "_id": ObjectId(), "timestamp": datetime.now(timezone.utc),
-                    "subtotal": subtotal, "discount_applied": discount_applied,
-                    "total_amount": final_total, "member_id": member_id, # Store the ObjectId or None
-                    "payment_method": "cash", "items": permanent_item_docs
-                }
-
-                # --- Step 8: TRANSACTION SHARDING LOGIC (Price-based) ---
-                if final_total <= 1000:
-                    transaction_shard_id = 0 # Corresponds to DB1
-                else:
-                    transaction_shard_id = 1 # Corresponds to DB2
-                
-                print(f"Saving transaction to Shard DB{transaction_shard_id + 1} (Total: {final_total})")
-                db_transaction_shard = db_connection.get_inventory_shard(transaction_shard_id)
-                if db_transaction_shard is None:
-                    raise ConnectionError(f"Could not connect to Transaction Shard DB{transaction_shard_id + 1}")
-                
-                transactions_coll = db_transaction_shard["transactions"]
-                trans_result = transactions_coll.insert_one(transaction_doc, session=session)
+                transaction_doc = _build_transaction_doc(
+                    transaction_id, timestamp, subtotal, discount_applied, member_id, permanent_item_docs, till_id
+                )
+
+                # --- Step 8: TRANSACTION SHARDING LOGIC (Time-partitioned) ---
+                print(f"Saving transaction to {partition} on Shard DB{transaction_shard_id + 1} (Total: {final_total})")
+                transactions_coll = transaction_store.get_collection(transaction_shard_id, partition)
+                with shard_health.guard(transaction_shard_id):
+                    trans_result = transactions_coll.insert_one(transaction_doc, session=session)
 
                 # --- Step 9: UPDATE MEMBER LOYALTY ON THE CORRECT SHARD ---
                 if member_info: # Check if a member was part of the sale
@@ -130,15 +232,72 @@ def record_sale(member_info, items_sold, discount_applied=0):
                     points_earned = int(final_total)
                     
                     print(f"Updating points for member {member_id} on Shard DB{member_shard_id + 1}")
-                    member_coll.update_one(
-                        {"_id": member_id}, # Use the ObjectId
-                        {"$inc": {"points": points_earned}},
-                        session=session
-                    )
+                    with shard_health.guard(member_shard_id):
+                        member_coll.update_one(
+                            {"_id": member_id}, # Use the ObjectId
+                            {"$inc": {"points": points_earned}},
+                            session=session
+                        )
                 # --- END OF LOYALTY UPDATE ---
 
-                return str(trans_result.inserted_id)
+                transaction_id = str(trans_result.inserted_id)
+
+    except ValueError as e:
+        # Out of stock, price changed...: the cashier needs to see why
+        print(f"Transaction aborted: {e}")
+        raise
+    except Exception as e:
+        print(f"Transaction aborted: {e}")
+        return None
+
+    # Committed: keep this till's local catalog in step with the new stock
+    try:
+        for shard_id, stock_doc in updated_stock:
+            catalog_store.upsert_stock(shard_id, [stock_doc])
+    except Exception as e:
+        print(f"Could not update local catalog after sale: {e}")
+
+    return transaction_id
+
+# --- ANALYTICS VIEW ---
+# Price bands for the "Live Sales Fragment Viewer" (price per unit, BDT)
+SALES_FRAGMENTS = {
+    "budget": {"$lt": 100},
+    "midrange": {"$gte": 100, "$lte": 1000},
+    "premium": {"$gt": 1000},
+}
+def get_temp_sales(fragment, category=None, limit=100):
+    """
+    Returns the most recent sold items in a price fragment (budget,
+    midrange or premium), optionally filtered by category.
+    Queries the hot transaction collections and merges newest-first.
+    """
+    price_match = SALES_FRAGMENTS.get(fragment)
+    if price_match is None:
+        raise ValueError(f"Unknown sales fragment: {fragment}")
+
+    item_match = {"items.price_at_sale": price_match}
+    if category:
+        item_match["items.category"] = {"$regex": category, "$options": "i"}
+
+    pipeline = [
+        {"$sort": {"timestamp": -1}},
+        {"$limit": limit},
+        {"$unwind": "$items"},
+        {"$match": item_match},
+        {"$project": {
+            "_id": 0, "createdAt": "$timestamp",
+            "name": "$items.name", "category": "$items.category",
+            "quantity_sold": "$items.quantity_sold", "price_at_sale": "$items.price_at_sale"
+        }},
+    ]
+
+    sales = []
+    for shard_id, name in transaction_store.hot_collections():
+        try:
+            sales.extend(transaction_store.get_collection(shard_id, name).aggregate(pipeline))
+        except Exception as e:
+            print(f"Error reading sales from {name} on Shard DB{shard_id + 1}: {e}")
 
-            except Exception as e:
-                print(f"Transaction aborted: {e}")
-                return None
\ No newline at end of file
+    sales.sort(key=lambda sale: sale["createdAt"], reverse=True)
+    return sales[:limit]
@@ -0,0 +1,184 @@
+from .db_connector import db_connection
+from contextlib import contextmanager
+import pymongo
+import threading
+import time
+
+# --- SHARD HEALTH (CIRCUIT BREAKERS) ---
+# One breaker per shard. After FAILURE_THRESHOLD consecutive connection
+# failures it opens: calls to that shard fail at once (ShardUnavailable)
+# instead of each waiting out the driver's server-selection timeout. A
+# background prober pings open shards with a short timeout; after
+# OPEN_SECONDS a breaker goes half-open and lets one trial call through -
+# success closes it, failure re-opens it with a longer wait.
+#
+#   closed --failures--> open --OPEN_SECONDS--> half_open --ok--> closed
+#                          ^------------------------fail-----'
+FAILURE_THRESHOLD = 3
+OPEN_SECONDS = 10 # First wait before a trial call
+MAX_OPEN_SECONDS = 120 # Backoff cap after repeated failed trials
+PROBE_INTERVAL_SECONDS = 5
+PROBE_TIMEOUT_MS = 1500
+
+# Errors that say the shard is unreachable (not that the query was bad)
+SHARD_DOWN_ERRORS = (
+    pymongo.errors.ConnectionFailure, # Includes AutoReconnect, NetworkTimeout, ServerSelectionTimeoutError
+    pymongo.errors.ExecutionTimeout,
+)
+
+
+class ShardUnavailable(ConnectionError):
+    def __init__(self, shard_id, reason="circuit open"):
+        super().__init__(f"Shard DB{shard_id + 1} is unavailable ({reason})")
+        self.shard_id = shard_id
+
+
+class CircuitBreaker:
+    def __init__(self, shard_id):
+        self.shard_id = shard_id
+        self.state = "closed"
+        self.failures = 0
+        self.open_seconds = OPEN_SECONDS
+        self.retry_at = 0
+        self.trial_in_flight = False
+        self.trial_started = 0
+        self.last_error = None
+        self.lock = threading.Lock()
+
+    def allow(self):
+        """ True if a call may go to the shard now (claims the trial slot when half-open) """
+        with self.lock:
+            if self.state == "closed":
+                return True
+            if self.state == "open" and time.time() >= self.retry_at:
+                self.state = "half_open"
+                self.trial_in_flight = False
+            # A trial that never reported back (caller died) frees the slot after OPEN_SECONDS
+            trial_lost = self.trial_in_flight and time.time() - self.trial_started > OPEN_SECONDS
+            if self.state == "half_open" and (not self.trial_in_flight or trial_lost):
+                self.trial_in_flight = True
+                self.trial_started = time.time()
+                return True
+            return False
+
+    def record_success(self):
+        with self.lock:
+            if self.state != "closed":
+                print(f"Shard DB{self.shard_id + 1} is reachable again; circuit closed.")
+            self.state = "closed"
+            self.failures = 0
+            self.open_seconds = OPEN_SECONDS
+            self.trial_in_flight = False
+
+    def record_failure(self, error=None):
+        with self.lock:
+            self.last_error = str(error) if error else None
+            self.failures += 1
+            if self.state == "half_open":
+                self.open_seconds = min(self.open_seconds * 2, MAX_OPEN_SECONDS)
+            elif self.state == "closed" and self.failures < FAILURE_THRESHOLD:
+                return
+            if self.state != "open":
+                print(f"Shard DB{self.shard_id + 1} unavailable; circuit open for {self.open_seconds}s ({error})")
+            self.state = "open"
+            self.retry_at = time.time() + self.open_seconds
+            self.trial_in_flight = False
+        _start_prober()
+
+
+_breakers = {}
+_breakers_lock = threading.Lock()
+_prober = None
+_probe_client = None
+
+
+def get_breaker(shard_id):
+    with _breakers_lock:
+        if shard_id not in _breakers:
+            _breakers[shard_id] = CircuitBreaker(shard_id)
+        return _breakers[shard_id]
+
+def is_available(shard_id):
+    """ False while the shard's circuit is open (no trial slot is claimed) """
+    breaker = get_breaker(shard_id)
+    return breaker.state == "closed" or (breaker.state == "open" and time.time() >= breaker.retry_at)
+
+def check(shard_id):
+    """ Raises ShardUnavailable if calls to the shard should fail fast """
+    if not get_breaker(shard_id).allow():
+        raise ShardUnavailable(shard_id)
+
+def record_success(shard_id):
+    get_breaker(shard_id).record_success()
+
+def record_failure(shard_id, error=None):
+    get_breaker(shard_id).record_failure(error)
+
+@contextmanager
+def guard(shard_id):
+    """
+    Wraps calls to one shard: fails fast while its circuit is open and
+    feeds the outcome to the breaker. Connection failures come out as
+    ShardUnavailable; other errors pass through (the shard did answer).
+    A ShardUnavailable from a nested guard says nothing about this shard.
+    """
+    check(shard_id)
+    try:
+        yield
+    except ShardUnavailable:
+        raise
+    except SHARD_DOWN_ERRORS as e:
+        record_failure(shard_id, e)
+        raise ShardUnavailable(shard_id, type(e).__name__) from e
+    except Exception:
+        record_success(shard_id) # The shard answered; the request itself was bad
+        raise
+    record_success(shard_id)
+
+def status():
+    """ {shard_id: "closed" | "open" | "half_open"} for every shard seen so far """
+    with _breakers_lock:
+        return {shard_id: breaker.state for shard_id, breaker in _breakers.items()}
+
+
+# --- BACKGROUND PROBING ---
+def _get_probe_client():
+    """ A separate client with short timeouts, so probes never stall """
+    global _probe_client
+    if _probe_client is None:
+        _probe_client = pymongo.MongoClient(
+            db_connection.connection_string,
+            serverSelectionTimeoutMS=PROBE_TIMEOUT_MS, connectTimeoutMS=PROBE_TIMEOUT_MS,
+            socketTimeoutMS=PROBE_TIMEOUT_MS
+        )
+    return _probe_client
+
+def probe(shard_id):
+    """ Pings one shard; True if it answered """
+    try:
+        _get_probe_client()[f"DB{shard_id + 1}"].command("ping")
+        return True
+    except Exception:
+        return False
+
+def _probe_open_shards():
+    while True:
+        with _breakers_lock:
+            waiting = [breaker for breaker in _breakers.values() if breaker.state != "closed"]
+        if not waiting:
+            return # Restarted by the next failure
+        for breaker in waiting:
+            # The probe takes the half-open trial slot like any other call
+            if breaker.allow():
+                if probe(breaker.shard_id):
+                    breaker.record_success()
+                else:
+                    breaker.record_failure("probe failed")
+        time.sleep(PROBE_INTERVAL_SECONDS)
+
+def _start_prober():
+    global _prober
+    with _breakers_lock:
+        if _prober is None or not _prober.is_alive():
+            _prober = threading.Thread(target=_probe_open_shards, name="shard-prober", daemon=True)
+            _prober.start()
@@ -0,0 +1,267 @@
+from .db_connector import db_connection
+from . import inventory_db, shard_routing, supplier_cache
+from datetime import datetime, timedelta, timezone
+from pymongo import ReplaceOne, UpdateOne
+import argparse
+import hashlib
+import time
+
+# --- ONLINE CATEGORY MIGRATION ---
+# Moves one category (its products, their stock and the suppliers they
+# reference) to another inventory shard while tills keep selling:
+#
+#   1. route the category to its current shard in state "copying" (copies
+#      on the target are ignored by searches while they are incomplete)
+#   2. copy in throttled batches, then catch up with writes made meanwhile
+#      (new products, and edits such as repricing via 'updated_at')
+#   3. verify counts and checksums of the copied products; nothing has
+#      been switched yet, so a mismatch just stops the migration
+#   4. switch the route to the target (one document write)
+#   5. wait for every process to see the new route, catch up once more,
+#      then optionally purge the old copies
+#
+# Stock is caught up with deltas ($inc by how much the source changed since
+# it was copied), so sales on the target after the switch are never lost.
+#
+#   python -m database.shard_migration --category Electronics --to 3
+DEFAULT_BATCH_SIZE = 500
+DEFAULT_PAUSE_SECONDS = 0.05 # Between batches, to keep the shards responsive
+CATCH_UP_SETTLED = 10 # Switch once a catch-up pass applies this few changes
+MAX_CATCH_UP_ROUNDS = 20
+VERIFY_ATTEMPTS = 5 # Sales on the source can race a check; catch up and retry
+CLOCK_SKEW = timedelta(seconds=5) # Watermark margin for till clocks
+
+
+class MigrationError(Exception):
+    pass
+
+
+class CategoryMigration:
+    def __init__(self, category, target_shard_id, batch_size=DEFAULT_BATCH_SIZE, pause=DEFAULT_PAUSE_SECONDS):
+        self.category = category
+        self.source_shard_id = inventory_db._get_shard_id_for_category(category)
+        self.target_shard_id = target_shard_id
+        self.batch_size = batch_size
+        self.pause = pause
+        if self.source_shard_id == target_shard_id:
+            raise MigrationError(f"'{category}' is already on DB{target_shard_id + 1}")
+
+        self.source_db = db_connection.get_inventory_shard(self.source_shard_id)
+        self.target_db = db_connection.get_inventory_shard(target_shard_id)
+        if self.source_db is None or self.target_db is None:
+            raise ConnectionError("Fatal: Could not connect to the inventory shards")
+
+        self.supplier_map = {} # source supplier _id -> target supplier _id
+        self.copied_products = set()
+        self.copied_quantity = {} # product _id -> source quantity last applied to target
+        self.product_wm = None
+        self.stock_wm = None
+
+    def _log(self, message):
+        print(f"[{self.category} DB{self.source_shard_id + 1}->DB{self.target_shard_id + 1}] {message}")
+
+    # --- COPYING ---
+    def _map_supplier(self, supplier_id):
+        """ Target supplier _id for a source supplier (matched by name, else copied) """
+        if supplier_id is None or supplier_id in self.supplier_map:
+            return self.supplier_map.get(supplier_id)
+        supplier = self.source_db["suppliers"].find_one({"_id": supplier_id})
+        if supplier is None:
+            self.supplier_map[supplier_id] = supplier_id
+            return supplier_id
+        # Same normalized name on the target -> same supplier
+        self.supplier_map[supplier_id] = supplier_cache.copy_supplier(self.target_shard_id, supplier)[0]
+        return self.supplier_map[supplier_id]
+
+    def _copy_products(self, product_docs):
+        """
+        Upserts products (and first copies of their stock) on the target.
+        A product copied before is only replaced if the target's copy is
+        not newer (it may have been repriced there after the switch).
+        """
+        if not product_docs:
+            return 0
+        product_ops = []
+        for doc in product_docs:
+            doc["supplier_id"] = self._map_supplier(doc.get("supplier_id"))
+            if doc["_id"] not in self.copied_products:
+                product_ops.append(ReplaceOne({"_id": doc["_id"]}, doc, upsert=True))
+                continue
+            not_newer = [{"updated_at": {"$exists": False}}]
+            if doc.get("updated_at") is not None:
+                not_newer.append({"updated_at": {"$lte": doc["updated_at"]}})
+            product_ops.append(ReplaceOne({"_id": doc["_id"], "$or": not_newer}, doc))
+        self.target_db["products"].bulk_write(product_ops, ordered=False)
+        self.copied_products.update(doc["_id"] for doc in product_docs)
+
+        product_ids = [doc["_id"] for doc in product_docs]
+        stock_docs = list(self.source_db["stock"].find({"product_id": {"$in": product_ids}}))
+        self._apply_stock(stock_docs)
+        return len(product_docs)
+
+    def _apply_stock(self, stock_docs):
+        """
+        First sight of a product's stock copies the document; after that
+        only the change since the last copy is applied, as an $inc.
+        """
+        stock_ops = []
+        for doc in stock_docs:
+            product_id = doc["product_id"]
+            quantity = doc.get("quantity", 0)
+            if product_id not in self.copied_quantity:
+                # Holds stay on the source shard (and expire there), so their count is not copied
+                doc = {field: value for field, value in doc.items() if field != "reserved"}
+                stock_ops.append(ReplaceOne({"product_id": product_id}, doc, upsert=True))
+            else:
+                delta = quantity - self.copied_quantity[product_id]
+                if delta == 0:
+                    continue
+                # price_version only moves forward (see pricing): a source repricing is carried over
+                stock_ops.append(UpdateOne(
+                    {"product_id": product_id},
+                    {"$inc": {"quantity": delta}, "$set": {"last_updated": datetime.now(timezone.utc)},
+                     "$max": {"price_version": doc.get("price_version", 0)}}
+                ))
+            self.copied_quantity[product_id] = quantity
+        if stock_ops:
+            self.target_db["stock"].bulk_write(stock_ops, ordered=False)
+        return len(stock_ops)
+
+    def bulk_copy(self):
+        """ Copies every product of the category in throttled batches """
+        # Watermarks start *before* the copy so catch-up sees anything it missed
+        self.product_wm = self.stock_wm = datetime.now(timezone.utc) - CLOCK_SKEW
+        copied, last_id = 0, None
+        while True:
+            query = {"category": self.category}
+            if last_id is not None:
+                query["_id"] = {"$gt": last_id}
+            batch = list(self.source_db["products"].find(query).sort("_id", 1).limit(self.batch_size))
+            if not batch:
+                break
+            last_id = batch[-1]["_id"]
+            copied += self._copy_products(batch)
+            self._log(f"copied {copied} products")
+            time.sleep(self.pause)
+        return copied
+
+    def catch_up(self):
+        """ Applies writes made on the source since the last pass; returns how many """
+        started = datetime.now(timezone.utc) - CLOCK_SKEW
+        changed_products = list(self.source_db["products"].find({
+            "category": self.category,
+            "$or": [{"created_at": {"$gte": self.product_wm}}, {"updated_at": {"$gte": self.product_wm}}]
+        }))
+        applied = self._copy_products(changed_products)
+
+        changed_stock = [
+            doc for doc in self.source_db["stock"].find({"last_updated": {"$gte": self.stock_wm}})
+            if doc["product_id"] in self.copied_quantity
+        ]
+        applied += self._apply_stock(changed_stock)
+        self.product_wm = self.stock_wm = started
+        return applied
+
+    # --- SWITCHING ---
+    def cutover(self):
+        for round_number in range(1, MAX_CATCH_UP_ROUNDS + 1):
+            applied = self.catch_up()
+            self._log(f"catch-up round {round_number}: {applied} changes")
+            if applied <= CATCH_UP_SETTLED:
+                break
+            time.sleep(self.pause)
+        self._verify_before_switch()
+        shard_routing.set_route(self.category, self.target_shard_id, self.source_shard_id, "cutover")
+
+        # Processes re-read routes every ROUTING_REFRESH_SECONDS; until then a
+        # till may still write to the source, which the last passes pick up.
+        time.sleep(shard_routing.ROUTING_REFRESH_SECONDS + 1)
+        applied = self.catch_up() + self.catch_up()
+        self._log(f"final catch-up after switch: {applied} changes")
+
+    # --- VERIFYING ---
+    def _checksum(self, db_shard):
+        """ Count and sha256 over the copied products (supplier by name) """
+        supplier_names = {doc["_id"]: doc.get("name", "").lower() for doc in db_shard["suppliers"].find({}, {"name": 1})}
+        digest = hashlib.sha256()
+        count = 0
+        for doc in db_shard["products"].find({"category": self.category}).sort("_id", 1):
+            if doc["_id"] not in self.copied_products:
+                continue # Added on the source after the last catch-up: the next one copies it
+            supplier_name = supplier_names.get(doc.get("supplier_id"), "")
+            line = f"{doc['_id']}|{doc.get('name')}|{doc.get('price')}|{supplier_name}\n"
+            digest.update(line.encode("utf-8"))
+            count += 1
+        return count, digest.hexdigest()
+
+    def verify(self):
+        """ Raises MigrationError unless the target holds everything the source has """
+        source_count, source_sum = self._checksum(self.source_db)
+        target_count, target_sum = self._checksum(self.target_db)
+        if source_count != target_count:
+            raise MigrationError(f"Product count mismatch: source {source_count}, target {target_count}")
+        if source_sum != target_sum:
+            raise MigrationError("Product checksum mismatch between source and target")
+
+        product_ids = list(self.copied_quantity)
+        target_stock = self.target_db["stock"].count_documents({"product_id": {"$in": product_ids}})
+        if target_stock != len(product_ids):
+            raise MigrationError(f"Stock count mismatch: {len(product_ids)} products, {target_stock} stock docs on target")
+        for doc in self.source_db["stock"].find({"product_id": {"$in": product_ids}}, {"product_id": 1, "quantity": 1}):
+            if doc.get("quantity", 0) != self.copied_quantity[doc["product_id"]]:
+                raise MigrationError(f"Unapplied stock change for product {doc['product_id']}")
+        self._log(f"verified {source_count} products (sha256 {source_sum[:12]}...) and {target_stock} stock docs")
+
+    def _verify_before_switch(self):
+        """ verify(), catching up and retrying while tills keep writing to the source """
+        for attempt in range(1, VERIFY_ATTEMPTS + 1):
+            try:
+                self.verify()
+                return
+            except MigrationError as e:
+                if attempt == VERIFY_ATTEMPTS:
+                    raise MigrationError(f"{e} (route left on DB{self.source_shard_id + 1})")
+                self._log(f"verify attempt {attempt} failed ({e}); catching up")
+                self.catch_up()
+
+    def purge_source(self):
+        """ Deletes the category's old copies from the source shard """
+        product_ids = list(self.copied_products)
+        stock_result = self.source_db["stock"].delete_many({"product_id": {"$in": product_ids}})
+        product_result = self.source_db["products"].delete_many({"category": self.category, "_id": {"$in": product_ids}})
+        self._log(f"purged {product_result.deleted_count} products and {stock_result.deleted_count} stock docs from source")
+        shard_routing.set_route(self.category, self.target_shard_id, self.source_shard_id, "done")
+
+    def run(self, purge=False):
+        self._log("starting")
+        shard_routing.set_route(self.category, self.source_shard_id, self.source_shard_id, "copying")
+        self.bulk_copy()
+        self.cutover()
+        if purge:
+            self.purge_source()
+        self._log("done. Update CATEGORY_HASH/NUM_INVENTORY_SHARDS to match, then drop the route override.")
+
+
+def migrate_category(category, target_shard_id, batch_size=DEFAULT_BATCH_SIZE, pause=DEFAULT_PAUSE_SECONDS, purge=False):
+    """ Moves 'category' to 'target_shard_id' (0-based: 3 means DB4) """
+    route = shard_routing.get_route_doc(category, refresh=True)
+    if route and route.get("state") in ("cutover", "done"):
+        # Re-copying would overwrite stock the target has sold since the switch
+        raise MigrationError(f"'{category}' was already switched to DB{route['shard_id'] + 1} ({route['state']})")
+    migration = CategoryMigration(category, target_shard_id, batch_size, pause)
+    migration.run(purge=purge)
+    return migration
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Move a category to another inventory shard without stopping sales")
+    parser.add_argument("--category", required=True)
+    parser.add_argument("--to", type=int, required=True, help="Target shard id (0-based; 3 = DB4)")
+    parser.add_argument("--batch-size", type=int, default=DEFAULT_BATCH_SIZE)
+    parser.add_argument("--pause", type=float, default=DEFAULT_PAUSE_SECONDS, help="Seconds between batches")
+    parser.add_argument("--purge-source", action="store_true", help="Delete the old copies after verifying")
+    args = parser.parse_args()
+    try:
+        migrate_category(args.category, args.to, args.batch_size, args.pause, args.purge_source)
+    except MigrationError as e:
+        print(f"Migration stopped: {e}")
@@ -0,0 +1,78 @@
+from .db_connector import db_connection
+from datetime import datetime, timezone
+import threading
+import time
+
+# --- CATEGORY ROUTING OVERRIDES ---
+# CATEGORY_HASH decides where a category lives. While a category is being
+# moved (see shard_migration.py) or after it has moved, a document in
+# ShopSales.shard_routing overrides the hash:
+#   {_id: category, shard_id, source_shard_id, state, version, updated_at}
+# 'shard_id' is the shard that serves the category; copies of the category
+# on any other shard are ignored by searches. Switching a route is a single
+# document update, so every process flips at once (within the cache TTL).
+ROUTING_REFRESH_SECONDS = 5
+
+db_sales = db_connection.get_sales_db()
+if db_sales is None:
+     raise ConnectionError("Fatal: Could not connect to ShopSales database")
+routing_coll = db_sales["shard_routing"]
+
+_lock = threading.Lock()
+_cache = {"routes": {}, "loaded_at": 0}
+
+
+def _load_routes(force=False):
+    """ Returns the cached routes, re-reading them every ROUTING_REFRESH_SECONDS """
+    with _lock:
+        if force or time.time() - _cache["loaded_at"] > ROUTING_REFRESH_SECONDS:
+            try:
+                _cache["routes"] = {doc["_id"]: doc for doc in routing_coll.find({})}
+                _cache["loaded_at"] = time.time()
+            except Exception as e:
+                # Keep using the last known routes rather than failing every call
+                print(f"Warning: Could not refresh shard routing: {e}")
+        return _cache["routes"]
+
+def get_route(category):
+    """ Shard id that serves 'category' by override, or None to use the hash """
+    route = _load_routes().get(category)
+    return route["shard_id"] if route else None
+
+def get_route_doc(category, refresh=False):
+    """ The whole override document for 'category' (state, source...), or None; refresh=True re-reads it now """
+    return _load_routes(force=refresh).get(category)
+
+def get_version():
+    """ A string that changes whenever any route is set or removed """
+    routes = _load_routes()
+    return "|".join(f"{category}:{route['shard_id']}:{route.get('version', 0)}"
+                    for category, route in sorted(routes.items()))
+
+def excluded_categories(shard_id):
+    """ Categories with copies on 'shard_id' that another shard now serves """
+    return [category for category, route in _load_routes().items() if route["shard_id"] != shard_id]
+
+def inventory_shard_ids(num_shards):
+    """ The hashed shards plus any extra shard a category was moved to (e.g. DB4) """
+    extra = {route["shard_id"] for route in _load_routes().values()}
+    return sorted(set(range(num_shards)) | extra)
+
+
+def set_route(category, shard_id, source_shard_id, state):
+    """ Atomically (one document write) points 'category' at 'shard_id' """
+    current = _load_routes(force=True).get(category)
+    version = (current.get("version", 0) if current else 0) + 1
+    routing_coll.update_one(
+        {"_id": category},
+        {"$set": {"shard_id": shard_id, "source_shard_id": source_shard_id, "state": state,
+                  "version": version, "updated_at": datetime.now(timezone.utc)}},
+        upsert=True
+    )
+    _load_routes(force=True)
+    print(f"Routing: '{category}' -> DB{shard_id + 1} ({state}, version {version})")
+
+def remove_route(category):
+    """ Drops an override once CATEGORY_HASH itself sends the category there """
+    routing_coll.delete_one({"_id": category})
+    _load_routes(force=True)
@@ -0,0 +1,138 @@
+from .db_connector import db_connection
+from . import shard_routing, stock_watcher
+import threading
+
+# --- SKU / BARCODE INDEX ---
+# Products may carry a 'sku' (barcode), unique per shard through a partial
+# index (products without one are left out). Each process keeps a map of
+# sku -> {_id, shard_id, name, price, price_version, supplier_name}, loaded in one pass
+# per shard and kept fresh from the stock watcher's product events, so a
+# scan at the till is a dict lookup: no aggregation, no round-trip. A miss
+# falls back to an indexed lookup across the shards.
+NUM_INVENTORY_SHARDS = 3 # DB1, DB2, DB3
+
+_lock = threading.Lock()
+_by_sku = {} # sku -> product entry (the shape Cart.add takes)
+_sku_of = {} # product _id -> sku, to drop a barcode that was changed
+_supplier_names = {} # (shard_id, supplier _id) -> name
+_indexed = set()
+_listening = False
+
+
+def normalize_sku(code):
+    """ Scanners add stray whitespace; barcodes are otherwise compared as-is """
+    return "".join(str(code).split())
+
+def _get_products_coll(shard_id):
+    db_shard = db_connection.get_inventory_shard(shard_id)
+    if db_shard is None:
+        raise ConnectionError(f"Fatal: Could not connect to inventory shard DB{shard_id + 1}")
+    return db_shard["products"]
+
+def ensure_index(shard_id):
+    """ Unique 'sku' index on one shard's products (partial: only products that have one) """
+    if shard_id in _indexed:
+        return
+    _get_products_coll(shard_id).create_index(
+        "sku", unique=True, partialFilterExpression={"sku": {"$type": "string"}}
+    )
+    _indexed.add(shard_id)
+
+def _remember(shard_id, doc, supplier_name):
+    entry = {
+        "_id": doc["_id"], "shard_id": shard_id, "name": doc.get("name"),
+        "price": doc.get("price", 0), "supplier_name": supplier_name or "N/A",
+        "supplier_id": doc.get("supplier_id"), "price_version": doc.get("price_version", 0)
+    }
+    with _lock:
+        old_sku = _sku_of.get(doc["_id"])
+        if old_sku is not None and old_sku != doc["sku"]:
+            _by_sku.pop(old_sku, None)
+        _by_sku[doc["sku"]] = entry
+        _sku_of[doc["_id"]] = doc["sku"]
+        _supplier_names[(shard_id, entry["supplier_id"])] = entry["supplier_name"]
+    return entry
+
+
+# --- WARM-UP ---
+def _sku_pipeline(match):
+    return [
+        {"$match": match},
+        {"$lookup": {"from": "suppliers", "localField": "supplier_id", "foreignField": "_id", "as": "supplier"}},
+        {"$project": {
+            "sku": 1, "name": 1, "price": 1, "supplier_id": 1, "price_version": 1,
+            "supplier_name": {"$ifNull": [{"$arrayElemAt": ["$supplier.name", 0]}, "N/A"]}
+        }}
+    ]
+
+def warm_up_skus():
+    """ Loads every product with a SKU on every shard, and follows product changes """
+    global _listening
+    total = 0
+    for shard_id in shard_routing.inventory_shard_ids(NUM_INVENTORY_SHARDS):
+        try:
+            ensure_index(shard_id)
+            for doc in _get_products_coll(shard_id).aggregate(_sku_pipeline({"sku": {"$type": "string"}})):
+                _remember(shard_id, doc, doc["supplier_name"])
+                total += 1
+        except Exception as e:
+            print(f"Warning: Could not load SKUs from Shard DB{shard_id + 1}: {e}")
+    if not _listening:
+        stock_watcher.add_listener(apply_event)
+        _listening = True
+    print(f"SKU index: {total} barcodes")
+    return total
+
+
+# --- LOOKUP ---
+def lookup_sku(code):
+    """ The product a barcode belongs to (shape Cart.add takes), or None """
+    sku = normalize_sku(code)
+    with _lock:
+        entry = _by_sku.get(sku)
+    if entry is not None:
+        return entry
+    # Added by another till since the warm-up (and its event not seen yet)
+    for shard_id in shard_routing.inventory_shard_ids(NUM_INVENTORY_SHARDS):
+        try:
+            for doc in _get_products_coll(shard_id).aggregate(_sku_pipeline({"sku": sku})):
+                return _remember(shard_id, doc, doc["supplier_name"])
+        except Exception as e:
+            print(f"Error looking up SKU {sku} on Shard DB{shard_id + 1}: {e}")
+    return None
+
+def get_sku_map():
+    """ Every known barcode's entry (for thin clients to warm their own copy) """
+    with _lock:
+        return [dict(entry, sku=sku) for sku, entry in _by_sku.items()]
+
+def apply_event(event):
+    """ stock_watcher listener: keeps name, price, shard and barcode of known products current """
+    if event["type"] != "product":
+        return
+    refresh_product(event["shard_id"], event["doc"])
+
+def refresh_product(shard_id, doc):
+    """ Brings one product's entry in line with its document (drops it if the barcode was removed) """
+    if not doc.get("sku"):
+        with _lock:
+            old_sku = _sku_of.pop(doc["_id"], None)
+            if old_sku is not None:
+                _by_sku.pop(old_sku, None)
+        return
+    with _lock:
+        supplier_name = _supplier_names.get((shard_id, doc.get("supplier_id")))
+    if supplier_name is None:
+        try:
+            supplier = _get_products_coll(shard_id).database["suppliers"].find_one(
+                {"_id": doc.get("supplier_id")}, {"name": 1}
+            )
+            supplier_name = supplier.get("name") if supplier else None
+        except Exception as e:
+            print(f"Could not look up supplier for SKU {doc['sku']}: {e}")
+    _remember(shard_id, doc, supplier_name)
+
+def remember_product(shard_id, product_doc, supplier_name):
+    """ Our own writes go in directly (add_product), without waiting for the watcher """
+    if product_doc.get("sku"):
+        _remember(shard_id, product_doc, supplier_name)
@@ -0,0 +1,154 @@
+from .db_connector import db_connection
+from . import catalog_store, shard_routing
+import pymongo
+import threading
+
+# --- LIVE STOCK UPDATES ---
+# One thread per inventory shard follows changes to 'products' and 'stock'.
+# It uses a change stream when the deployment supports it (replica sets),
+# and otherwise polls with the catalog's incremental sync. Every change is
+# applied to the local catalog and handed to the registered listeners
+# (e.g. the Point of Sale screen), so tills see each other's sales without
+# re-running the product search.
+NUM_INVENTORY_SHARDS = 3 # DB1, DB2, DB3
+WATCH_POLL_INTERVAL_SECONDS = 2 # Polling fallback period
+WATCH_RETRY_SECONDS = 5 # Wait after an error before reconnecting
+WATCH_COLLECTIONS = ["products", "stock"]
+
+# "The $changeStream stage is only supported on replica sets"
+_CHANGE_STREAM_UNSUPPORTED_CODES = {40573}
+
+_listeners = []
+_listeners_lock = threading.Lock()
+_threads = []
+_stop = threading.Event()
+_modes = {} # shard_id -> "stream" or "poll"
+
+
+def add_listener(callback):
+    """
+    Registers callback(event). Events are dicts:
+      {"type": "stock", "shard_id", "product_id", "quantity"}
+      {"type": "product", "shard_id", "product_id", "doc"}
+    Callbacks run on a watcher thread, not the Tk thread.
+    """
+    with _listeners_lock:
+        _listeners.append(callback)
+
+def remove_listener(callback):
+    with _listeners_lock:
+        if callback in _listeners:
+            _listeners.remove(callback)
+
+def _publish(event):
+    with _listeners_lock:
+        listeners = list(_listeners)
+    for callback in listeners:
+        try:
+            callback(event)
+        except Exception as e:
+            print(f"Error in stock listener: {e}")
+
+def _publish_changes(shard_id, product_docs=(), stock_docs=()):
+    for doc in product_docs:
+        _publish({"type": "product", "shard_id": shard_id, "product_id": str(doc["_id"]), "doc": doc})
+    for doc in stock_docs:
+        _publish({"type": "stock", "shard_id": shard_id,
+                  "product_id": str(doc["product_id"]), "quantity": doc.get("quantity", 0)})
+
+
+def _stream_shard(shard_id):
+    """ Follows one shard's change stream until stopped; raises on failure """
+    db_shard = db_connection.get_inventory_shard(shard_id)
+    if db_shard is None:
+        raise ConnectionError(f"Fatal: Could not connect to inventory shard DB{shard_id + 1}")
+
+    pipeline = [{"$match": {
+        "ns.coll": {"$in": WATCH_COLLECTIONS},
+        "operationType": {"$in": ["insert", "update", "replace"]},
+        # Holds only move 'reserved' (see reservations): no till needs to repaint for that
+        "$or": [
+            {"operationType": {"$ne": "update"}},
+            {"updateDescription.updatedFields.reserved": {"$exists": False}},
+            {"updateDescription.updatedFields.quantity": {"$exists": True}},
+        ]
+    }}]
+    with db_shard.watch(pipeline, full_document="updateLookup", max_await_time_ms=1000) as stream:
+        if _modes.get(shard_id) != "stream":
+            print(f"Watching Shard DB{shard_id + 1} with a change stream.")
+        _modes[shard_id] = "stream"
+
+        # The stream is open, so anything written from here on is seen by it;
+        # catch up on what happened before.
+        routing_version = shard_routing.get_version()
+        _publish_changes(shard_id, *catalog_store.sync_shard(shard_id))
+
+        while not _stop.is_set() and stream.alive:
+            change = stream.try_next()
+            if change is None:
+                if shard_routing.get_version() != routing_version:
+                    return # A category moved: reopen, which resyncs the catalog
+                catalog_store.mark_synced(shard_id) # Idle, but still up to date
+                continue
+            doc = change.get("fullDocument")
+            if doc is None:
+                continue # Document was deleted before the lookup
+            if change["ns"]["coll"] == "stock":
+                catalog_store.apply_changes(shard_id, stock=[doc])
+                _publish_changes(shard_id, stock_docs=[doc])
+            else:
+                catalog_store.apply_changes(shard_id, products=[doc])
+                catalog_store.fetch_missing_suppliers(shard_id, db_shard)
+                _publish_changes(shard_id, product_docs=[doc])
+
+def _poll_shard(shard_id):
+    """ Polling fallback: incremental catalog sync every few seconds """
+    if _modes.get(shard_id) != "poll":
+        print(f"Watching Shard DB{shard_id + 1} by polling every {WATCH_POLL_INTERVAL_SECONDS}s.")
+    _modes[shard_id] = "poll"
+    while not _stop.is_set():
+        _publish_changes(shard_id, *catalog_store.sync_shard(shard_id))
+        _stop.wait(WATCH_POLL_INTERVAL_SECONDS)
+
+def _watch_shard(shard_id, use_change_streams):
+    while not _stop.is_set():
+        try:
+            if use_change_streams:
+                _stream_shard(shard_id)
+            else:
+                _poll_shard(shard_id)
+        except pymongo.errors.OperationFailure as e:
+            if e.code in _CHANGE_STREAM_UNSUPPORTED_CODES or "replica set" in str(e):
+                print(f"Change streams not available on Shard DB{shard_id + 1}; falling back to polling.")
+                use_change_streams = False
+                continue
+            print(f"Watcher error on Shard DB{shard_id + 1}: {e}")
+            _stop.wait(WATCH_RETRY_SECONDS)
+        except Exception as e:
+            print(f"Watcher error on Shard DB{shard_id + 1}: {e}")
+            _stop.wait(WATCH_RETRY_SECONDS)
+
+
+def start(use_change_streams=True):
+    """ Starts (once) one watcher thread per inventory shard """
+    if is_running():
+        return
+    _stop.clear()
+    _threads.clear()
+    for shard_id in shard_routing.inventory_shard_ids(NUM_INVENTORY_SHARDS):
+        thread = threading.Thread(
+            target=_watch_shard, args=(shard_id, use_change_streams),
+            name=f"stock-watcher-DB{shard_id + 1}", daemon=True
+        )
+        thread.start()
+        _threads.append(thread)
+
+def stop():
+    _stop.set()
+
+def is_running():
+    return any(thread.is_alive() for thread in _threads) and not _stop.is_set()
+
+def get_mode(shard_id):
+    """ "stream", "poll", or None if the shard has not been watched yet """
+    return _modes.get(shard_id)
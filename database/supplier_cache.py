@@ -0,0 +1,136 @@
+from .db_connector import db_connection
+from pymongo import ReturnDocument, UpdateOne
+import pymongo
+import threading
+
+# --- SUPPLIER IDENTITY CACHE ---
+# Suppliers are identified by a normalized key (trimmed, single-spaced,
+# case-folded name) stored as 'name_key' under a unique index on each shard,
+# so "Nestle", "nestle " and "NESTLE" are one supplier and concurrent
+# upserts cannot create duplicates. Each process caches name_key -> (_id,
+# name) per shard; known brands never need a round-trip.
+
+_lock = threading.Lock()
+_cache = {} # shard_id -> {name_key: (supplier _id, stored name)}
+_warmed = set() # shards whose suppliers have all been loaded
+_indexed = set() # shards where name_key is backfilled and indexed
+
+
+def normalize_supplier_name(name):
+    return " ".join(name.split()).casefold()
+
+def _get_suppliers_coll(shard_id):
+    db_shard = db_connection.get_inventory_shard(shard_id)
+    if db_shard is None:
+        raise ConnectionError(f"Fatal: Could not connect to inventory shard DB{shard_id + 1}")
+    return db_shard["suppliers"]
+
+def _ensure_name_key_index(shard_id, suppliers_coll):
+    """ Backfills 'name_key' on older suppliers, then adds the unique index (once) """
+    if shard_id in _indexed:
+        return
+    backfill = [
+        UpdateOne({"_id": doc["_id"]}, {"$set": {"name_key": normalize_supplier_name(doc.get("name", ""))}})
+        for doc in suppliers_coll.find({"name_key": {"$exists": False}}, {"name": 1})
+    ]
+    if backfill:
+        suppliers_coll.bulk_write(backfill, ordered=False)
+        print(f"Backfilled name_key on {len(backfill)} suppliers on Shard DB{shard_id + 1}")
+    try:
+        suppliers_coll.create_index("name_key", unique=True)
+    except pymongo.errors.OperationFailure as e:
+        # Existing case-variant duplicates must be merged by hand first; retried on the next call
+        print(f"Warning: Could not create unique supplier index on Shard DB{shard_id + 1}: {e}")
+        return
+    _indexed.add(shard_id)
+
+def _remember(shard_id, doc):
+    with _lock:
+        _cache.setdefault(shard_id, {})[doc["name_key"]] = (doc["_id"], doc.get("name"))
+
+
+def warm_up(shard_id):
+    """ Loads every supplier of a shard into the cache """
+    suppliers_coll = _get_suppliers_coll(shard_id)
+    _ensure_name_key_index(shard_id, suppliers_coll)
+    entries = {doc["name_key"]: (doc["_id"], doc.get("name"))
+               for doc in suppliers_coll.find({}, {"name_key": 1, "name": 1}) if doc.get("name_key")}
+    with _lock:
+        _cache[shard_id] = entries
+        _warmed.add(shard_id)
+    print(f"Supplier cache: {len(entries)} suppliers for Shard DB{shard_id + 1}")
+
+def cached_supplier(shard_id, supplier_name):
+    """ (_id, name) from the cache only, or None """
+    with _lock:
+        return _cache.get(shard_id, {}).get(normalize_supplier_name(supplier_name))
+
+
+def cached_names(shard_id):
+    """ Stored names of every supplier on a warmed-up shard, or None """
+    with _lock:
+        if shard_id not in _warmed:
+            return None
+        return [name for _, name in _cache.get(shard_id, {}).values()]
+
+
+def find_supplier(shard_id, supplier_name):
+    """ (_id, name) of an existing supplier, or None. No write. """
+    entry = cached_supplier(shard_id, supplier_name)
+    if entry is not None:
+        return entry
+    if shard_id not in _warmed:
+        warm_up(shard_id)
+        entry = cached_supplier(shard_id, supplier_name)
+        if entry is not None:
+            return entry
+    # A supplier another till added after our warm-up
+    doc = _get_suppliers_coll(shard_id).find_one({"name_key": normalize_supplier_name(supplier_name)})
+    if doc is None:
+        return None
+    _remember(shard_id, doc)
+    return doc["_id"], doc.get("name")
+
+def copy_supplier(shard_id, supplier_doc):
+    """
+    (_id, name) on a shard for a supplier document from another shard:
+    the existing supplier with the same name_key, else a copy of the
+    document itself (same _id and fields).
+    """
+    entry = find_supplier(shard_id, supplier_doc.get("name", ""))
+    if entry is not None:
+        return entry
+    suppliers_coll = _get_suppliers_coll(shard_id)
+    doc = dict(supplier_doc, name_key=normalize_supplier_name(supplier_doc.get("name", "")))
+    try:
+        suppliers_coll.insert_one(doc)
+    except pymongo.errors.DuplicateKeyError:
+        # Same name_key inserted meanwhile (or the _id is already taken)
+        doc = suppliers_coll.find_one({"name_key": doc["name_key"]}) or suppliers_coll.find_one({"_id": doc["_id"]})
+    _remember(shard_id, doc)
+    return doc["_id"], doc.get("name")
+
+def get_or_create_supplier(shard_id, supplier_name):
+    """ (_id, name) of the supplier, creating it if needed (race-safe upsert) """
+    entry = find_supplier(shard_id, supplier_name)
+    if entry is not None:
+        return entry
+    suppliers_coll = _get_suppliers_coll(shard_id)
+    _ensure_name_key_index(shard_id, suppliers_coll)
+    if shard_id not in _indexed:
+        # Without the unique index the upsert could race another till into a duplicate
+        raise ConnectionError(f"Supplier name_key index missing on Shard DB{shard_id + 1}; merge duplicate suppliers first")
+    name_key = normalize_supplier_name(supplier_name)
+    try:
+        doc = suppliers_coll.find_one_and_update(
+            {"name_key": name_key},
+            {"$setOnInsert": {"name": supplier_name.strip(), "name_key": name_key,
+                              "contact_email": "default@supplier.com"}},
+            upsert=True,
+            return_document=ReturnDocument.AFTER
+        )
+    except pymongo.errors.DuplicateKeyError:
+        # Another till inserted the same supplier between our find and upsert
+        doc = suppliers_coll.find_one({"name_key": name_key})
+    _remember(shard_id, doc)
+    return doc["_id"], doc.get("name")
@@ -0,0 +1,304 @@
+from .db_connector import db_connection
+from . import shard_health
+from bson import json_util
+from datetime import datetime, timezone
+import argparse
+import hashlib
+import threading
+import zlib
+import gzip
+import json
+import io
+import os
+import re
+
+# zstd is optional: without it archives are written as gzip
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+# --- TIME-PARTITIONED TRANSACTIONS ---
+# Receipts go to monthly collections (transactions_YYYY_MM), spread over the
+# transaction shards by a hash of the transaction _id. Closed months are
+# archived to compressed JSONL files listed in a manifest and then dropped,
+# so the hot collections and their indexes stay small. Readers use
+# hot_collections() for pushdown queries and iter_transactions() to also
+# cover archived months.
+#
+#   python -m database.transaction_store --archive [--drop]
+TRANSACTION_SHARD_IDS = [0, 1, 2] # DB1, DB2, DB3
+TRANSACTION_HASH_SPREAD = True # False: every partition lives on the first shard
+PARTITION_PREFIX = "transactions_"
+HOT_MONTHS = 2 # Current month + previous month stay in MongoDB
+LEGACY_COLLECTION = "transactions" # Amount-routed receipts from before partitioning
+LEGACY_SHARD_IDS = [0, 1]
+ARCHIVE_DIR = os.getenv("TRANSACTION_ARCHIVE_DIR", "transaction_archive")
+MANIFEST_NAME = "manifest.json"
+
+_PARTITION_RE = re.compile(rf"^{PARTITION_PREFIX}(\d{{4}})_(\d{{2}})$")
+_ensured = set()
+_ensure_lock = threading.Lock()
+_manifest_lock = threading.Lock()
+
+
+def _naive_utc(value):
+    """ Compare datetimes as naive UTC (what PyMongo returns by default) """
+    if value is not None and value.tzinfo is not None:
+        return value.astimezone(timezone.utc).replace(tzinfo=None)
+    return value
+
+def _month_index(year, month):
+    return year * 12 + (month - 1)
+
+def partition_name(timestamp):
+    return f"{PARTITION_PREFIX}{timestamp:%Y_%m}"
+
+def _partition_month(name):
+    match = _PARTITION_RE.match(name)
+    return (int(match.group(1)), int(match.group(2))) if match else None
+
+def _partition_range(name):
+    """ [start, end) of a monthly partition, naive UTC """
+    year, month = _partition_month(name)
+    end_year, end_month = (year + 1, 1) if month == 12 else (year, month + 1)
+    return datetime(year, month, 1), datetime(end_year, end_month, 1)
+
+def _overlaps(name, start, end):
+    part_start, part_end = _partition_range(name)
+    return (start is None or part_end > _naive_utc(start)) and (end is None or part_start < _naive_utc(end))
+
+def _get_shard(shard_id):
+    db_shard = db_connection.get_inventory_shard(shard_id)
+    if db_shard is None:
+        raise ConnectionError(f"Could not connect to Transaction Shard DB{shard_id + 1}")
+    return db_shard
+
+
+# --- PLACEMENT ---
+def get_location(transaction_id, timestamp):
+    """ (shard_id, collection name) for a new transaction """
+    if TRANSACTION_HASH_SPREAD:
+        index = zlib.crc32(transaction_id.binary) % len(TRANSACTION_SHARD_IDS)
+    else:
+        index = 0
+    # If that shard is down, the receipt goes to the next one that is up (reads scan every shard)
+    for offset in range(len(TRANSACTION_SHARD_IDS)):
+        shard_id = TRANSACTION_SHARD_IDS[(index + offset) % len(TRANSACTION_SHARD_IDS)]
+        if shard_health.is_available(shard_id):
+            return shard_id, partition_name(timestamp)
+    raise shard_health.ShardUnavailable(TRANSACTION_SHARD_IDS[index])
+
+def ensure_partition(shard_id, name):
+    """
+    Creates a partition and its timestamp index before the first write.
+    Done outside the sale's transaction (DDL inside one is restricted).
+    """
+    if (shard_id, name) in _ensured:
+        return
+    with _ensure_lock:
+        if (shard_id, name) in _ensured:
+            return
+        db_shard = _get_shard(shard_id)
+        if name not in db_shard.list_collection_names(filter={"name": name}):
+            try:
+                db_shard.create_collection(name)
+                print(f"Created partition {name} on Shard DB{shard_id + 1}")
+            except Exception as e:
+                # Another till may have created it first
+                if "already exists" not in str(e):
+                    raise
+        db_shard[name].create_index("timestamp")
+        _ensured.add((shard_id, name))
+
+
+# --- HOT READS ---
+def list_partitions(shard_id):
+    names = _get_shard(shard_id).list_collection_names(filter={"name": {"$regex": f"^{PARTITION_PREFIX}"}})
+    return sorted(name for name in names if _partition_month(name))
+
+def hot_collections(start=None, end=None):
+    """
+    (shard_id, collection) pairs that may hold transactions in [start, end),
+    including the legacy 'transactions' collections.
+    """
+    locations = [(shard_id, LEGACY_COLLECTION) for shard_id in LEGACY_SHARD_IDS]
+    for shard_id in TRANSACTION_SHARD_IDS:
+        for name in list_partitions(shard_id):
+            if _overlaps(name, start, end):
+                locations.append((shard_id, name))
+    return locations
+
+def get_collection(shard_id, name):
+    return _get_shard(shard_id)[name]
+
+
+# --- ARCHIVE ---
+def _manifest_path():
+    return os.path.join(ARCHIVE_DIR, MANIFEST_NAME)
+
+def load_manifest():
+    """ List of archived partitions: {partition, shard_id, file, format, count, min_ts, max_ts, sha256} """
+    try:
+        with open(_manifest_path(), "r", encoding="utf-8") as f:
+            return json.load(f)["partitions"]
+    except FileNotFoundError:
+        return []
+
+def _save_manifest(entries):
+    os.makedirs(ARCHIVE_DIR, exist_ok=True)
+    tmp_path = _manifest_path() + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump({"partitions": entries}, f, indent=2)
+    os.replace(tmp_path, _manifest_path()) # Readers never see a half-written manifest
+
+def _open_archive(path, fmt, mode):
+    if fmt == "jsonl.zst":
+        if zstandard is None:
+            raise ImportError("Reading .zst archives requires the 'zstandard' package")
+        raw = open(path, mode + "b")
+        if mode == "w":
+            stream = zstandard.ZstdCompressor(level=10).stream_writer(raw, closefd=True)
+        else:
+            stream = zstandard.ZstdDecompressor().stream_reader(raw, closefd=True)
+        return io.TextIOWrapper(stream, encoding="utf-8")
+    return gzip.open(path, mode + "t", encoding="utf-8")
+
+def closed_partitions(now=None, include_archived=False):
+    """
+    (shard_id, name) of partitions older than the HOT_MONTHS window that are
+    not archived yet; include_archived=True adds archived ones still present.
+    """
+    now = _naive_utc(now or datetime.now(timezone.utc))
+    oldest_hot = _month_index(now.year, now.month) - (HOT_MONTHS - 1)
+    archived = {(entry["shard_id"], entry["partition"]) for entry in load_manifest()}
+    closed = []
+    for shard_id in TRANSACTION_SHARD_IDS:
+        for name in list_partitions(shard_id):
+            if _month_index(*_partition_month(name)) >= oldest_hot:
+                continue
+            if include_archived or (shard_id, name) not in archived:
+                closed.append((shard_id, name))
+    return closed
+
+def archive_partition(shard_id, name, drop=False):
+    """
+    Writes one partition to ARCHIVE_DIR, checks the written count, records it
+    in the manifest and (with drop=True) drops the collection.
+    """
+    fmt = "jsonl.zst" if zstandard is not None else "jsonl.gz"
+    os.makedirs(ARCHIVE_DIR, exist_ok=True)
+    file_name = f"{name}.DB{shard_id + 1}.{fmt}"
+    path = os.path.join(ARCHIVE_DIR, file_name)
+
+    coll = get_collection(shard_id, name)
+    count, min_ts, max_ts = 0, None, None
+    with _open_archive(path, fmt, "w") as out:
+        for doc in coll.find({}).sort("timestamp", 1):
+            out.write(json_util.dumps(doc) + "\n")
+            count += 1
+            ts = _naive_utc(doc.get("timestamp"))
+            if ts is not None:
+                min_ts = ts if min_ts is None else min(min_ts, ts)
+                max_ts = ts if max_ts is None else max(max_ts, ts)
+
+    if count != coll.estimated_document_count():
+        os.remove(path)
+        raise RuntimeError(f"{name} on DB{shard_id + 1} changed while archiving; not archived")
+
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            digest.update(chunk)
+
+    entry = {
+        "partition": name, "shard_id": shard_id, "file": file_name, "format": fmt,
+        "count": count, "min_ts": min_ts.isoformat() if min_ts else None,
+        "max_ts": max_ts.isoformat() if max_ts else None,
+        "sha256": digest.hexdigest(), "archived_at": datetime.now(timezone.utc).isoformat()
+    }
+    with _manifest_lock:
+        entries = [e for e in load_manifest() if (e["shard_id"], e["partition"]) != (shard_id, name)]
+        entries.append(entry)
+        _save_manifest(entries)
+    print(f"Archived {count} transactions from {name} on Shard DB{shard_id + 1} to {file_name}")
+
+    if drop:
+        coll.drop()
+        _ensured.discard((shard_id, name))
+        print(f"Dropped {name} on Shard DB{shard_id + 1}")
+    return entry
+
+def drop_archived_partition(shard_id, name, entry):
+    """ Drops a partition archived earlier (without --drop), once it still matches its manifest entry """
+    coll = get_collection(shard_id, name)
+    if not os.path.exists(os.path.join(ARCHIVE_DIR, entry["file"])):
+        raise RuntimeError(f"Archive file {entry['file']} for {name} on DB{shard_id + 1} is missing; not dropped")
+    if coll.estimated_document_count() != entry["count"]:
+        raise RuntimeError(f"{name} on DB{shard_id + 1} no longer matches its archive; archive it again before dropping")
+    coll.drop()
+    _ensured.discard((shard_id, name))
+    print(f"Dropped {name} on Shard DB{shard_id + 1} (archived {entry['archived_at']})")
+    return entry
+
+def archive_closed_partitions(drop=False):
+    """ Archives closed partitions; with drop=True also drops ones archived by an earlier run without it """
+    archived = {(entry["shard_id"], entry["partition"]): entry for entry in load_manifest()}
+    done = []
+    for shard_id, name in closed_partitions(include_archived=drop):
+        entry = archived.get((shard_id, name))
+        if entry is None:
+            done.append(archive_partition(shard_id, name, drop))
+        else:
+            done.append(drop_archived_partition(shard_id, name, entry))
+    return done
+
+def read_archive(entry):
+    """ Yields the transactions of one archived partition """
+    with _open_archive(os.path.join(ARCHIVE_DIR, entry["file"]), entry["format"], "r") as f:
+        for line in f:
+            if line.strip():
+                yield json_util.loads(line)
+
+
+# --- READING EVERYTHING ---
+def iter_transactions(start=None, end=None):
+    """
+    Yields transactions with start <= timestamp < end from the hot
+    collections and from archived partitions (in no particular order).
+    A partition that is both archived and still present is read from MongoDB.
+    """
+    time_query = {}
+    if start is not None: time_query["$gte"] = start
+    if end is not None: time_query["$lt"] = end
+    query = {"timestamp": time_query} if time_query else {}
+
+    hot = hot_collections(start, end)
+    for shard_id, name in hot:
+        yield from get_collection(shard_id, name).find(query)
+    yield from iter_archived_transactions(start, end, skip=hot)
+
+def iter_archived_transactions(start=None, end=None, skip=()):
+    """ Archived transactions in [start, end), except partitions in 'skip' (shard_id, name) """
+    skip = set(skip)
+    start, end = _naive_utc(start), _naive_utc(end)
+    for entry in load_manifest():
+        if (entry["shard_id"], entry["partition"]) in skip or not _overlaps(entry["partition"], start, end):
+            continue
+        for doc in read_archive(entry):
+            ts = _naive_utc(doc.get("timestamp"))
+            if (start is None or ts >= start) and (end is None or ts < end):
+                yield doc
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Archive closed monthly transaction partitions")
+    parser.add_argument("--archive", action="store_true", help="Archive partitions older than HOT_MONTHS")
+    parser.add_argument("--drop", action="store_true", help="Drop partitions after archiving them")
+    args = parser.parse_args()
+    if args.archive:
+        archived = archive_closed_partitions(drop=args.drop)
+        print(f"Archived {len(archived)} partitions{' (and dropped them)' if args.drop else ''}.")
+    else:
+        for entry in load_manifest():
+            print(f"{entry['partition']} DB{entry['shard_id'] + 1}: {entry['count']} transactions in {entry['file']}")
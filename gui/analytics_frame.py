@@ -1,5 +1,6 @@
 import customtkinter as ctk
-from database import sales_db
+from .backend import sales_db
+from . import profiler
 
 class AnalyticsFrame(ctk.CTkFrame):
     def __init__(self, master):
@@ -47,6 +48,7 @@ class AnalyticsFrame(ctk.CTkFrame):
         # Initial search
         self.search_sales()
 
+    @profiler.timed
     def search_sales(self):
         """
         Called when 'Search' is clicked.
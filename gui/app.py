@@ -1,18 +1,29 @@
 import customtkinter as ctk
-from .inventory_frame import InventoryFrame
-from .sales_frame import SalesFrame
-from .member_frame import MemberFrame
-from database.db_connector import db_connection 
+import importlib
+from . import backend
+from . import profiler
+
+# --- LAZY TABS ---
+# Tab name -> (module, frame class). Modules are imported and frames are
+# built the first time the tab is shown, so a till that only ever uses
+# Point of Sale never pays for the other screens.
+TAB_FRAMES = {
+    "Point of Sale": ("gui.sales_frame", "SalesFrame"),
+    "Inventory": ("gui.inventory_frame", "InventoryFrame"),
+    "Members": ("gui.member_frame", "MemberFrame"),
+    "Analytics": ("gui.analytics_frame", "AnalyticsFrame"),
+}
+DEFAULT_TAB = "Point of Sale"
 
 class App(ctk.CTk):
     def __init__(self):
         super().__init__()
 
         self.title("SuperShop Management System")
-        
+
         # --- 16x8 Inch Window Size ---
         # (Assuming 96 DPI: 16 inches * 96 = 1536px, 8 inches * 96 = 768px)
-        self.geometry("1536x768") 
+        self.geometry("1536x768")
 
         ctk.set_appearance_mode("System")
         ctk.set_default_color_theme("blue")
@@ -22,36 +33,70 @@ class App(ctk.CTk):
         self.grid_columnconfigure(0, weight=1)
 
         # Create Tab View
-        self.tab_view = ctk.CTkTabview(self, width=1500, height=750)
+        self.tab_view = ctk.CTkTabview(self, width=1500, height=750, command=self.on_tab_changed)
         # --- Use .grid() and 'sticky' to make the tab view resizeable ---
         self.tab_view.grid(row=0, column=0, padx=20, pady=20, sticky="nsew")
 
-        # Add tabs
-        self.tab_view.add("Point of Sale")
-        self.tab_view.add("Inventory")
-        self.tab_view.add("Members")
-
-        # --- Populate tabs with frames from other files ---
-        self.sales_frame = SalesFrame(self.tab_view.tab("Point of Sale"))
-        self.sales_frame.pack(expand=True, fill="both")
+        # Add tabs (empty until first shown)
+        for tab_name in TAB_FRAMES:
+            self.tab_view.add(tab_name)
 
-        self.inventory_frame = InventoryFrame(self.tab_view.tab("Inventory"), sales_frame=self.sales_frame)
-        self.inventory_frame.pack(expand=True, fill="both")
+        self.sales_frame = None
+        self.inventory_frame = None
+        self.member_frame = None
+        self.analytics_frame = None
 
-        self.member_frame = MemberFrame(self.tab_view.tab("Members"))
-        self.member_frame.pack(expand=True, fill="both")
+        # Keep the local catalog snapshot fresh (and stock counts live)
+        backend.stock_watcher.start()
+        backend.start_promotions()
 
-        # Set default tab
-        self.tab_view.set("Point of Sale")
+        # Set default tab and build only that one
+        self.tab_view.set(DEFAULT_TAB)
+        self.build_tab(DEFAULT_TAB)
 
         # Handle window close event
         self.protocol("WM_DELETE_WINDOW", self.on_closing)
 
+        # Stall watchdog and callback timings (only with SUPERSHOP_PROFILE=1)
+        profiler.start(self)
+
+    def on_tab_changed(self):
+        """ Called by the tab view whenever the user switches tabs. """
+        self.build_tab(self.tab_view.get())
+
+    @profiler.timed
+    def build_tab(self, tab_name):
+        """
+        Imports the frame module for 'tab_name' and builds its frame,
+        unless that was already done. Returns the frame.
+        """
+        module_name, class_name = TAB_FRAMES[tab_name]
+        attr_name = module_name.rsplit(".", 1)[1] # e.g. 'sales_frame'
+        frame = getattr(self, attr_name)
+        if frame is not None:
+            return frame
+
+        frame_class = getattr(importlib.import_module(module_name), class_name)
+        master = self.tab_view.tab(tab_name)
+        if tab_name == "Inventory":
+            # Inventory refreshes the product list after changes, but only
+            # if the sales screen actually exists.
+            frame = frame_class(master, sales_frame=self.sales_frame)
+        else:
+            frame = frame_class(master)
+        frame.pack(expand=True, fill="both")
+        setattr(self, attr_name, frame)
+        print(f"Built '{tab_name}' tab.")
+        return frame
+
     def on_closing(self):
         """
         Called when the user clicks the 'X' button.
         Ensures the database connection is closed gracefully.
         """
         print("Closing application...")
-        db_connection.close_connection()
-        self.destroy()
\ No newline at end of file
+        if self.sales_frame is not None:
+            self.sales_frame.release_holds(wait=True) # Before the connection goes
+        backend.close()
+        profiler.stop()
+        self.destroy()
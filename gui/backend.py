@@ -0,0 +1,41 @@
+import os
+
+# --- BACKEND SELECTION ---
+# By default the GUI runs the 'database' package in-process. With
+# SUPERSHOP_BACKEND_URL set it becomes a thin client of the shop's backend
+# service (service/server.py), which exposes the same functions.
+BACKEND_URL = os.getenv("SUPERSHOP_BACKEND_URL")
+
+if BACKEND_URL:
+    from service import client
+    inventory_db = member_db = sales_db = stock_watcher = reservations = sku_index = client
+else:
+    from database import inventory_db, member_db, sales_db, stock_watcher, reservations, sku_index
+
+
+def is_available():
+    """ True if the selected backend can serve the GUI """
+    if BACKEND_URL:
+        return client.ping()
+    from database.db_connector import db_connection
+    return db_connection.client is not None
+
+def get_low_stock(limit):
+    """ Forecast of products running low (NumPy is only loaded once this is first asked for) """
+    if BACKEND_URL:
+        return client.get_low_stock(limit)
+    from database import forecasting
+    return forecasting.get_low_stock(limit)
+
+def start_promotions():
+    """ In-process, the app starts and ends scheduled promotions (the backend service does it for thin clients) """
+    if not BACKEND_URL:
+        from database import pricing
+        pricing.start_scheduler()
+
+def close():
+    """ Stops live updates and, in-process, closes the MongoDB connection """
+    stock_watcher.stop()
+    if not BACKEND_URL:
+        from database.db_connector import db_connection
+        db_connection.close_connection()
@@ -0,0 +1,121 @@
+# --- CART MODEL ---
+# The sale in progress, keyed by product_id. Totals are kept as running
+# sums (in paisa, so repeated +/- never drifts), so adding, removing or
+# re-pricing a line is O(1) however big the basket is. Each change returns
+# the affected line so the view can update just that row.
+# cart_id names the cart's stock holds (see database.reservations). Lines
+# keep the price and price_version they were added at; that snapshot is
+# what record_sale charges (see database.pricing).
+import uuid
+
+DISCOUNT_THRESHOLD = 1000
+DISCOUNT_PERCENT = 0.05
+
+
+def _to_paisa(amount):
+    return int(round(amount * 100))
+
+
+class Cart:
+    def __init__(self, discount_threshold=DISCOUNT_THRESHOLD, discount_percent=DISCOUNT_PERCENT):
+        self.discount_threshold = discount_threshold
+        self.discount_percent = discount_percent
+        self.items = {} # product_id -> {"product_id", "shard_id", "name", "price", "price_version", "quantity"}
+        self.member = None # {'doc':..., 'shard_id':...} from find_member_by_phone
+        self.cart_id = uuid.uuid4().hex
+        self._subtotal_paisa = 0
+
+    def __len__(self):
+        return len(self.items)
+
+    def __contains__(self, product_id):
+        return product_id in self.items
+
+    # --- CHANGES ---
+    def add(self, product, quantity=1):
+        """ Adds units of a listed product; returns (line, is_new_line) """
+        product_id = str(product["_id"])
+        line = self.items.get(product_id)
+        is_new = line is None
+        if is_new:
+            brand_name = product.get("supplier_name", "N/A")
+            line = self.items[product_id] = {
+                "product_id": product_id,
+                "shard_id": product["shard_id"],
+                "name": f"{product['name']} ({brand_name})",
+                "price": product["price"],
+                "price_version": product.get("price_version", 0),
+                "quantity": 0
+            }
+        line["quantity"] += quantity
+        self._subtotal_paisa += _to_paisa(line["price"]) * quantity
+        return line, is_new
+
+    def decrement(self, product_id, quantity=1):
+        """ Takes units off a line; returns (line, removed) - the line is dropped at zero """
+        line = self.items[product_id]
+        quantity = min(quantity, line["quantity"])
+        line["quantity"] -= quantity
+        self._subtotal_paisa -= _to_paisa(line["price"]) * quantity
+        if line["quantity"] == 0:
+            del self.items[product_id]
+            return line, True
+        return line, False
+
+    def remove(self, product_id):
+        line = self.items.pop(product_id)
+        self._subtotal_paisa -= _to_paisa(line["price"]) * line["quantity"]
+        return line
+
+    def reprice(self, product_id, price, price_version):
+        """ Moves a line to a new price (a repricing or promotion); returns the line, or None if unchanged """
+        line = self.items.get(product_id)
+        if line is None or price_version <= line["price_version"]:
+            return None
+        self._subtotal_paisa += (_to_paisa(price) - _to_paisa(line["price"])) * line["quantity"]
+        line["price"] = price
+        line["price_version"] = price_version
+        return line
+
+    def set_member(self, member):
+        self.member = member
+
+    def clear(self):
+        """ Empties the cart; the next sale gets a new cart_id """
+        self.items = {}
+        self.member = None
+        self.cart_id = uuid.uuid4().hex
+        self._subtotal_paisa = 0
+
+    # --- TOTALS ---
+    @property
+    def subtotal(self):
+        return self._subtotal_paisa / 100
+
+    @property
+    def discount(self):
+        """ Member discount for the current subtotal (0 if not eligible) """
+        if self.member and self.subtotal >= self.discount_threshold:
+            return self.subtotal * self.discount_percent
+        return 0
+
+    @property
+    def total(self):
+        return self.subtotal - self.discount
+
+    @property
+    def amount_to_discount(self):
+        """ How much more a member must spend for the discount (0 once reached) """
+        return max(self.discount_threshold - self.subtotal, 0)
+
+    @staticmethod
+    def line_total(line):
+        return line["price"] * line["quantity"]
+
+    def items_for_sale(self):
+        """ Cart lines in the shape record_sale expects """
+        return [
+            {"product_id": line["product_id"], "quantity": line["quantity"], "shard_id": line["shard_id"],
+             "price": line["price"], "price_version": line["price_version"]}
+            for line in self.items.values()
+        ]
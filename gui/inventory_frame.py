@@ -1,8 +1,12 @@
 import customtkinter as ctk
-from database import inventory_db
+import threading
+from .backend import inventory_db, get_low_stock
+from . import profiler
 
 # Use the hash map keys for consistency
 CATEGORIES_LIST = list(inventory_db.CATEGORY_HASH.keys())
+LOW_STOCK_LIMIT = 20 # Products listed in the Low Stock box
+LOW_STOCK_POLL_MS = 200 # How often to check for a finished forecast
 
 class InventoryFrame(ctk.CTkFrame):
 
@@ -20,7 +24,9 @@ class InventoryFrame(ctk.CTkFrame):
         self.add_label = ctk.CTkLabel(self, text="Add New Product", font=ctk.CTkFont(size=16))
         self.add_label.grid(row=1, column=0, padx=20, pady=(10, 5), sticky="w")
         self.name_entry = ctk.CTkEntry(self, placeholder_text="Product Name")
-        self.name_entry.grid(row=2, column=0, columnspan=2, padx=20, pady=5, sticky="ew")
+        self.name_entry.grid(row=2, column=0, padx=(20, 5), pady=5, sticky="ew")
+        self.sku_entry = ctk.CTkEntry(self, placeholder_text="Barcode / SKU (optional)")
+        self.sku_entry.grid(row=2, column=1, padx=(5, 20), pady=5, sticky="ew")
         self.price_entry = ctk.CTkEntry(self, placeholder_text="Price (e.g., 100)")
         self.price_entry.grid(row=3, column=0, padx=(20, 5), pady=5, sticky="ew")
         self.stock_entry = ctk.CTkEntry(self, placeholder_text="Initial Stock")
@@ -57,12 +63,26 @@ class InventoryFrame(ctk.CTkFrame):
         self.status_label = ctk.CTkLabel(self, text="", text_color="green")
         self.status_label.grid(row=12, column=0, columnspan=2, padx=20, pady=15)
 
+        # --- Low Stock Section (forecast: what runs out first) ---
+        self.low_stock_flag = ctk.CTkLabel(self, text="", font=ctk.CTkFont(size=14, weight="bold"))
+        self.low_stock_flag.grid(row=6, column=1, padx=20, pady=(20, 5), sticky="w")
+        self.low_stock_box = ctk.CTkTextbox(self, width=380, height=180, font=ctk.CTkFont(size=12))
+        self.low_stock_box.grid(row=7, column=1, rowspan=4, padx=20, pady=5, sticky="nsew")
+        self.low_stock_box.configure(state="disabled")
+        self.low_stock_button = ctk.CTkButton(self, text="Refresh Low Stock", width=80, command=self.refresh_low_stock)
+        self.low_stock_button.grid(row=11, column=1, padx=20, pady=10, sticky="w")
+
+        self.low_stock_result = None
+        self.refresh_low_stock()
+
+    @profiler.timed
     def add_product_callback(self):
         name = self.name_entry.get()
         price_str = self.price_entry.get()
         stock_str = self.stock_entry.get()
         category = self.add_category_var.get() # Use correct var
         supplier = self.supplier_entry.get()
+        sku = self.sku_entry.get().strip() or None
 
         if not all([name, price_str, stock_str, supplier, category]):
             self.status_label.configure(text="All fields are required.", text_color="red")
@@ -80,15 +100,16 @@ class InventoryFrame(ctk.CTkFrame):
             return
 
         try:
-            product_id = inventory_db.add_product(name, price, category, supplier, stock)
+            product_id = inventory_db.add_product(name, price, category, supplier, stock, sku)
             if not product_id:
-                raise Exception("Product/supplier combo exists.")
+                raise Exception("Product/supplier combo or SKU exists.")
 
             self.status_label.configure(text=f"Success! Added '{name}'", text_color="green")
             self.name_entry.delete(0, "end")
             self.price_entry.delete(0, "end")
             self.stock_entry.delete(0, "end")
             self.supplier_entry.delete(0, "end")
+            self.sku_entry.delete(0, "end")
             self.add_category_var.set(CATEGORIES_LIST[0])
 
             if self.sales_frame:
@@ -97,6 +118,7 @@ class InventoryFrame(ctk.CTkFrame):
         except Exception as e:
             self.status_label.configure(text=f"Error adding product: {e}", text_color="red")
 
+    @profiler.timed
     def add_stock_callback(self):
         product_name = self.stock_name_entry.get()
         supplier_name = self.stock_supplier_entry.get()
@@ -132,8 +154,48 @@ class InventoryFrame(ctk.CTkFrame):
 
                 if self.sales_frame:
                     self.sales_frame.apply_filters_callback()
+                self.refresh_low_stock()
             else:
                 self.status_label.configure(text="Error: Product/Supplier/Category combo not found.", text_color="red")
 
         except Exception as e:
-            self.status_label.configure(text=f"Error adding stock: {e}", text_color="red")
\ No newline at end of file
+            self.status_label.configure(text=f"Error adding stock: {e}", text_color="red")
+
+    # --- LOW STOCK ---
+    def refresh_low_stock(self):
+        """ Runs the forecast off the Tk thread; _show_low_stock picks up the result """
+        self.low_stock_button.configure(state="disabled")
+        self.low_stock_flag.configure(text="Checking stock levels...", text_color="gray")
+        self.low_stock_result = None
+        threading.Thread(target=self._load_low_stock, daemon=True).start()
+        self.after(LOW_STOCK_POLL_MS, self._show_low_stock)
+
+    def _load_low_stock(self):
+        try:
+            self.low_stock_result = get_low_stock(LOW_STOCK_LIMIT)
+        except Exception as e:
+            self.low_stock_result = e
+
+    def _show_low_stock(self):
+        result = self.low_stock_result
+        if result is None:
+            self.after(LOW_STOCK_POLL_MS, self._show_low_stock)
+            return
+        self.low_stock_button.configure(state="normal")
+
+        self.low_stock_box.configure(state="normal")
+        self.low_stock_box.delete("1.0", "end")
+        if isinstance(result, Exception):
+            self.low_stock_flag.configure(text="Low stock: unavailable", text_color="red")
+            self.low_stock_box.insert("end", f"Could not forecast stock: {result}")
+        elif result["count"] == 0:
+            self.low_stock_flag.configure(text="Stock levels OK", text_color="green")
+        else:
+            self.low_stock_flag.configure(text=f"LOW STOCK: {result['count']} products", text_color="red")
+            for item in result["items"]:
+                self.low_stock_box.insert(
+                    "end",
+                    f"{item['name']} ({item['category']}): {item['quantity']} left, "
+                    f"~{item['days_of_cover']} days. Order {item['reorder_qty']}\n"
+                )
+        self.low_stock_box.configure(state="disabled")
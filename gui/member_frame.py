@@ -1,5 +1,6 @@
 import customtkinter as ctk
-from database import member_db
+from .backend import member_db
+from . import profiler
 import re # <-- Import the regex module
 
 # --- Define a simple pattern for email validation ---
@@ -30,6 +31,7 @@ class MemberFrame(ctk.CTkFrame):
         self.status_label = ctk.CTkLabel(self, text="", text_color="green")
         self.status_label.grid(row=5, column=0, padx=20, pady=10)
 
+    @profiler.timed
     def add_member_callback(self):
         name = self.name_entry.get()
         phone = self.phone_entry.get()
@@ -0,0 +1,186 @@
+from collections import Counter, defaultdict
+import functools
+import threading
+import traceback
+import argparse
+import json
+import time
+import sys
+import os
+
+# --- GUI PROFILER (opt-in) ---
+# Finds what freezes the till window. With SUPERSHOP_PROFILE=1:
+#  - callbacks marked @timed log how long each call ran on the Tk thread;
+#  - a watchdog thread checks that a Tk heartbeat (after() every
+#    HEARTBEAT_MS) keeps firing. When it is late by more than
+#    STALL_THRESHOLD_MS, the watchdog samples the Tk thread's stack every
+#    SAMPLE_INTERVAL_MS until the loop is back, then logs the stall with
+#    the callback that was running and its most common stacks.
+# Records are JSON lines in PROFILE_LOG; summarize them with
+#
+#   python -m gui.profiler summary [profile.log]
+#
+# When profiling is off, @timed returns the function unchanged.
+ENABLED = os.getenv("SUPERSHOP_PROFILE", "").lower() in ("1", "true", "yes")
+PROFILE_LOG = os.getenv("SUPERSHOP_PROFILE_LOG", "profile.log")
+HEARTBEAT_MS = 50
+STALL_THRESHOLD_MS = int(os.getenv("SUPERSHOP_STALL_THRESHOLD_MS", "200"))
+SAMPLE_INTERVAL_MS = 10
+TOP_STACKS = 5 # Distinct stacks logged per stall
+STACK_DEPTH = 12 # Innermost frames kept per sample
+
+_log_lock = threading.Lock()
+_log_file = None
+_tk_thread_id = None
+_last_beat = 0.0
+_current = [] # Names of the @timed callbacks running on the Tk thread (innermost last)
+_watchdog = None
+_stop = threading.Event()
+
+
+def _write(record):
+    global _log_file
+    with _log_lock:
+        if _log_file is None:
+            _log_file = open(PROFILE_LOG, "a", encoding="utf-8", buffering=1)
+        _log_file.write(json.dumps(record) + "\n")
+
+
+# --- CALLBACK TIMING ---
+def timed(func):
+    """ Logs each call's duration (and names it in stall reports) when profiling is on """
+    if not ENABLED:
+        return func
+    name = func.__qualname__
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        _current.append(name)
+        started = time.perf_counter()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            elapsed_ms = (time.perf_counter() - started) * 1000
+            _current.pop()
+            _write({"type": "callback", "name": name, "ms": round(elapsed_ms, 3), "ts": time.time()})
+    return wrapper
+
+
+# --- STALL WATCHDOG ---
+def _beat(root):
+    global _last_beat
+    _last_beat = time.perf_counter()
+    if not _stop.is_set():
+        root.after(HEARTBEAT_MS, _beat, root)
+
+def _sample_stack():
+    frame = sys._current_frames().get(_tk_thread_id)
+    if frame is None:
+        return None
+    stack = traceback.extract_stack(frame)[-STACK_DEPTH:]
+    return tuple(f"{os.path.basename(entry.filename)}:{entry.lineno} {entry.name}" for entry in stack)
+
+def _watch():
+    stall_started = None
+    samples = Counter()
+    callbacks = Counter()
+    while not _stop.wait(SAMPLE_INTERVAL_MS / 1000):
+        late_ms = (time.perf_counter() - _last_beat) * 1000 - HEARTBEAT_MS
+        if late_ms > STALL_THRESHOLD_MS:
+            if stall_started is None:
+                stall_started = _last_beat
+            stack = _sample_stack()
+            if stack:
+                samples[stack] += 1
+            running = list(_current) # Snapshot: the Tk thread changes it as we read
+            callbacks[running[-1] if running else None] += 1
+        elif stall_started is not None:
+            # The loop is back: the heartbeat after the stall has run
+            stall_ms = (_last_beat - stall_started) * 1000 - HEARTBEAT_MS
+            callback = callbacks.most_common(1)[0][0] if callbacks else None
+            _write({
+                "type": "stall", "ms": round(stall_ms, 1), "callback": callback, "ts": time.time(),
+                "samples": sum(samples.values()),
+                "stacks": [{"count": count, "frames": list(stack)} for stack, count in samples.most_common(TOP_STACKS)]
+            })
+            print(f"Tk stall: {stall_ms:.0f}ms in {callback or 'unknown callback'}")
+            stall_started = None
+            samples = Counter()
+            callbacks = Counter()
+
+def start(root):
+    """ Starts the heartbeat and watchdog for a Tk root (call on the Tk thread); no-op unless enabled """
+    global _tk_thread_id, _watchdog
+    if not ENABLED or (_watchdog is not None and _watchdog.is_alive()):
+        return
+    _tk_thread_id = threading.get_ident()
+    _stop.clear()
+    _beat(root)
+    _watchdog = threading.Thread(target=_watch, name="tk-watchdog", daemon=True)
+    _watchdog.start()
+    print(f"GUI profiling on: stalls over {STALL_THRESHOLD_MS}ms and callback times go to {PROFILE_LOG}")
+
+def stop():
+    global _log_file
+    _stop.set()
+    with _log_lock:
+        if _log_file is not None:
+            _log_file.close()
+            _log_file = None
+
+
+# --- SUMMARY ---
+def _percentile(sorted_values, fraction):
+    return sorted_values[min(int(len(sorted_values) * fraction), len(sorted_values) - 1)]
+
+def summarize(path=PROFILE_LOG, top=10):
+    """ Per-callback timings and the worst stalls from a profile log, as text """
+    durations = defaultdict(list)
+    stalls = []
+    with open(path, encoding="utf-8") as log:
+        for line in log:
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                continue # A line cut off when the app was killed
+            if record.get("type") == "callback":
+                durations[record["name"]].append(record["ms"])
+            elif record.get("type") == "stall":
+                stalls.append(record)
+
+    lines = [f"{'callback':<48} {'calls':>6} {'mean':>8} {'p50':>8} {'p95':>8} {'max':>8} {'total':>10}  (ms)"]
+    by_total = sorted(durations.items(), key=lambda item: sum(item[1]), reverse=True)
+    for name, values in by_total:
+        values.sort()
+        lines.append(
+            f"{name:<48} {len(values):>6} {sum(values) / len(values):>8.1f} {_percentile(values, 0.5):>8.1f} "
+            f"{_percentile(values, 0.95):>8.1f} {values[-1]:>8.1f} {sum(values):>10.0f}"
+        )
+
+    lines.append("")
+    stall_ms = Counter()
+    for stall in stalls:
+        stall_ms[stall.get("callback") or "unknown"] += stall["ms"]
+    lines.append(f"{len(stalls)} stalls over the threshold, {sum(stall_ms.values()):.0f}ms frozen in total")
+    for callback, total_ms in stall_ms.most_common():
+        count = sum(1 for stall in stalls if (stall.get("callback") or "unknown") == callback)
+        lines.append(f"  {callback:<46} {count:>6} stalls {total_ms:>10.0f}ms")
+
+    for stall in sorted(stalls, key=lambda stall: stall["ms"], reverse=True)[:top]:
+        lines.append("")
+        lines.append(f"Stall {stall['ms']:.0f}ms in {stall.get('callback') or 'unknown'} ({stall['samples']} samples)")
+        for entry in stall["stacks"][:1]:
+            # Innermost frames of the most sampled stack
+            for frame in entry["frames"][-6:]:
+                lines.append(f"    {frame}")
+    return "\n".join(lines)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="SuperShop GUI profile log tools")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    summary_parser = subparsers.add_parser("summary", help="Per-callback timings and worst stalls")
+    summary_parser.add_argument("path", nargs="?", default=PROFILE_LOG)
+    summary_parser.add_argument("--top", type=int, default=10, help="Stalls to show in detail")
+    args = parser.parse_args()
+    print(summarize(args.path, args.top))
@@ -1,15 +1,24 @@
 import customtkinter as ctk
-from database import sales_db, inventory_db, member_db
+import threading
+import queue
+from .backend import sales_db, inventory_db, member_db, stock_watcher, reservations, sku_index
+from .cart import Cart
+from . import profiler
 
 CATEGORIES = ["All Categories"] + list(inventory_db.CATEGORY_HASH.keys())
+STOCK_EVENTS_POLL_MS = 250 # How often watcher events are applied to the list
+HOLD_WAIT_SECONDS = 5 # Checkout/closing wait for queued stock holds
 
 class SalesFrame(ctk.CTkFrame):
     def __init__(self, master):
         super().__init__(master, fg_color="transparent")
-        self.cart = []
-        self.member_found = None # This will now store the {'doc':..., 'shard_id':...} dict
-        self.DISCOUNT_THRESHOLD = 1000
-        self.DISCOUNT_PERCENT = 0.05
+        self.cart = Cart() # Lines keyed by product_id; member stored as {'doc':..., 'shard_id':...}
+        self.cart_rows = {} # product_id -> (row frame, label) in the cart list
+        self.stock_labels = {} # product_id -> "Stock" label of the listed row
+        self.stock_events = queue.Queue() # Filled by the watcher threads
+        # Stock holds are placed/released in order by one worker, off the Tk thread
+        self.hold_requests = queue.Queue()
+        threading.Thread(target=self.run_hold_requests, name="stock-holds", daemon=True).start()
         
         # --- Layout (Unchanged) ---
         self.grid_columnconfigure(0, weight=1, minsize=180)
@@ -77,19 +86,51 @@ class SalesFrame(ctk.CTkFrame):
         self.total_label.grid(row=3, column=0, columnspan=2, padx=15, pady=5, sticky="w")
         self.cart_list_frame = ctk.CTkScrollableFrame(self.cart_frame, fg_color="transparent")
         self.cart_list_frame.grid(row=4, column=0, columnspan=2, padx=15, pady=15, sticky="nsew")
+        self.cart_empty_label = ctk.CTkLabel(self.cart_list_frame, text="Cart is empty.")
+        self.cart_empty_label.pack()
         self.process_sale_button = ctk.CTkButton(self.cart_frame, text="Process Payment", command=self.process_sale_callback)
         self.process_sale_button.grid(row=5, column=0, padx=(15, 5), pady=15, sticky="ew")
         self.clear_sale_button = ctk.CTkButton( self.cart_frame, text="Clear Sale", command=self.clear_sale, fg_color="#D32F2F", hover_color="#B71C1C")
         self.clear_sale_button.grid(row=5, column=1, padx=(5, 15), pady=15, sticky="ew")
         self.status_label = ctk.CTkLabel(self.cart_frame, text="", text_color="green")
         self.status_label.grid(row=6, column=0, columnspan=2, padx=15, pady=5)
-        
-        self.apply_filters_callback()
+        # --- Scan entry: a barcode scanner types the code and presses Enter ---
+        self.scan_entry = ctk.CTkEntry(self.cart_frame, placeholder_text="Scan barcode / SKU")
+        self.scan_entry.grid(row=7, column=0, padx=(15, 5), pady=(5, 15), sticky="ew")
+        self.scan_entry.bind("<Return>", self.scan_callback)
+        self.scan_mode_var = ctk.BooleanVar(value=False)
+        self.scan_mode_switch = ctk.CTkSwitch(
+            self.cart_frame, text="Scan mode", variable=self.scan_mode_var, command=self.toggle_scan_mode
+        )
+        self.scan_mode_switch.grid(row=7, column=1, padx=(5, 15), pady=(5, 15))
+        # Barcode map loads off the Tk thread; scans before it is ready fall back to the database
+        threading.Thread(target=self.warm_up_skus, daemon=True).start()
+
+        # Show whatever the local catalog has right away, even if stale
+        self.apply_filters_callback(startup=True)
+
+        # Live stock counts from other tills
+        stock_watcher.add_listener(self.stock_events.put)
+        self.bind("<Destroy>", self.on_destroy, add="+")
+        self.after(STOCK_EVENTS_POLL_MS, self.apply_stock_events)
 
-    def apply_filters_callback(self):
-        # (Unchanged)
+    def show_search_status(self, search_status):
+        """ Warns when some shards could not be searched (or only from an old local copy) """
+        if not search_status["degraded"]:
+            return
+        shards = search_status["shards"]
+        missing = [f"DB{shard_id + 1}" for shard_id, state in sorted(shards.items()) if state in ("unavailable", "error")]
+        stale = [f"DB{shard_id + 1}" for shard_id, state in sorted(shards.items()) if state == "stale"]
+        parts = []
+        if missing: parts.append(f"{', '.join(missing)} unavailable")
+        if stale: parts.append(f"{', '.join(stale)} from local copy")
+        self.status_label.configure(text=f"Partial results: {'; '.join(parts)}", text_color="orange")
+
+    @profiler.timed
+    def apply_filters_callback(self, startup=False):
         for widget in self.product_list_frame.winfo_children():
             widget.destroy()
+        self.stock_labels = {}
         filters = {}
         name = self.name_entry.get()
         if name: filters["name"] = name
@@ -108,7 +149,14 @@ class SalesFrame(ctk.CTkFrame):
             return
         else:
             self.status_label.configure(text="")
-        products = inventory_db.create_product_fragment(filters) 
+        if startup:
+            # Any local snapshot will do; the watcher catches it up
+            products, search_status = inventory_db.create_product_fragment(
+                filters, max_staleness=None, compact=True, with_status=True
+            )
+        else:
+            products, search_status = inventory_db.create_product_fragment(filters, compact=True, with_status=True)
+        self.show_search_status(search_status)
         if not products:
             ctk.CTkLabel(self.product_list_frame, text="No products match filters.").grid(row=0, column=0, padx=10, pady=10)
         for i, product in enumerate(products):
@@ -123,20 +171,64 @@ class SalesFrame(ctk.CTkFrame):
             ctk.CTkLabel(prod_frame, text=product['name'], anchor="w").grid(row=0, column=0, padx=10, pady=5, sticky="ew")
             ctk.CTkLabel(prod_frame, text=brand_display, anchor="w").grid(row=0, column=1, padx=5, pady=5, sticky="ew")
             ctk.CTkLabel(prod_frame, text=f"{product['price']:.2f}", anchor="w").grid(row=0, column=2, padx=5, pady=5, sticky="ew")
-            ctk.CTkLabel(prod_frame, text=product['quantity_in_stock'], anchor="w").grid(row=0, column=3, padx=5, pady=5, sticky="ew")
+            stock_label = ctk.CTkLabel(prod_frame, text=product['quantity_in_stock'], anchor="w")
+            stock_label.grid(row=0, column=3, padx=5, pady=5, sticky="ew")
+            self.stock_labels[str(product["_id"])] = stock_label
             ctk.CTkButton(
                 prod_frame, text="+", width=30, height=20,
                 command=lambda p=product: self.add_to_cart_callback(p)
             ).grid(row=0, column=4, padx=(5, 10), pady=5)
 
+    def apply_stock_events(self):
+        """
+        Runs on the Tk thread: applies queued watcher events to the stock
+        column of the products currently listed, and new prices to the cart.
+        """
+        events = []
+        try:
+            while True:
+                events.append(self.stock_events.get_nowait())
+        except queue.Empty:
+            pass
+        if events:
+            self.apply_events(events) # Only polls that did something show up in the profile
+        self.after(STOCK_EVENTS_POLL_MS, self.apply_stock_events)
+
+    @profiler.timed
+    def apply_events(self, events):
+        for event in events:
+            if event["type"] == "hold_refused":
+                self.apply_hold_refused(event)
+                continue
+            if event["type"] == "product":
+                self.apply_price_change(event)
+                continue
+            label = self.stock_labels.get(event["product_id"])
+            if label is not None:
+                label.configure(text=event["quantity"])
+
+    def apply_price_change(self, event):
+        """ A cart line follows its product's repricing or promotion, so checkout charges what is shown """
+        doc = event["doc"]
+        line = self.cart.reprice(event["product_id"], doc.get("price", 0), doc.get("price_version", 0))
+        if line is None:
+            return
+        self.update_cart_row(line)
+        self.update_totals_ui()
+        self.status_label.configure(text=f"Price updated: {line['name']} now {line['price']:.2f} BDT", text_color="orange")
+
+    def on_destroy(self, event):
+        if event.widget is self:
+            stock_watcher.remove_listener(self.stock_events.put)
+
+    @profiler.timed
     def check_member_callback(self):
-        # (Unchanged)
         phone = self.member_phone_entry.get()
         if not phone:
              self.status_label.configure(text="Enter phone.", text_color="red"); return
         
         member_info = member_db.find_member_by_phone(phone)
-        self.member_found = member_info
+        self.cart.set_member(member_info)
         
         if member_info:
             status_text = f"Member: {member_info['doc']['name']}"
@@ -146,92 +238,198 @@ class SalesFrame(ctk.CTkFrame):
             status_color = "red"
             
         self.status_label.configure(text=status_text, text_color=status_color)
-        self.update_cart_ui()
+        self.update_totals_ui()
+
+    def warm_up_skus(self):
+        try:
+            sku_index.warm_up_skus()
+        except Exception as e:
+            print(f"Could not load barcodes: {e}")
+
+    def toggle_scan_mode(self):
+        """ In scan mode the barcode entry keeps the focus between scans """
+        if self.scan_mode_var.get():
+            self.scan_entry.focus_set()
+
+    @profiler.timed
+    def scan_callback(self, event=None):
+        """ Adds the scanned product straight to the cart: a map lookup, no product search """
+        code = self.scan_entry.get()
+        self.scan_entry.delete(0, "end")
+        if not code.strip():
+            return
+        try:
+            product = sku_index.lookup_sku(code)
+        except Exception as e:
+            self.status_label.configure(text=f"Error: {e}", text_color="red"); return
+        if product is None:
+            self.status_label.configure(text=f"Unknown barcode: {code.strip()}", text_color="red")
+        else:
+            self.add_to_cart_callback(product)
+        if self.scan_mode_var.get():
+            self.scan_entry.focus_set()
 
+    # --- STOCK HOLDS (worker thread) ---
+    def run_hold_requests(self):
+        while True:
+            request = self.hold_requests.get()
+            action = request["action"]
+            try:
+                if action == "reserve":
+                    reservations.reserve(request["cart_id"], request["shard_id"], request["product_id"])
+                elif action == "release":
+                    reservations.release(request["cart_id"], request["shard_id"], request["product_id"], 1)
+                elif action == "release_cart":
+                    reservations.release_cart(request["cart_id"])
+            except ValueError as e:
+                # The unit is not free: the Tk thread takes it back out of the cart
+                self.stock_events.put({"type": "hold_refused", **request, "message": str(e)})
+            except Exception as e:
+                print(f"Could not {action.replace('_', ' ')} stock hold (checked again at checkout / it will expire): {e}")
+            finally:
+                if request.get("done") is not None:
+                    request["done"].set()
+
+    def wait_for_holds(self, timeout=HOLD_WAIT_SECONDS):
+        """ Blocks until the holds queued so far are placed (checkout, closing); False on timeout """
+        done = threading.Event()
+        self.hold_requests.put({"action": "wait", "done": done})
+        return done.wait(timeout)
+
+    def apply_hold_refused(self, event):
+        if event["cart_id"] != self.cart.cart_id or event["product_id"] not in self.cart:
+            return # That sale is already over
+        line, removed = self.cart.decrement(event["product_id"])
+        if removed:
+            self.remove_cart_row(event["product_id"])
+        else:
+            self.update_cart_row(line)
+        self.update_totals_ui()
+        self.status_label.configure(text=f"{event['name']}: {event['message']}", text_color="red")
+
+    @profiler.timed
     def add_to_cart_callback(self, product):
-        # (Unchanged)
-        product_id_str = str(product["_id"])
-        shard_id = product["shard_id"] 
-        for item in self.cart:
-            if item["product_id"] == product_id_str:
-                item["quantity"] += 1
-                self.update_cart_ui()
-                return
-        brand_name = product.get("supplier_name", "N/A")
-        display_name = f"{product['name']} ({brand_name})"
-        cart_item = {
-            "product_id": product_id_str,
-            "shard_id": shard_id,
-            "name": display_name,
-            "price": product["price"],
-            "quantity": 1
-        }
-        self.cart.append(cart_item)
-        self.update_cart_ui()
-
-    # --- THIS FUNCTION IS THE FIX ---
-    def update_cart_ui(self):
-        for widget in self.cart_list_frame.winfo_children(): widget.destroy()
-        subtotal = 0
-        if not self.cart: ctk.CTkLabel(self.cart_list_frame, text="Cart is empty.").pack()
-        
-        for item in self.cart:
-            item_total = item["price"] * item["quantity"]
-            subtotal += item_total
-            item_text = f"{item['name']} (x{item['quantity']}) - {item_total:.2f} BDT"
-            ctk.CTkLabel(self.cart_list_frame, text=item_text).pack(anchor="w", padx=10)
-        
-        discount = 0
-        final_total = subtotal
-        
-        # This is the logic block that fixes your issue
-        if self.member_found and subtotal >= self.DISCOUNT_THRESHOLD:
-            # Case 1: Member found AND total is high enough
-            discount = subtotal * self.DISCOUNT_PERCENT
-            final_total = subtotal - discount
-            self.discount_label.configure(text=f"Discount (5%): -{discount:.2f} BDT", text_color="#1F6AA5")
+        # Hold the unit (in the background), so checkout does not find it gone
+        self.hold_requests.put({
+            "action": "reserve", "cart_id": self.cart.cart_id, "shard_id": product["shard_id"],
+            "product_id": str(product["_id"]), "name": product["name"]
+        })
+        line, is_new = self.cart.add(product)
+        if is_new:
+            self.add_cart_row(line)
         else:
-            # Case 2: EITHER no member OR total is too low
-            discount_needed = self.DISCOUNT_THRESHOLD - subtotal
-            
-            # This line checks if a member is found AND if they still need to spend more
-            discount_text = f"Spend {discount_needed:.2f} BDT more for 5% off" if self.member_found and discount_needed > 0 else "No discount applied."
-            
+            self.update_cart_row(line)
+        self.update_totals_ui()
+
+    @profiler.timed
+    def remove_from_cart_callback(self, product_id):
+        line, removed = self.cart.decrement(product_id)
+        self.hold_requests.put({
+            "action": "release", "cart_id": self.cart.cart_id, "shard_id": line["shard_id"], "product_id": product_id
+        })
+        if removed:
+            self.remove_cart_row(product_id)
+        else:
+            self.update_cart_row(line)
+        self.update_totals_ui()
+
+    # --- CART VIEW: only the changed row is touched ---
+    def _cart_row_text(self, line):
+        return f"{line['name']} (x{line['quantity']}) - {Cart.line_total(line):.2f} BDT"
+
+    def add_cart_row(self, line):
+        if not self.cart_rows:
+            self.cart_empty_label.pack_forget()
+        row = ctk.CTkFrame(self.cart_list_frame, fg_color="transparent")
+        row.pack(anchor="w", fill="x", padx=10)
+        label = ctk.CTkLabel(row, text=self._cart_row_text(line), anchor="w")
+        label.pack(side="left")
+        ctk.CTkButton(
+            row, text="-", width=24, height=20,
+            command=lambda product_id=line["product_id"]: self.remove_from_cart_callback(product_id)
+        ).pack(side="right", padx=(5, 0))
+        self.cart_rows[line["product_id"]] = (row, label)
+
+    def update_cart_row(self, line):
+        self.cart_rows[line["product_id"]][1].configure(text=self._cart_row_text(line))
+
+    def remove_cart_row(self, product_id):
+        row, _ = self.cart_rows.pop(product_id)
+        row.destroy()
+        if not self.cart_rows:
+            self.cart_empty_label.pack()
+
+    def clear_cart_rows(self):
+        for row, _ in self.cart_rows.values():
+            row.destroy()
+        self.cart_rows = {}
+        self.cart_empty_label.pack()
+
+    def update_totals_ui(self):
+        """ Discount and total from the cart's running sums (no pass over the lines) """
+        discount = self.cart.discount
+        if discount:
+            # Member found AND total is high enough
+            self.discount_label.configure(
+                text=f"Discount ({self.cart.discount_percent:.0%}): -{discount:.2f} BDT", text_color="#1F6AA5"
+            )
+        else:
+            # EITHER no member OR total is too low
+            discount_needed = self.cart.amount_to_discount
+            discount_text = f"Spend {discount_needed:.2f} BDT more for {self.cart.discount_percent:.0%} off" \
+                if self.cart.member and discount_needed > 0 else "No discount applied."
             self.discount_label.configure(text=discount_text, text_color="gray")
         
-        self.total_label.configure(text=f"Total: {final_total:.2f} BDT")
-    # --- END OF FIX ---
+        self.total_label.configure(text=f"Total: {self.cart.total:.2f} BDT")
 
+    @profiler.timed
     def process_sale_callback(self):
-        # (Unchanged)
         self.status_label.configure(text="Processing...", text_color="orange"); self.update_idletasks()
         
-        member_info_for_backend = self.member_found 
+        member_info_for_backend = self.cart.member
         
         if not self.cart: self.status_label.configure(text="Cart empty.", text_color="red"); return
         
-        subtotal = sum(item["price"] * item["quantity"] for item in self.cart)
-        discount_applied = 0
-        if self.member_found and subtotal >= self.DISCOUNT_THRESHOLD: 
-            discount_applied = subtotal * self.DISCOUNT_PERCENT
-
-        items_sold_db = [
-            {"product_id": item["product_id"], "quantity": item["quantity"], "shard_id": item["shard_id"]} 
-            for item in self.cart
-        ]
+        # The sale converts the cart's holds: let the queued ones land first
+        if not self.wait_for_holds():
+            print("Stock holds still pending; checkout checks stock itself.")
+        discount_applied = self.cart.discount
+        items_sold_db = self.cart.items_for_sale()
         try:
-            transaction_id = sales_db.record_sale(member_info_for_backend, items_sold_db, discount_applied)
+            transaction_id = sales_db.record_sale(
+                member_info_for_backend, items_sold_db, discount_applied, cart_id=self.cart.cart_id
+            )
             
             if transaction_id:
-                self.status_label.configure(text=f"Sale complete!", text_color="green"); self.clear_sale()
+                self.status_label.configure(text=f"Sale complete!", text_color="green"); self.clear_sale(sold=True)
             else:
                 self.status_label.configure(text="Sale Failed (See console).", text_color="red")
+        except ValueError as e:
+            self.status_label.configure(text=f"Sale refused: {e}", text_color="red")
         except Exception as e:
             self.status_label.configure(text=f"Error: {e}", text_color="red")
 
-    def clear_sale(self):
-        # (Unchanged)
-        self.cart = []; self.member_found = None
+    def release_holds(self, wait=False):
+        """
+        Gives back the stock this cart holds (the sale was cleared or the
+        till closed); queued after any holds still being placed. wait=True
+        blocks until done (before the connection is closed).
+        """
+        if not self.cart:
+            return
+        self.hold_requests.put({"action": "release_cart", "cart_id": self.cart.cart_id})
+        if wait:
+            self.wait_for_holds()
+
+    @profiler.timed
+    def clear_sale(self, sold=False):
+        if not sold: # A completed sale already converted its holds
+            self.release_holds()
+        self.cart.clear()
         self.member_phone_entry.delete(0, "end")
         self.status_label.configure(text="Sale cleared.", text_color="gray")
-        self.update_cart_ui(); self.apply_filters_callback()
\ No newline at end of file
+        self.clear_cart_rows()
+        self.update_totals_ui()
+        # The watcher pushes the new stock counts; only re-search without it
+        if not stock_watcher.is_running():
+            self.apply_filters_callback()
\ No newline at end of file
@@ -1,19 +1,20 @@
-from gui.app import App
-from database.db_connector import db_connection
+from gui import backend
 
 if __name__ == "__main__":
-    # This checks if the db_connection was successful
-    if db_connection:
-        
-        # --- THESE ARE THE MISSING LINES ---
+    # This checks if the database (or the backend service) is reachable
+    if backend.is_available():
+        from gui.app import App
+
         # This creates the application window
         app = App()
-        
+
         # This tells the window to open and wait for user input
         app.mainloop()
-        # --- END OF MISSING LINES ---
-        
+
+    elif backend.BACKEND_URL:
+        print("Application cannot start: Backend service is not available.")
+        print(f"Please check that service/server.py is running at {backend.BACKEND_URL}.")
     else:
         # If db_connector.py failed, don't start the app.
         print("Application cannot start: Failed to connect to database.")
-        print("Please check your .env file and ensure MongoDB is running.")
\ No newline at end of file
+        print("Please check your .env file and ensure MongoDB is running.")
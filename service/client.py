@@ -0,0 +1,213 @@
+from bson import json_util
+import urllib.request
+import urllib.error
+import threading
+import socket
+import os
+
+# --- THIN CLIENT ---
+# Same function names as the 'database' modules, but every call goes to the
+# backend service (service/server.py). Used by the GUI when
+# SUPERSHOP_BACKEND_URL is set.
+BACKEND_URL = os.getenv("SUPERSHOP_BACKEND_URL", "http://127.0.0.1:8765").rstrip("/")
+RPC_TIMEOUT_SECONDS = 30
+EVENTS_TIMEOUT_SECONDS = 35 # A bit longer than the server's long-poll wait
+TILL_ID = os.getenv("TILL_ID") or socket.gethostname() # Sent with sales; the backend's own id is not this till's
+
+# Errors the backend may report that the GUI already knows how to show
+_ERROR_TYPES = {"ValueError": ValueError, "ConnectionError": ConnectionError, "ShardUnavailable": ConnectionError}
+
+
+def _request(path, payload=None, timeout=RPC_TIMEOUT_SECONDS):
+    data = json_util.dumps(payload).encode("utf-8") if payload is not None else None
+    request = urllib.request.Request(
+        BACKEND_URL + path, data=data,
+        headers={"Content-Type": "application/json"} if data is not None else {}
+    )
+    try:
+        with urllib.request.urlopen(request, timeout=timeout) as response:
+            return json_util.loads(response.read())
+    except urllib.error.HTTPError as e:
+        body = json_util.loads(e.read() or b"{}")
+        error_type = _ERROR_TYPES.get(body.get("error_type"), RuntimeError)
+        raise error_type(body.get("error", f"Backend error {e.code}")) from None
+    except urllib.error.URLError as e:
+        raise ConnectionError(f"Backend not reachable at {BACKEND_URL}: {e.reason}") from None
+
+def _call(name, *args, **kwargs):
+    return _request(f"/rpc/{name}", {"args": list(args), "kwargs": kwargs})["result"]
+
+def ping():
+    """ True if the backend is up and connected to MongoDB """
+    try:
+        return _request("/health", timeout=5).get("status") == "ok"
+    except ConnectionError as e:
+        print(e)
+        return False
+
+
+# --- CONFIG ---
+_config = None
+
+def _get_config():
+    global _config
+    if _config is None:
+        _config = _request("/config")
+    return _config
+
+def __getattr__(name):
+    # CATEGORY_HASH is read from the backend the first time it is needed
+    if name == "CATEGORY_HASH":
+        return _get_config()["CATEGORY_HASH"]
+    raise AttributeError(name)
+
+
+# --- INVENTORY ---
+def create_product_fragment(filters={}, compact=False, with_status=False, **kwargs):
+    result = _call("create_product_fragment", filters, with_status=with_status, **kwargs)
+    docs, status = result if with_status else (result, None)
+    if compact:
+        # Compacted here: the batch itself does not travel as JSON
+        from database.product_rows import ProductBatch
+        docs = ProductBatch.from_docs(docs)
+    if with_status:
+        # JSON object keys come back as strings
+        status["shards"] = {int(shard_id): state for shard_id, state in status["shards"].items()}
+        return docs, status
+    return docs
+
+def add_product(name, price, category, supplier_name, initial_stock, sku=None):
+    return _call("add_product", name, price, category, supplier_name, initial_stock, sku)
+
+def add_stock_to_product(product_name, supplier_name, category, amount_to_add):
+    return _call("add_stock_to_product", product_name, supplier_name, category, amount_to_add)
+
+# --- MEMBERS ---
+def add_member(name, phone, email):
+    return _call("add_member", name, phone, email)
+
+def find_member_by_phone(phone):
+    return _call("find_member_by_phone", phone)
+
+# --- SALES ---
+def record_sale(member_info, items_sold, discount_applied=0, till_id=None, cart_id=None):
+    return _call("record_sale", member_info, items_sold, discount_applied, till_id or TILL_ID, cart_id)
+
+def get_temp_sales(fragment, category=None, limit=100):
+    return _call("get_temp_sales", fragment, category, limit)
+
+# --- SKU / BARCODE LOOKUP ---
+# Like database.sku_index, the till keeps its own barcode map (warmed from
+# the backend's, kept current from product events) so a scan is local.
+_skus = {} # sku -> product entry
+_skus_lock = threading.Lock()
+
+def warm_up_skus():
+    entries = _call("get_sku_map")
+    with _skus_lock:
+        _skus.clear()
+        for entry in entries:
+            _skus[entry.pop("sku")] = entry
+    return len(entries)
+
+def lookup_sku(code):
+    sku = "".join(str(code).split())
+    with _skus_lock:
+        entry = _skus.get(sku)
+    if entry is None:
+        entry = _call("lookup_sku", sku)
+        if entry is not None:
+            with _skus_lock:
+                _skus[sku] = entry
+    return entry
+
+def _apply_sku_event(event):
+    if event["type"] != "product":
+        return
+    doc = event["doc"]
+    with _skus_lock:
+        for sku, entry in list(_skus.items()):
+            if entry["_id"] == doc["_id"]:
+                del _skus[sku]
+                if doc.get("sku"):
+                    _skus[doc["sku"]] = dict(entry, shard_id=event["shard_id"], name=doc.get("name"),
+                                             price=doc.get("price", entry["price"]),
+                                             price_version=doc.get("price_version", 0))
+                return
+
+# --- STOCK RESERVATIONS ---
+def reserve(cart_id, shard_id, product_id, quantity=1):
+    return _call("reserve", cart_id, shard_id, product_id, quantity)
+
+def release(cart_id, shard_id, product_id, quantity=None):
+    return _call("release", cart_id, shard_id, product_id, quantity)
+
+def release_cart(cart_id):
+    return _call("release_cart", cart_id)
+
+# --- PRICING ---
+def reprice(percent=None, amount=None, set_price=None, category=None, product_ids=None, brand=None):
+    return _call("reprice", percent, amount, set_price, category, product_ids, brand)
+
+def create_promotion(name, ends_at, percent_off=None, amount_off=None, starts_at=None,
+                     category=None, product_ids=None, brand=None):
+    return _call("create_promotion", name, ends_at, percent_off, amount_off, starts_at, category, product_ids, brand)
+
+def end_promotion(promotion_id):
+    return _call("end_promotion", promotion_id)
+
+# --- FORECASTING ---
+def get_low_stock(limit=50):
+    return _call("get_low_stock", limit)
+
+
+# --- LIVE STOCK EVENTS ---
+# Mirrors database.stock_watcher: listeners get the backend's watcher
+# events, fetched with a long-poll on /events.
+_listeners = []
+_listeners_lock = threading.Lock()
+_events_thread = None
+_stop = threading.Event()
+
+def add_listener(callback):
+    with _listeners_lock:
+        _listeners.append(callback)
+
+def remove_listener(callback):
+    with _listeners_lock:
+        if callback in _listeners:
+            _listeners.remove(callback)
+
+def _follow_events():
+    since = -1 # First ask only for the current position: events from now on
+    while not _stop.is_set():
+        try:
+            feed = _request(f"/events?since={since}", timeout=EVENTS_TIMEOUT_SECONDS)
+        except Exception as e:
+            print(f"Lost backend event feed: {e}")
+            _stop.wait(5)
+            continue
+        with _listeners_lock:
+            listeners = list(_listeners)
+        for item in feed["events"]:
+            _apply_sku_event(item["event"])
+            for callback in listeners:
+                try:
+                    callback(item["event"])
+                except Exception as e:
+                    print(f"Error in stock listener: {e}")
+        since = feed["next"]
+
+def start():
+    global _events_thread
+    if is_running():
+        return
+    _stop.clear()
+    _events_thread = threading.Thread(target=_follow_events, name="backend-events", daemon=True)
+    _events_thread.start()
+
+def stop():
+    _stop.set()
+
+def is_running():
+    return _events_thread is not None and _events_thread.is_alive() and not _stop.is_set()
@@ -0,0 +1,149 @@
+from database.db_connector import db_connection
+from database import inventory_db, member_db, sales_db, stock_watcher, supplier_cache, forecasting
+from database import pricing, reservations, shard_health, sku_index
+from bson import json_util
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlparse, parse_qs
+from collections import deque
+import argparse
+import threading
+import os
+
+# --- POS BACKEND SERVICE ---
+# Runs the 'database' package once for the whole shop: one MongoClient
+# (one connection pool), one local catalog kept live by the stock watcher,
+# shared by every till. Tills talk to it over loopback HTTP with JSON
+# (bson.json_util, so ObjectIds and datetimes survive the trip).
+#
+#   python -m service.server --port 8765
+#   SUPERSHOP_BACKEND_URL=http://127.0.0.1:8765 python main.py
+DEFAULT_HOST = "127.0.0.1"
+DEFAULT_PORT = int(os.getenv("SUPERSHOP_BACKEND_PORT", "8765"))
+EVENT_BUFFER_SIZE = 5000 # Stock events kept for tills that fall behind
+EVENT_WAIT_SECONDS = 25 # Long-poll timeout for /events
+
+# Functions tills may call: name -> callable
+RPC_FUNCTIONS = {
+    "create_product_fragment": inventory_db.create_product_fragment,
+    "add_product": inventory_db.add_product,
+    "add_stock_to_product": inventory_db.add_stock_to_product,
+    "find_member_by_phone": member_db.find_member_by_phone,
+    "add_member": member_db.add_member,
+    "record_sale": sales_db.record_sale,
+    "get_temp_sales": sales_db.get_temp_sales,
+    "get_low_stock": forecasting.get_low_stock,
+    "reserve": reservations.reserve,
+    "release": reservations.release,
+    "release_cart": reservations.release_cart,
+    "lookup_sku": sku_index.lookup_sku,
+    "get_sku_map": sku_index.get_sku_map,
+    "reprice": pricing.reprice,
+    "create_promotion": pricing.create_promotion,
+    "end_promotion": pricing.end_promotion,
+}
+
+
+# --- STOCK EVENT FEED ---
+class EventFeed:
+    """ Numbered ring buffer of watcher events that tills long-poll """
+    def __init__(self, size=EVENT_BUFFER_SIZE):
+        self.events = deque(maxlen=size)
+        self.next_seq = 0
+        self.cond = threading.Condition()
+
+    def publish(self, event):
+        with self.cond:
+            self.events.append((self.next_seq, event))
+            self.next_seq += 1
+            self.cond.notify_all()
+
+    def read(self, since, timeout=EVENT_WAIT_SECONDS):
+        """
+        Events with seq >= since (waits up to 'timeout' for new ones).
+        since < 0 returns no events, just the next seq to ask for.
+        """
+        with self.cond:
+            if since < 0:
+                return {"next": self.next_seq, "events": []}
+            if since >= self.next_seq:
+                self.cond.wait(timeout)
+            events = [{"seq": seq, "event": event} for seq, event in self.events if seq >= since]
+            return {"next": self.next_seq, "events": events}
+
+event_feed = EventFeed()
+
+
+class BackendHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def _send_json(self, status, payload):
+        body = json_util.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        if url.path == "/health":
+            shards = {f"DB{shard_id + 1}": state for shard_id, state in shard_health.status().items()}
+            self._send_json(200, {"status": "ok" if db_connection.client else "no-database", "shards": shards})
+        elif url.path == "/config":
+            self._send_json(200, {"CATEGORY_HASH": inventory_db.CATEGORY_HASH})
+        elif url.path == "/events":
+            since = int(parse_qs(url.query).get("since", ["0"])[0])
+            self._send_json(200, event_feed.read(since))
+        else:
+            self._send_json(404, {"error": f"Unknown path {url.path}"})
+
+    def do_POST(self):
+        url = urlparse(self.path)
+        name = url.path.removeprefix("/rpc/")
+        func = RPC_FUNCTIONS.get(name)
+        if not url.path.startswith("/rpc/") or func is None:
+            self._send_json(404, {"error": f"Unknown function {name}"})
+            return
+        try:
+            length = int(self.headers.get("Content-Length", 0))
+            request = json_util.loads(self.rfile.read(length) or b"{}")
+            result = func(*request.get("args", []), **request.get("kwargs", {}))
+        except Exception as e:
+            print(f"Error in {name}: {e}")
+            self._send_json(500, {"error": str(e), "error_type": type(e).__name__})
+            return
+        self._send_json(200, {"result": result})
+
+    def log_message(self, format, *args):
+        pass # One line per request is too noisy for a shop's worth of tills
+
+
+def serve(host=DEFAULT_HOST, port=DEFAULT_PORT):
+    stock_watcher.add_listener(event_feed.publish)
+    stock_watcher.start()
+    for shard_id in range(inventory_db.NUM_INVENTORY_SHARDS):
+        try:
+            supplier_cache.warm_up(shard_id)
+        except Exception as e:
+            print(f"Warning: Could not warm supplier cache for Shard DB{shard_id + 1}: {e}")
+    sku_index.warm_up_skus()
+    pricing.start_scheduler()
+    server = ThreadingHTTPServer((host, port), BackendHandler)
+    server.daemon_threads = True
+    print(f"SuperShop backend listening on http://{host}:{port}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        print("Shutting down backend...")
+    finally:
+        server.server_close()
+        stock_watcher.stop()
+        db_connection.close_connection()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="SuperShop POS backend service")
+    parser.add_argument("--host", default=DEFAULT_HOST, help="Bind address (keep it on loopback)")
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT)
+    args = parser.parse_args()
+    serve(args.host, args.port)
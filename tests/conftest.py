@@ -0,0 +1,21 @@
+import importlib
+import pytest
+
+# database.* modules connect to MongoDB when imported (db_connector exits if
+# it cannot), so tests that need one only run where the app itself can start.
+_unavailable = {}
+
+
+@pytest.fixture(scope="session")
+def database_module():
+    def load(name):
+        pytest.importorskip("pymongo")
+        pytest.importorskip("dotenv")
+        if "reason" in _unavailable:
+            pytest.skip(_unavailable["reason"])
+        try:
+            return importlib.import_module(f"database.{name}")
+        except (SystemExit, ValueError, ConnectionError) as e:
+            _unavailable["reason"] = f"database.{name} needs a reachable MongoDB ({e or 'connection failed'})"
+            pytest.skip(_unavailable["reason"])
+    return load
@@ -0,0 +1,94 @@
+import pytest
+
+from gui.cart import Cart
+
+
+def _product(product_id, price, price_version=0):
+    return {"_id": product_id, "shard_id": 0, "name": f"Item {product_id}", "supplier_name": "Acme",
+            "price": price, "price_version": price_version}
+
+
+def test_running_subtotal_does_not_drift():
+    cart = Cart()
+    for _ in range(10):
+        cart.add(_product("a", 0.1))
+    assert cart.subtotal == 1.0
+    for _ in range(10):
+        cart.decrement("a")
+    assert cart.subtotal == 0
+    assert len(cart) == 0
+
+
+def test_add_returns_line_and_whether_it_is_new():
+    cart = Cart()
+    line, is_new = cart.add(_product("a", 19.99), 2)
+    assert is_new and line["quantity"] == 2
+    assert line["name"] == "Item a (Acme)"
+    line, is_new = cart.add(_product("a", 19.99))
+    assert not is_new and line["quantity"] == 3
+    assert cart.subtotal == pytest.approx(59.97)
+
+
+def test_decrement_clamps_and_drops_the_line_at_zero():
+    cart = Cart()
+    cart.add(_product("a", 5.25), 2)
+    cart.add(_product("b", 1.10))
+    line, removed = cart.decrement("a", 5)
+    assert removed and line["quantity"] == 0
+    assert "a" not in cart
+    assert cart.subtotal == pytest.approx(1.10)
+
+
+def test_remove_takes_the_whole_line_off_the_subtotal():
+    cart = Cart()
+    cart.add(_product("a", 3.33), 3)
+    cart.add(_product("b", 0.01))
+    cart.remove("a")
+    assert cart.subtotal == 0.01
+
+
+def test_reprice_only_moves_to_a_newer_version():
+    cart = Cart()
+    cart.add(_product("a", 10.00, price_version=2), 3)
+    assert cart.reprice("a", 8.50, 2) is None
+    assert cart.reprice("a", 8.50, 1) is None
+    assert cart.reprice("missing", 1.00, 9) is None
+    line = cart.reprice("a", 8.50, 3)
+    assert line["price"] == 8.50 and line["price_version"] == 3
+    assert cart.subtotal == 25.50
+
+
+def test_member_discount_starts_at_the_threshold():
+    cart = Cart(discount_threshold=100, discount_percent=0.05)
+    cart.add(_product("a", 99.99))
+    cart.set_member({"doc": {}, "shard_id": 0})
+    assert cart.discount == 0
+    assert cart.amount_to_discount == pytest.approx(0.01)
+    cart.add(_product("b", 0.01))
+    assert cart.discount == pytest.approx(5.0)
+    assert cart.total == pytest.approx(95.0)
+    assert cart.amount_to_discount == 0
+
+
+def test_no_discount_without_a_member():
+    cart = Cart(discount_threshold=100)
+    cart.add(_product("a", 500))
+    assert cart.discount == 0 and cart.total == 500
+
+
+def test_clear_starts_a_new_cart():
+    cart = Cart()
+    cart_id = cart.cart_id
+    cart.add(_product("a", 2.00))
+    cart.set_member({"doc": {}, "shard_id": 1})
+    cart.clear()
+    assert len(cart) == 0 and cart.member is None and cart.subtotal == 0
+    assert cart.cart_id != cart_id
+
+
+def test_items_for_sale_keeps_the_price_snapshot():
+    cart = Cart()
+    cart.add(_product("a", 4.00, price_version=7), 2)
+    assert cart.items_for_sale() == [
+        {"product_id": "a", "quantity": 2, "shard_id": 0, "price": 4.00, "price_version": 7}
+    ]
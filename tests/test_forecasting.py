@@ -0,0 +1,58 @@
+import pytest
+
+np = pytest.importorskip("numpy")
+
+
+@pytest.fixture(scope="module")
+def forecasting(database_module):
+    return database_module("forecasting")
+
+
+def _stock(quantities):
+    count = len(quantities)
+    return {
+        "product_id": np.array([bytes([i]) * 12 for i in range(count)], dtype="S12"),
+        "name": np.array([f"p{i}" for i in range(count)], dtype=object),
+        "category": np.array(["c"] * count, dtype=object),
+        "shard_id": np.zeros(count, dtype=np.int64),
+        "quantity": np.array(quantities, dtype=np.int64),
+    }
+
+
+def _history(rows):
+    """ rows: (stock index, day index, units) """
+    ids = np.array([bytes([i]) * 12 for i, _, _ in rows], dtype="S12")
+    return ids, np.array([d for _, d, _ in rows], dtype=np.int64), np.array([u for _, _, u in rows], dtype=float)
+
+
+def test_velocity_takes_the_faster_of_the_two_windows(forecasting):
+    # Product 0 sells 2/day all month; product 1 only sold 14 units in the last week
+    rows = [(0, day, 2) for day in range(28)] + [(1, 27, 14)]
+    result = forecasting.forecast(_stock([100, 100]), _history(rows), days=28, short_window=7)
+    assert result["velocity"][0] == pytest.approx(2.0)
+    assert result["velocity"][1] == pytest.approx(2.0)
+    assert result["days_of_cover"][0] == pytest.approx(50.0)
+
+
+def test_sold_out_has_no_cover_and_unsold_has_infinite_cover(forecasting):
+    result = forecasting.forecast(_stock([0, 10]), _history([]), days=28, short_window=7)
+    assert result["days_of_cover"][0] == 0
+    assert np.isinf(result["days_of_cover"][1])
+    assert list(result["low_stock"]) == [True, False]
+    assert list(result["reorder_qty"]) == [0, 0]
+
+
+def test_history_outside_the_window_or_for_unknown_products_is_ignored(forecasting):
+    history = _history([(0, -1, 50), (0, 28, 50), (5, 3, 50), (0, 27, 7)])
+    result = forecasting.forecast(_stock([10]), history, days=28, short_window=7)
+    assert result["velocity"][0] == pytest.approx(1.0)
+
+
+def test_reorder_quantity_and_urgency_order(forecasting):
+    rows = [(i, day, units) for i, units in enumerate([1, 4, 4]) for day in range(28)]
+    result = forecasting.forecast(_stock([100, 8, 4]), _history(rows), days=28, short_window=7)
+    assert list(result["order"]) == [2, 1, 0]
+    assert list(result["low_stock"]) == [False, True, True]
+    assert result["reorder_qty"][2] == forecasting.TARGET_COVER_DAYS * 4 - 4
+    entries = forecasting.reorder_list(result, limit=1)
+    assert [entry["name"] for entry in entries] == ["p2"]
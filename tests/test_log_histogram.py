@@ -0,0 +1,50 @@
+import random
+import pytest
+
+
+@pytest.fixture(scope="module")
+def reporting(database_module):
+    return database_module("reporting")
+
+
+def _exact_quantile(values, q):
+    return sorted(values)[int(q * (len(values) - 1))]
+
+
+def test_empty_histogram_has_no_quantiles(reporting):
+    assert reporting.LogHistogram().quantile(0.5) is None
+
+
+def test_quantiles_are_within_the_relative_accuracy(reporting):
+    rng = random.Random(7)
+    values = [rng.lognormvariate(3, 1.5) for _ in range(5000)]
+    histogram = reporting.LogHistogram(relative_accuracy=0.01)
+    for value in values:
+        histogram.add(value)
+    for q in (0, 0.1, 0.5, 0.9, 0.99, 1):
+        exact = _exact_quantile(values, q)
+        assert histogram.quantile(q) == pytest.approx(exact, rel=0.01)
+
+
+def test_zero_and_negative_values_count_as_zero(reporting):
+    histogram = reporting.LogHistogram()
+    histogram.add(0)
+    histogram.add(-5)
+    histogram.add(100)
+    assert histogram.zero_count == 2 and histogram.count == 3
+    assert histogram.quantile(0.5) == 0.0
+    assert histogram.quantile(1) == pytest.approx(100, rel=0.01)
+
+
+def test_merge_equals_building_one_histogram(reporting):
+    rng = random.Random(11)
+    values = [rng.uniform(-10, 1000) for _ in range(2000)]
+    whole = reporting.LogHistogram()
+    left, right = reporting.LogHistogram(), reporting.LogHistogram()
+    for i, value in enumerate(values):
+        whole.add(value)
+        (left if i % 2 else right).add(value)
+    left.merge(right)
+    assert left.buckets == whole.buckets
+    assert left.zero_count == whole.zero_count and left.count == whole.count
+    assert left.quantile(0.95) == whole.quantile(0.95)
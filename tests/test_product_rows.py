@@ -0,0 +1,73 @@
+import pytest
+
+bson = pytest.importorskip("bson")
+from database.product_rows import ProductBatch, ROW_FIELDS
+
+
+def _docs():
+    ids = [bson.ObjectId() for _ in range(3)]
+    return ids, [
+        {"_id": ids[0], "name": "banana", "price": 1.5, "price_version": 2, "category": "Fruit",
+         "quantity_in_stock": 40, "supplier_name": "Dole", "shard_id": 0},
+        {"_id": str(ids[1]), "name": "Apple", "price": 2.25, "category": "Fruit",
+         "quantity_in_stock": 5, "supplier_name": "Dole", "shard_id": 1},
+        {"_id": ids[2], "name": "cherry", "price": None, "category": None, "shard_id": 2},
+    ]
+
+
+def test_rows_read_like_the_documents():
+    ids, docs = _docs()
+    batch = ProductBatch.from_docs(docs)
+    assert len(batch) == 3
+    row = batch[1]
+    assert row["_id"] == ids[1]
+    assert row["name"] == "Apple" and row["price"] == 2.25 and row["shard_id"] == 1
+    assert row["price_version"] == 0
+    assert row.get("missing", "x") == "x"
+    with pytest.raises(KeyError):
+        row["missing"]
+    assert row.keys() == ROW_FIELDS
+
+
+def test_missing_fields_get_defaults():
+    _, docs = _docs()
+    row = ProductBatch.from_docs(docs)[-1]
+    assert row["price"] == 0.0 and row["quantity_in_stock"] == 0
+    assert row["category"] == "" and row["supplier_name"] == "N/A"
+
+
+def test_index_bounds():
+    _, docs = _docs()
+    batch = ProductBatch.from_docs(docs)
+    assert batch[-3]["name"] == "banana"
+    with pytest.raises(IndexError):
+        batch[3]
+    with pytest.raises(IndexError):
+        batch[-4]
+
+
+def test_supplier_names_are_shared():
+    _, docs = _docs()
+    batch = ProductBatch.from_docs(docs)
+    assert batch[0]["supplier_name"] is batch[1]["supplier_name"]
+
+
+def test_sorted_by_name_ignores_case():
+    _, docs = _docs()
+    batch = ProductBatch.from_docs(docs)
+    assert [row["name"] for row in batch.sorted_by("name")] == ["Apple", "banana", "cherry"]
+    assert [row["price"] for row in batch.sorted_by("price", reverse=True)] == [2.25, 1.5, 0.0]
+
+
+def test_where_and_take_keep_columns_aligned():
+    ids, docs = _docs()
+    batch = ProductBatch.from_docs(docs)
+    low = batch.where("quantity_in_stock", lambda quantity: quantity < 10)
+    assert [row["_id"] for row in low] == [ids[1], ids[2]]
+    assert [row["shard_id"] for row in batch.take([2, 0])] == [2, 0]
+
+
+def test_to_dicts_round_trip():
+    ids, docs = _docs()
+    first = ProductBatch.from_docs(docs).to_dicts()[0]
+    assert first == {**docs[0], "_id": ids[0]}
@@ -0,0 +1,73 @@
+import pytest
+
+
+@pytest.fixture
+def shard_health(database_module, monkeypatch):
+    module = database_module("shard_health")
+    monkeypatch.setattr(module, "_start_prober", lambda: None) # No background pings to the real shards
+    return module
+
+
+@pytest.fixture
+def clock(shard_health, monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(shard_health.time, "time", lambda: now[0])
+    return now
+
+
+def _open(breaker, shard_health):
+    for _ in range(shard_health.FAILURE_THRESHOLD):
+        breaker.record_failure(ConnectionError("down"))
+
+
+def test_opens_after_the_failure_threshold(shard_health, clock):
+    breaker = shard_health.CircuitBreaker(0)
+    for _ in range(shard_health.FAILURE_THRESHOLD - 1):
+        breaker.record_failure()
+    assert breaker.state == "closed" and breaker.allow()
+    breaker.record_failure(ConnectionError("down"))
+    assert breaker.state == "open" and not breaker.allow()
+    assert breaker.last_error == "down"
+
+
+def test_success_resets_the_failure_count(shard_health, clock):
+    breaker = shard_health.CircuitBreaker(0)
+    for _ in range(shard_health.FAILURE_THRESHOLD - 1):
+        breaker.record_failure()
+    breaker.record_success()
+    breaker.record_failure()
+    assert breaker.state == "closed"
+
+
+def test_half_open_lets_one_trial_through(shard_health, clock):
+    breaker = shard_health.CircuitBreaker(1)
+    _open(breaker, shard_health)
+    clock[0] += shard_health.OPEN_SECONDS
+    assert breaker.allow()
+    assert breaker.state == "half_open"
+    assert not breaker.allow()
+    breaker.record_success()
+    assert breaker.state == "closed" and breaker.allow()
+
+
+def test_failed_trial_reopens_with_a_longer_wait(shard_health, clock):
+    breaker = shard_health.CircuitBreaker(2)
+    _open(breaker, shard_health)
+    for expected in (2, 4, 8):
+        clock[0] = breaker.retry_at
+        assert breaker.allow()
+        breaker.record_failure()
+        assert breaker.state == "open"
+        assert breaker.open_seconds == min(shard_health.OPEN_SECONDS * expected, shard_health.MAX_OPEN_SECONDS)
+        assert breaker.retry_at == clock[0] + breaker.open_seconds
+    breaker.record_success()
+    assert breaker.open_seconds == shard_health.OPEN_SECONDS
+
+
+def test_lost_trial_frees_the_slot(shard_health, clock):
+    breaker = shard_health.CircuitBreaker(0)
+    _open(breaker, shard_health)
+    clock[0] = breaker.retry_at
+    assert breaker.allow()
+    clock[0] += shard_health.OPEN_SECONDS + 1
+    assert breaker.allow()
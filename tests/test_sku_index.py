@@ -0,0 +1,17 @@
+import pytest
+
+
+@pytest.fixture(scope="module")
+def sku_index(database_module):
+    return database_module("sku_index")
+
+
+@pytest.mark.parametrize("code, expected", [
+    ("4006381333931", "4006381333931"),
+    (" 4006381333931\n", "4006381333931"),
+    ("400 638\t1333931", "4006381333931"),
+    (4006381333931, "4006381333931"),
+    ("ab-12", "ab-12"),
+])
+def test_normalize_sku_only_strips_whitespace(sku_index, code, expected):
+    assert sku_index.normalize_sku(code) == expected
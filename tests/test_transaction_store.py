@@ -0,0 +1,38 @@
+from datetime import datetime, timedelta, timezone
+import pytest
+
+
+@pytest.fixture(scope="module")
+def transaction_store(database_module):
+    return database_module("transaction_store")
+
+
+def test_partition_names_round_trip(transaction_store):
+    name = transaction_store.partition_name(datetime(2026, 3, 31, 23, 59))
+    assert name == "transactions_2026_03"
+    assert transaction_store._partition_month(name) == (2026, 3)
+    assert transaction_store._partition_month("transactions") is None
+    assert transaction_store._partition_month("transactions_2026_3") is None
+
+
+def test_december_partition_ends_in_january(transaction_store):
+    start, end = transaction_store._partition_range("transactions_2025_12")
+    assert (start, end) == (datetime(2025, 12, 1), datetime(2026, 1, 1))
+
+
+def test_overlap_uses_half_open_ranges(transaction_store):
+    name = "transactions_2026_03"
+    overlaps = transaction_store._overlaps
+    assert overlaps(name, None, None)
+    assert overlaps(name, datetime(2026, 3, 31), datetime(2026, 4, 2))
+    assert not overlaps(name, datetime(2026, 4, 1), None)
+    assert not overlaps(name, None, datetime(2026, 3, 1))
+    assert overlaps(name, None, datetime(2026, 3, 1, 0, 0, 1))
+
+
+def test_overlap_compares_aware_datetimes_as_utc(transaction_store):
+    name = "transactions_2026_03"
+    plus_six = timezone(timedelta(hours=6))
+    # 05:00 on 1 April at +06:00 is still 31 March in UTC
+    assert transaction_store._overlaps(name, datetime(2026, 4, 1, 5, tzinfo=plus_six), None)
+    assert not transaction_store._overlaps(name, datetime(2026, 4, 1, 7, tzinfo=plus_six), None)